@@ -0,0 +1,246 @@
+import sys
+import json
+import time
+import argparse
+import itertools
+import contextlib
+import numpy as np
+from template_loader import load_templates
+from synthetic import generate_board
+from session_recorder import SessionReader
+from matcher_profile import MATCHER_PROFILE, DEFAULT_CONFIG, normalize_config, create_matcher, save_matcher_profile
+
+WEIGHT_TOTAL = sum(DEFAULT_CONFIG['weights'])  # 权重之和固定为默认配置的总和，置信度阈值保持原有含义
+METRICS = ("ssim", "hist", "tmpl")  # 权重顺序对应的特征
+
+
+def synthetic_boards(templates, count, cols=10, rows=14, seed=0, noise=6.0):
+    """
+    用模板合成带真实标签的棋盘（噪声、亮度和缩放扰动见 synthetic.generate_board）
+    :param count: 棋盘数，第 i 个棋盘的随机种子为 seed + i
+    :param noise: 高斯噪声标准差（加大后更能区分各配置的准确率）
+    :return: [{'blocks': 方块 (N, H, W, 3), 'names': 真实类型 (N,), 'scale': 模板缩放比例}, ...]
+    """
+    h, w = templates.size
+    boards = []
+    for i in range(count):
+        frame, cells = generate_board(templates, cols, rows, block_w=w, block_h=h, noise=noise, seed=seed + i)
+        blocks = np.stack([frame[c['y']:c['y'] + h, c['x']:c['x'] + w] for c in cells])
+        boards.append({'blocks': blocks, 'names': np.array([c['name'] for c in cells]), 'scale': templates.scale})
+    return boards
+
+
+def recorded_boards(path, limit=None):
+    """
+    从会话文件（main.py --record）取出带标签的棋盘：识别结果变化的帧按录制的方块坐标切片，
+    标签为录制时的识别结果（应先确认录制结果正确），未识别的方块不计入
+    :param limit: 最多取出的棋盘数
+    :return: 同 synthetic_boards，缩放比例取录制的校准参数
+    """
+    boards, frame, scale = [], None, 1.0
+    for event, _, payload in SessionReader(path):
+        if event == 'frame':
+            frame = payload[0]
+        elif event == 'calibration':
+            scale = payload.get('template_scale', 1.0)
+        elif event == 'result' and payload[1] is not None and frame is not None:
+            blocks, names = [], []
+            for value in payload[1].values():
+                x1, y1, x2, y2 = (int(v) for v in value['coordinate'])
+                blocks.append(frame[y1:y2, x1:x2])
+                names.append(value['name'])
+            if blocks:
+                boards.append({'blocks': np.stack(blocks), 'names': np.array(names), 'scale': scale})
+            if limit and len(boards) >= limit:
+                break
+    return boards
+
+
+def weight_grid(steps=(1, 2)):
+    """
+    权重组合：每个非空的特征子集内，各特征的相对权重取 steps 中的值，再归一化到总和 WEIGHT_TOTAL
+    （相对权重相同的组合只保留一个）
+    :return: [(SSIM, 直方图, 模板匹配), ...]
+    """
+    grid = []
+    for mask in itertools.product((0, 1), repeat=len(METRICS)):
+        for relative in itertools.product(steps, repeat=sum(mask)):
+            values = iter(relative)
+            raw = [next(values) if enabled else 0 for enabled in mask]
+            if not any(raw):
+                continue
+            weights = tuple(round(WEIGHT_TOTAL * r / sum(raw), 4) for r in raw)
+            if weights not in grid:
+                grid.append(weights)
+    return grid
+
+
+def config_grid(weight_steps=(1, 2), bins=(4, 6, 8), resolutions=(1.0, 0.75, 0.5)):
+    """
+    待评估的匹配配置：权重组合 × 直方图分箱数（只在使用直方图时变化）× 工作分辨率
+    :return: [匹配配置, ...]
+    """
+    configs = []
+    for weights in weight_grid(weight_steps):
+        for hist_bins in (bins if weights[1] else (DEFAULT_CONFIG['hist_bins'],)):
+            for resolution in resolutions:
+                configs.append(normalize_config({'weights': weights, 'hist_bins': hist_bins,
+                                                 'resolution': resolution}))
+    return configs
+
+
+def evaluate(templates, boards, config, repeat=3):
+    """
+    评估一种匹配配置：准确率和每个棋盘的匹配耗时（与识别器相同，由 create_matcher 建立级联匹配引擎）
+    :param repeat: 每个棋盘计时的重复次数（取中位数）
+    :return: {'config', 'accuracy', 'ms_per_board': 各棋盘耗时中位数的均值, 'us_per_cell'}
+    """
+    matchers = {}
+    correct = cells = 0
+    times = []
+    for board in boards:
+        matcher = matchers.get(board['scale'])
+        if matcher is None:
+            matcher = matchers[board['scale']] = create_matcher(templates.scaled(board['scale']), config)
+            matcher.match(board['blocks'][:1])  # 预热：建立（或读取缓存的）嵌入索引
+        names, _ = matcher.match(board['blocks'])
+        correct += int((names == board['names']).sum())
+        cells += len(names)
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            matcher.match(board['blocks'])
+            runs.append(time.perf_counter() - start)
+        times.append(float(np.median(runs)))
+    ms = float(np.mean(times)) * 1000
+    return {'config': dict(config, weights=list(config['weights'])), 'accuracy': correct / max(1, cells),
+            'ms_per_board': ms, 'us_per_cell': ms * 1000 * len(boards) / max(1, cells)}
+
+
+def pareto_front(results):
+    """
+    耗时-准确率的帕累托前沿：不存在另一配置更快且准确率不低（或同样快且更准确）的配置
+    :return: 按耗时升序排列的前沿配置
+    """
+    front, best = [], -1.0
+    for result in sorted(results, key=lambda r: (r['ms_per_board'], -r['accuracy'])):
+        if result['accuracy'] > best:
+            front.append(result)
+            best = result['accuracy']
+    return front
+
+
+def select(results, target):
+    """
+    选出达到目标准确率的最快配置；没有配置达到目标时取准确率最高的配置
+    :return: (选中的结果, 是否达到目标)
+    """
+    qualified = [r for r in results if r['accuracy'] >= target]
+    if qualified:
+        return min(qualified, key=lambda r: r['ms_per_board']), True
+    return max(results, key=lambda r: (r['accuracy'], -r['ms_per_board'])), False
+
+
+def _describe(config):
+    """单行描述匹配配置"""
+    weights = " ".join(f"{name}={w:g}" for name, w in zip(METRICS, config['weights']) if w)
+    bins = config['hist_bins'] if config['weights'][1] else "-"
+    return f"{weights:34s} bins={bins:<2} res={config['resolution']:g}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="匹配配置调优：扫描权重、直方图分箱数、工作分辨率和特征组合，"
+                                                 "输出耗时-准确率帕累托前沿，并把达到目标准确率的最快配置写入档案")
+    parser.add_argument("--templates", default="block_templates", help="模板目录")
+    parser.add_argument("--session", nargs="*", default=[], help="用作标注数据的会话文件（默认使用合成棋盘）")
+    parser.add_argument("--max-boards", type=int, default=20, help="每个会话文件最多取出的棋盘数")
+    parser.add_argument("--boards", type=int, default=4, help="用于调优的合成棋盘数（未指定会话文件时）")
+    parser.add_argument("--validation-boards", type=int,
+                        help="留出验证的棋盘数：合成棋盘另行生成（默认与 --boards 相同，随机种子接在调优棋盘之后），"
+                             "会话取最后的若干个棋盘（默认为四分之一）")
+    parser.add_argument("--seed", type=int, default=100, help="合成棋盘的起始随机种子（与基准测试的棋盘不同）")
+    parser.add_argument("--noise", type=float, default=6.0, help="合成棋盘的高斯噪声标准差")
+    parser.add_argument("--weight-steps", type=float, nargs="+", default=[1, 2], help="各特征的相对权重取值")
+    parser.add_argument("--bins", type=int, nargs="+", default=[4, 6, 8], help="直方图分箱数取值")
+    parser.add_argument("--resolutions", type=float, nargs="+", default=[1.0, 0.75, 0.5], help="工作分辨率取值")
+    parser.add_argument("--repeat", type=int, default=3, help="每个棋盘计时的重复次数")
+    parser.add_argument("--target", type=float, help="目标准确率（默认为默认配置的准确率）")
+    parser.add_argument("--output", default=MATCHER_PROFILE, help="匹配配置档案路径（识别器启动时读取）")
+    parser.add_argument("--report", help="全部评估结果的 JSON 文件路径")
+    parser.add_argument("--dry-run", action="store_true", help="只输出结果，不写入档案")
+    args = parser.parse_args(argv)
+
+    # 加载和评估过程中的提示信息输出到标准错误
+    with contextlib.redirect_stdout(sys.stderr):
+        templates = load_templates(args.templates)
+        # 调优棋盘用于选出配置，验证棋盘只用于评估选出的配置和默认配置，不参与选择
+        if args.session:
+            boards = [board for path in args.session for board in recorded_boards(path, args.max_boards)]
+            count = args.validation_boards if args.validation_boards is not None else len(boards) // 4
+            count = min(max(1, count), len(boards) - 1)
+            boards, holdout = (boards[:-count], boards[-count:]) if count > 0 else ([], [])
+        else:
+            count = args.validation_boards if args.validation_boards is not None else args.boards
+            boards = synthetic_boards(templates, args.boards, seed=args.seed, noise=args.noise)
+            holdout = synthetic_boards(templates, max(1, count), seed=args.seed + args.boards, noise=args.noise)
+        if not boards:
+            print("没有可用的标注棋盘（会话至少需要 2 个棋盘，分别用于调优和验证）")
+            return 1
+        configs = config_grid(tuple(args.weight_steps), tuple(args.bins), tuple(args.resolutions))
+        default = evaluate(templates, boards, normalize_config(), args.repeat)
+        results = []
+        for i, config in enumerate(configs):
+            results.append(evaluate(templates, boards, config, args.repeat))
+            print(f"[{i + 1}/{len(configs)}] {_describe(config)} 准确率 {results[-1]['accuracy']:.4f} "
+                  f"{results[-1]['ms_per_board']:.2f} ms")
+
+    target = args.target if args.target is not None else default['accuracy']
+    front = pareto_front(results)
+    chosen, reached = select(results, target)
+    with contextlib.redirect_stdout(sys.stderr):
+        validation = evaluate(templates, holdout, chosen['config'], args.repeat)
+        default_validation = evaluate(templates, holdout, normalize_config(), args.repeat)
+    cells = sum(len(board['names']) for board in boards)
+    validation_cells = sum(len(board['names']) for board in holdout)
+    print(f"调优数据: {len(boards)} 个棋盘 {cells} 个方块，评估 {len(results)} 种配置；"
+          f"验证数据: {len(holdout)} 个棋盘 {validation_cells} 个方块")
+    print(f"默认配置: 准确率 {default['accuracy']:.4f} {default['ms_per_board']:.2f} ms/棋盘")
+    print("帕累托前沿（耗时升序）:")
+    for result in front:
+        mark = "*" if result is chosen else " "
+        print(f" {mark} {_describe(result['config'])} 准确率 {result['accuracy']:.4f} "
+              f"{result['ms_per_board']:7.2f} ms/棋盘 {result['us_per_cell']:6.1f} us/方块")
+    if not reached:
+        print(f"警告: 没有配置达到目标准确率 {target:.4f}，选用准确率最高的配置")
+    print(f"选用: {_describe(chosen['config'])}（目标准确率 {target:.4f}，"
+          f"耗时为默认配置的 {chosen['ms_per_board'] / default['ms_per_board']:.2f} 倍）")
+    print(f"验证棋盘: 选用配置准确率 {validation['accuracy']:.4f} {validation['ms_per_board']:.2f} ms/棋盘，"
+          f"默认配置准确率 {default_validation['accuracy']:.4f} {default_validation['ms_per_board']:.2f} ms/棋盘")
+    if validation['accuracy'] < default_validation['accuracy']:
+        print("警告: 选用配置在验证棋盘上的准确率低于默认配置，可能过拟合调优棋盘")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({'default': default, 'target': target, 'chosen': chosen, 'front': front, 'results': results,
+                       'validation': validation, 'default_validation': default_validation},
+                      f, ensure_ascii=False, indent=2)
+    if not args.dry_run:
+        data = "sessions" if args.session else "synthetic"
+        note = ("在录制的会话上选出，在留出的会话棋盘上验证" if args.session else
+                "只在合成棋盘上选出并验证，实际画面的准确率未知，识别器读取时会给出提示")
+        save_matcher_profile(chosen['config'], args.output, data=data, note=note, sessions=args.session,
+                             noise=None if args.session else args.noise, target=target,
+                             tune_accuracy=chosen['accuracy'], tune_boards=len(boards),
+                             accuracy=validation['accuracy'], ms_per_board=validation['ms_per_board'],
+                             default_accuracy=default_validation['accuracy'],
+                             default_ms_per_board=default_validation['ms_per_board'],
+                             boards=len(holdout), cells=validation_cells, templates=templates.key,
+                             time=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        print(f"已写入匹配配置档案 {args.output}（验证准确率 {validation['accuracy']:.4f}）")
+        if not args.session:
+            print("注意: 该配置只在合成棋盘上验证过，识别器启动时会给出提示；建议用录制的会话（--session）重新调优")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+import cv2
+import numpy as np
+import features
+from buffer_pool import BufferPool
+
+class BatchMatcher:
+    """
+    批量匹配引擎：所有区块一次性与整个模板特征库打分
+    三种特征均转化为矩阵运算：
+    - 颜色直方图相关系数: (N, B) @ (B, K)
+    - 归一化互相关 (TM_CCOEFF_NORMED): (N, D) @ (D, K)
+    - SSIM: 按窗口分组的批量矩阵乘法 (P, N, 49) @ (P, 49, K)
+    """
+
+    def __init__(self, bank, weights=(0.8, 0.8, 0.8), ssim_stride=features.SSIM_WIN, buffers=None,
+                 hist_bins=features.HIST_BINS):
+        """
+        :param bank: 模板特征库 TemplateBank
+        :param weights: (SSIM, 直方图, 模板匹配) 的权重，权重为 0 的特征不计算
+        :param ssim_stride: SSIM 窗口步长；默认取窗口边长（不重叠分块），
+                            设为 1 时与 skimage 的逐像素滑窗结果一致，但耗时高一个数量级
+        :param buffers: 工作缓冲区池 BufferPool（区块张量、像素向量、灰度图复用其中的缓冲区），默认新建
+        :param hist_bins: 颜色直方图每个通道的分箱数（与特征库不同时按模板图像重新计算模板直方图）
+        """
+        self.bank = bank
+        self.buffers = buffers or BufferPool()
+        self.weights = tuple(weights)
+        self.ssim_stride = ssim_stride
+        self.hist_bins = hist_bins
+        self.names = np.array(bank.names)
+        self.size = bank.images.shape[1:3]  # 模板尺寸 (高, 宽)，随模板金字塔的层而定
+        h, w = self.size
+
+        # 模板侧的矩阵在初始化时转置好，匹配时直接参与乘法
+        hist_vecs = bank.hist_vecs
+        if hist_bins != features.HIST_BINS:
+            hist_vecs = features.normalize_rows(features.color_histograms(bank.images, hist_bins))
+        self._hist_t = np.ascontiguousarray(hist_vecs.T)
+        # 归一化互相关：模板向量已按通道去均值，因此与区块原始像素的点积即为分子；
+        # 末尾追加三列通道指示向量，同一次矩阵乘法顺带求出区块各通道像素和
+        channels = np.tile(np.eye(3, dtype=np.float32), (h * w, 1))
+        self._ncc_t = np.ascontiguousarray(np.hstack([bank.ncc_vecs.T, channels]))
+        s = ssim_stride
+        self._mu_t = bank.ssim_mu[:, ::s, ::s].reshape(len(bank.names), -1).T  # (P, K)
+        self._var_t = bank.ssim_var[:, ::s, ::s].reshape(len(bank.names), -1).T
+        if s > 1:
+            self._patches_t = self._window_patches(bank.grays).transpose(0, 2, 1)  # (P, 49, K)
+
+    def updated(self, bank, changed=()):
+        """
+        模板热更新后的匹配引擎：相同参数、共用缓冲区池，模板侧矩阵按新特征库重新排列
+        :param bank: 更新后的模板特征库（同一金字塔层）
+        :param changed: 修改过的模板名
+        """
+        return type(self)(bank, self.weights, self.ssim_stride, buffers=self.buffers, hist_bins=self.hist_bins)
+
+    def _window_patches(self, grays, pooled=False):
+        """
+        按 SSIM 窗口取出像素块 (P, N, win*win)，float32
+        :param pooled: 是否写入缓冲区池（区块侧每帧调用；模板侧的结果需长期保存，不使用缓冲区池）
+        """
+        win, s = features.SSIM_WIN, self.ssim_stride
+        windows = np.lib.stride_tricks.sliding_window_view(grays, (win, win), axis=(1, 2))
+        windows = windows[:, ::s, ::s]
+        n, ph, pw = windows.shape[:3]
+        if not pooled:
+            return windows.reshape(n, ph * pw, win * win).transpose(1, 0, 2).astype(np.float32)
+        patches = self.buffers.get("match.patches", (ph * pw, n, win * win), np.float32)
+        np.copyto(patches.reshape(ph, pw, n, win, win), windows.transpose(1, 2, 0, 3, 4))
+        return patches
+
+    def stack_blocks(self, blocks):
+        """
+        将区块组堆叠为 (N, H, W, 3) 的连续张量（H, W 为模板尺寸）
+        识别器按校准时选定的模板金字塔层切出原尺寸区块，工作分辨率为 1 时不需要缩放；
+        工作分辨率小于 1 时整组区块纵向拼接为一幅图像，一次缩放到模板尺寸（每个区块的边界正好落在
+        目标像素边界上，与逐块缩放结果相同）；其他尺寸不符的区块（如外部传入的列表）才逐块缩放
+        :param blocks: 区块列表或已堆叠的数组
+        """
+        h, w = self.size
+        if isinstance(blocks, np.ndarray) and blocks.ndim == 4:
+            n, bh, bw = blocks.shape[:3]
+            if (bh, bw) == (h, w):
+                if blocks.flags.c_contiguous:
+                    return blocks
+                stack = self.buffers.get("match.stack", blocks.shape)
+                np.copyto(stack, blocks)
+                return stack
+            if blocks.flags.c_contiguous and n:
+                stack = self.buffers.get("match.stack", (n, h, w, 3))
+                interpolation = cv2.INTER_AREA if bh > h else cv2.INTER_LINEAR
+                cv2.resize(blocks.reshape(n * bh, bw, 3), (w, n * h), dst=stack.reshape(n * h, w, 3),
+                           interpolation=interpolation)
+                return stack
+        stack = self.buffers.get("match.stack", (len(blocks), h, w, 3))
+        for i, block in enumerate(blocks):
+            if block.shape[:2] == (h, w):
+                stack[i] = block
+            else:
+                interpolation = cv2.INTER_AREA if block.shape[0] > h else cv2.INTER_LINEAR
+                cv2.resize(block, (w, h), dst=stack[i], interpolation=interpolation)
+        return stack
+
+    def _ssim_scores(self, grays):
+        """批量 SSIM (N, K)"""
+        win, s = features.SSIM_WIN, self.ssim_stride
+        area = float(win * win)
+        cov_norm = area / (area - 1)
+        mu_t, var_t = self._mu_t[:, None, :], self._var_t[:, None, :]
+
+        if s > 1:
+            patches = self._window_patches(grays, pooled=True)  # (P, N, 49)
+            mu_b = patches.mean(axis=2)
+            var_b = cov_norm * (np.einsum("pni,pni->pn", patches, patches) / area - mu_b * mu_b)
+            cross = np.matmul(patches, self._patches_t) / area  # (P, N, K)
+        else:
+            mu_full, var_full = features.ssim_stats(grays)
+            mu_b = mu_full.reshape(len(grays), -1).T
+            var_b = var_full.reshape(len(grays), -1).T
+            g = grays.astype(np.float32)
+            t = self.bank.grays.astype(np.float32)
+            cross = np.empty((mu_b.shape[0], len(grays), t.shape[0]), dtype=np.float32)
+            for k in range(t.shape[0]):  # 逐模板计算，控制中间张量的内存
+                cross[:, :, k] = (features.box_sum(g * t[k]) / area).reshape(len(grays), -1).T
+
+        # 原地运算，减少 (P, N, K) 临时张量
+        mu_b, var_b = mu_b[:, :, None], var_b[:, :, None]
+        ssim = mu_b * mu_t
+        cov = cross * cov_norm
+        cov -= cov_norm * ssim
+        cov *= 2
+        cov += features.SSIM_C2
+        ssim *= 2
+        ssim += features.SSIM_C1
+        ssim *= cov
+        den = mu_b * mu_b + (mu_t * mu_t + features.SSIM_C1)
+        den *= var_b + (var_t + features.SSIM_C2)
+        ssim /= den
+        return ssim.mean(axis=0)
+
+    def score(self, stack):
+        """
+        计算综合评分矩阵
+        :param stack: 区块张量 (N, H, W, 3)
+        :return: 评分 (N, K)
+        """
+        w_ssim, w_hist, w_tmpl = self.weights
+        scores = np.zeros((len(stack), len(self.names)), dtype=np.float32)
+        if w_ssim:
+            scores += w_ssim * self._ssim_scores(self._gray(stack))
+        if w_hist:
+            scores += w_hist * (features.normalize_rows(features.color_histograms(stack, self.hist_bins)) @ self._hist_t)
+        if w_tmpl:
+            scores += w_tmpl * self._ncc_scores(stack)
+        return scores
+
+    def _gray(self, stack):
+        """区块灰度图 (N, H, W)（写入缓冲区池）"""
+        return features.to_gray(stack, out=self.buffers.get("match.gray", stack.shape[:3]))
+
+    def _flat(self, stack):
+        """区块像素向量 (N, H*W*3)，float32（写入缓冲区池）"""
+        n = len(stack)
+        flat = self.buffers.get("match.flat", (n, stack[0].size), np.float32)
+        np.copyto(flat, stack.reshape(n, -1))
+        return flat
+
+    def _ncc_scores(self, stack):
+        """批量归一化互相关 (N, K)"""
+        flat = self._flat(stack)
+        prod = flat @ self._ncc_t
+        sums = prod[:, -3:]
+        # 区块去均值后的平方和 = 原始平方和 - 各通道 (和^2 / 像素数)
+        norm2 = np.einsum("ij,ij->i", flat, flat) - (sums * sums).sum(axis=1) / (self.size[0] * self.size[1])
+        return prod[:, :-3] / np.sqrt(np.maximum(norm2, 1e-6))[:, None]
+
+    def match(self, blocks):
+        """
+        批量匹配
+        :param blocks: 区块列表或 (N, H, W, 3) 张量
+        :return: (名称数组 (N,), 置信度数组 (N,))，评分不为正的区块名称为 "unknown"
+        """
+        if len(blocks) == 0:
+            return np.array([], dtype=object), np.zeros(0, dtype=np.float32)
+        scores = self.score(self.stack_blocks(blocks))
+        best = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(best)), best].astype(np.float32)
+        names = self.names[best].astype(object)
+        names[confidences <= 0] = "unknown"
+        return names, confidences
@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import multiprocessing
+from frame_source import ImageDirSource, VideoSource
+from debug_window import NullDebugWindow
+from template_loader import load_templates, PYRAMID_SCALES
+from block_recognizer import BlockRecognizer
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".webm", ".flv")
+
+_templates = None  # 工作进程中加载的模板特征库
+_results = None  # 工作进程逐帧向主进程发送结果的队列
+
+
+def collect_jobs(inputs, chunk=500):
+    """
+    将命令行输入拆分为识别任务，每个任务是一段独立校准的会话
+    - 目录：按文件名排序的图片，每 chunk 张为一个任务
+    - 视频文件：每 chunk 帧为一个任务（各自从第一帧开始校准），单个视频也能分配到多个进程
+    - 图片文件：每张为一个任务
+    :param inputs: 图片文件、目录或视频文件路径列表
+    :param chunk: 每个任务的图片数或视频帧数，为 0 时整个目录或视频为一个任务
+    :return: [(类型 "images" | "video", 来源路径, 图片列表或帧数（None 为读到视频末尾）, 首帧序号), ...]
+    """
+    jobs = []
+    for path in inputs:
+        if os.path.isdir(path):
+            files = ImageDirSource(path).files
+            step = chunk if chunk > 0 else max(1, len(files))
+            for start in range(0, len(files), step):
+                jobs.append(("images", path, files[start:start + step], start))
+        elif path.lower().endswith(VIDEO_EXTENSIONS):
+            # 容器记录的帧数可能不准，最后一段读到视频末尾；无法获取帧数时整个视频为一个任务
+            total = VideoSource.frame_count(path) if chunk > 0 else 0
+            starts = list(range(0, total, chunk)) if total else [0]
+            for start, end in zip(starts, starts[1:] + [None]):
+                jobs.append(("video", path, None if end is None else end - start, start))
+        elif path.lower().endswith(ImageDirSource.EXTENSIONS):
+            jobs.append(("images", path, [path], 0))
+        else:
+            print(f"警告: 跳过无法识别的输入 {path}", file=sys.stderr)
+    return jobs
+
+
+def _init_worker(template_dir, results=None):
+    """
+    工作进程初始化：加载模板（读取特征库缓存），识别过程中的提示信息输出到标准错误
+    :param results: 逐帧发送结果的队列（单进程运行时为 None）
+    """
+    global _templates, _results
+    sys.stdout = sys.stderr
+    _templates = load_templates(template_dir)
+    _results = results
+
+
+def board_records(state):
+    """识别结果转换为可序列化的列表 [{'col', 'row', 'name', 'box'}, ...]"""
+    return [{'col': col, 'row': row, 'name': value['name'], 'box': [int(v) for v in value['coordinate']]}
+            for (col, row), value in sorted(state.items(), key=lambda item: (item[0][1], item[0][0]))]
+
+
+def run_job(job, region=None, max_turns=1, edge_routes=False):
+    """
+    识别一个任务中的所有帧：首帧（失败时顺延到后续帧）自动校准，之后逐帧识别并查找可消除对
+    :param job: collect_jobs 返回的任务
+    :param region: 裁剪区域 (x1, y1, x2, y2)，为 None 时使用整帧
+    :return: 逐帧生成 JSON 行（生成器，识别完一帧即输出一行）
+    """
+    kind, path, files, first = job
+    try:
+        if kind == "video":
+            source = VideoSource(path, region, start=first, count=files)
+        else:
+            source = ImageDirSource(files, region)
+    except Exception as e:
+        yield json.dumps({'source': path, 'error': str(e)}, ensure_ascii=False)
+        return
+
+    recognizer = BlockRecognizer(region, _templates, frame_source=source, debug_window=NullDebugWindow())
+    recognizer.use_profiles = False  # 多进程并行时不读写共享的校准档案
+    recognizer.solve_budget = 0
+    recognizer.max_turns = max_turns
+    recognizer.edge_routes = edge_routes
+    with source:
+        for index, frame in enumerate(source, first):
+            record = {'source': path, 'frame': index}
+            if kind == "images":
+                record['file'] = source.current
+            start = time.perf_counter()
+            try:
+                if not recognizer.calibrated:
+                    recognizer._auto_calibrate(frame)
+                recognizer.last_state = recognizer._recognize_blocks(frame, render=False)
+                pairs = recognizer._pair_finder().removable_pairs()
+            except Exception as e:
+                record['error'] = str(e)
+            else:
+                record['board'] = board_records(recognizer.last_state)
+                record['pairs'] = [[list(a), list(b)] for a, b in pairs]
+            record['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            yield json.dumps(record, ensure_ascii=False)
+
+
+def _stream_job(args):
+    """工作进程中运行一个任务，每帧的结果立即放入队列，任务结束时放入 (序号, None)"""
+    index, task = args
+    try:
+        for line in run_job(*task):
+            _results.put((index, line))
+    finally:
+        _results.put((index, None))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量识别截图目录和视频（无界面，多进程并行，每帧输出一行 JSON）")
+    parser.add_argument("inputs", nargs="+", help="图片文件、图片目录或视频文件")
+    parser.add_argument("--region", nargs=4, type=int, metavar=("X1", "Y1", "X2", "Y2"),
+                        help="固定的裁剪区域（默认使用整帧）")
+    parser.add_argument("--templates", default="block_templates", help="模板目录")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="工作进程数（1 为在当前进程中运行）")
+    parser.add_argument("--chunk", type=int, default=500,
+                        help="每个任务（独立校准）的图片数或视频帧数，0 为整个目录或视频")
+    parser.add_argument("--ordered", action="store_true",
+                        help="按输入顺序输出（后面任务的结果缓存到前面的任务完成为止；默认按识别完成顺序逐帧输出）")
+    parser.add_argument("--max-turns", type=int, default=1, choices=[0, 1, 2],
+                        help="消除路径最多拐点数（默认 1 为游戏规则，2 为扩展规则）")
+    parser.add_argument("--edge-routes", action="store_true", help="扩展规则：消除路径允许绕行棋盘外圈")
+    parser.add_argument("--output", help="JSON lines 输出文件（默认输出到标准输出）")
+    args = parser.parse_args(argv)
+
+    jobs = collect_jobs(args.inputs, args.chunk)
+    region = tuple(args.region) if args.region else None
+    tasks = [(job, region, args.max_turns, args.edge_routes) for job in jobs]
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    frames = 0
+    start = time.perf_counter()
+    try:
+        if args.workers <= 1 or len(tasks) <= 1:
+            # 单进程：提示信息重定向到标准错误，结果逐帧写入 out
+            with contextlib.redirect_stdout(sys.stderr):
+                _init_worker(args.templates)
+                for task in tasks:
+                    for line in run_job(*task):
+                        out.write(line + "\n")
+                        out.flush()
+                        frames += 1
+        else:
+            # 先在主进程中建立（或验证）特征库和金字塔各层的磁盘缓存，工作进程启动后只读取缓存，
+            # 不会在冷缓存上同时重建并写入同一目录
+            with contextlib.redirect_stdout(sys.stderr):
+                load_templates(args.templates, scales=PYRAMID_SCALES)
+            # 工作进程逐帧放入有界队列（主进程写出较慢时工作进程等待，内存占用不随任务长度增长）
+            results = multiprocessing.Queue(maxsize=1024)
+            with multiprocessing.Pool(min(args.workers, len(tasks)), _init_worker, (args.templates, results)) as pool:
+                pending = pool.map_async(_stream_job, enumerate(tasks), chunksize=1)
+                buffered, finished, current = {}, set(), 0  # --ordered：尚未轮到的任务的结果、已结束的任务、正在输出的任务
+                while len(finished) < len(tasks):
+                    index, line = results.get()
+                    if line is None:
+                        finished.add(index)
+                        while args.ordered and current in finished:
+                            current += 1
+                            lines = buffered.pop(current, [])
+                            out.write("".join(line + "\n" for line in lines))
+                            frames += len(lines)
+                    elif args.ordered and index != current:
+                        buffered.setdefault(index, []).append(line)
+                        continue
+                    else:
+                        out.write(line + "\n")
+                        frames += 1
+                    out.flush()
+                pending.get()  # 工作进程中的异常在此抛出
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print(f"完成 {len(tasks)} 个任务、{frames} 帧，用时 {elapsed:.1f} 秒（{frames / max(elapsed, 1e-9):.1f} 帧/秒）",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
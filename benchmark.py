@@ -0,0 +1,280 @@
+import sys
+import json
+import time
+import argparse
+import contextlib
+import platform
+import subprocess
+import multiprocessing
+import cv2
+import numpy as np
+from frame_source import ReplaySource
+from batch_matcher import BatchMatcher
+from debug_window import NullDebugWindow
+from template_loader import load_templates
+from instrumentation import Instrumentation, STARTUP_BUDGET_MS
+from block_recognizer import BlockRecognizer
+from synthetic import generate_board, label_accuracy
+from matcher_profile import DEFAULT_CONFIG, load_matcher_profile
+from multi_board import MultiBoardRecognizer
+
+def _timed(fn, repeat):
+    """重复执行并记录每次耗时（秒），返回最后一次结果"""
+    result, times = None, []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def _summarize(times, items=1):
+    """
+    汇总耗时
+    :param items: 每次调用处理的对象数（方块数等），用于计算吞吐量
+    """
+    ms = np.array(times) * 1000
+    mean_s = float(np.mean(times))
+    return {
+        'runs': len(times),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p90_ms': float(np.percentile(ms, 90)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+        'throughput': items / mean_s if mean_s > 0 else 0.0,  # 每秒处理的对象数
+    }
+
+
+def bench_board(templates, cols, rows, repeat, seed=0, match_config=DEFAULT_CONFIG):
+    """
+    对一种棋盘尺寸计时
+    :param match_config: 识别器的匹配配置（默认为默认配置，不读取匹配配置档案）
+    :return: {'accuracy', 'cells', 'cascade_exits': {级联阶段: 结束比例}, 'stages': {阶段名: 耗时统计}}
+    """
+    frame, cells = generate_board(templates, cols, rows, seed=seed)
+    h, w = frame.shape[:2]
+    rec = BlockRecognizer((0, 0, w, h), templates, frame_source=ReplaySource([frame], loop=True),
+                          debug_window=NullDebugWindow(), match_config=match_config)
+    rec.use_profiles = False  # 每次都完整校准
+    rec.solve_budget = 0  # 只计时可消除对查找，不含整盘求解
+    stages = {}
+
+    _, times = _timed(lambda: rec._auto_calibrate(frame), max(1, repeat // 4))
+    stages['auto_calibrate'] = _summarize(times)
+
+    rec.incremental = False
+    positions, times = _timed(lambda: rec._find_all_blocks(frame), repeat)
+    stages['find_all_blocks'] = _summarize(times, len(cells))
+    accuracy = label_accuracy(positions, cells)
+
+    # 画面不变时的增量识别
+    rec.incremental = True
+    rec.last_state = rec._recognize_blocks(frame)
+    _, times = _timed(lambda: rec._recognize_blocks(frame), repeat)
+    stages['recognize_blocks_incremental'] = _summarize(times, len(cells))
+
+    blocks = np.stack([frame[c['y']:c['y'] + rec.block_h, c['x']:c['x'] + rec.block_w] for c in cells])
+    rec.matcher.reset_stats()
+    _, times = _timed(lambda: rec._match_blocks(blocks), repeat)
+    stages['match_blocks'] = _summarize(times, len(blocks))
+    cascade_exits = rec.matcher.exit_fractions()
+
+    # 不做级联剪枝，所有模板完整打分
+    exhaustive = BatchMatcher(rec.templates)
+    _, times = _timed(lambda: exhaustive.match(blocks), repeat)
+    stages['match_blocks_exhaustive'] = _summarize(times, len(blocks))
+
+    # 逐模板参考实现较慢，只取少量方块
+    sample = blocks[:min(len(blocks), 8)]
+    _, times = _timed(lambda: [rec._match_block(block) for block in sample], 1)
+    stages['match_block'] = _summarize([t / len(sample) for t in times])
+
+    rec.last_state = positions
+
+    def highlight():
+        rec._finder = None  # 每次重新建立索引
+        rec._highlight_removable_pairs(frame)
+
+    _, times = _timed(highlight, repeat)
+    stages['highlight_removable_pairs'] = _summarize(times)
+
+    return {'accuracy': accuracy, 'cells': len(cells), 'cascade_exits': cascade_exits, 'stages': stages}
+
+
+def bench_memory(templates, cols, rows, frames, seed=0, warmup=5, match_config=DEFAULT_CONFIG):
+    """
+    逐帧识别时的内存占用：每帧清空一个方块，走完整的 process_frame（变化检测 + 增量识别）
+    :param frames: 统计的帧数（不含预热帧；预热期间完成校准并建立缓冲区）
+    :return: {'frame_peak': 每帧临时分配峰值统计（字节）, 'current': 帧间常驻内存统计, 'growth': 统计期间常驻内存增长}
+    """
+    frame, cells = generate_board(templates, cols, rows, seed=seed)
+    h, w = frame.shape[:2]
+    block_w, block_h = 78, 82  # generate_board 的默认方块尺寸
+    sequence = []
+    for cell in cells[:frames]:
+        changed = frame.copy()
+        changed[cell['y']:cell['y'] + block_h, cell['x']:cell['x'] + block_w] = frame[0, 0]  # 涂成背景色
+        sequence.append(changed)
+    instruments = Instrumentation(enabled=True)
+    rec = BlockRecognizer((0, 0, w, h), templates, frame_source=ReplaySource(sequence, loop=True),
+                          debug_window=NullDebugWindow(), instruments=instruments, match_config=match_config)
+    rec.use_profiles = False
+    rec.solve_budget = 0
+    for _ in range(warmup):
+        rec.process_frame()
+    instruments.track_memory()
+    try:
+        for _ in range(frames):
+            rec.process_frame()
+        return instruments.memory_stats()
+    finally:
+        instruments.close()
+
+
+def bench_multi_board(template_dir, templates, counts=(1, 2, 4), frames=20, cols=10, rows=14, seed=0, variants=4):
+    """
+    多棋盘识别的吞吐量：k 个棋盘横向并排合成一帧，由 k 个工作进程识别
+    每个周期换用另一组棋盘（variants 组轮流），所有棋盘都完整重新识别
+    :param counts: 棋盘数
+    :param frames: 计时的周期数（不含校准和预热）
+    :return: {'cpus', 'boards': {棋盘数: {'workers', 'boards_per_second', 'tick': 耗时统计, 'speedup', 'efficiency'}}}，
+             speedup 为相对最少棋盘数的吞吐量倍数，efficiency = speedup / 棋盘数之比（近似线性时接近 1）
+    """
+    boards = {}
+    for count in counts:
+        composites = [np.hstack([generate_board(templates, cols, rows, seed=seed + 100 * v + i)[0]
+                                 for i in range(count)]) for v in range(variants)]
+        board_w = composites[0].shape[1] // count
+        regions = {i: (i * board_w, 0, (i + 1) * board_w, composites[0].shape[0]) for i in range(count)}
+        with MultiBoardRecognizer(regions, composites[0].shape, template_dir, workers=count) as multi:
+            for frame in composites:  # 校准并预热每组棋盘
+                multi.recognize(frame)
+            _, times = _timed(lambda: multi.recognize(composites[multi.ticks % variants]), frames)
+            tick = _summarize(times, count)
+            boards[count] = {'workers': multi.workers, 'boards_per_second': tick['throughput'], 'tick': tick}
+    if boards:
+        first = min(boards)
+        for count, result in boards.items():
+            result['speedup'] = result['boards_per_second'] / boards[first]['boards_per_second']
+            result['efficiency'] = result['speedup'] / (count / first)
+    return {'cpus': multiprocessing.cpu_count(), 'boards': boards}
+
+
+def bench_startup(template_dir, repeat, budget_ms):
+    """
+    在新进程中测量启动耗时（导入、加载模板、初始化识别器，见 main.startup_probe）
+    :return: {'phases': {阶段名: 耗时统计}, 'total': 耗时统计, 'budget_ms', 'within_budget'}（按中位数判断）
+    """
+    code = ("import time; t = time.perf_counter(); import main; "
+            f"main.startup_probe({template_dir!r}, t, {budget_ms!r})")
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    phases = {name: _summarize([run['phases'][name] / 1000 for run in runs]) for name in runs[0]['phases']}
+    total = _summarize([run['total_ms'] / 1000 for run in runs])
+    return {'phases': phases, 'total': total, 'budget_ms': budget_ms, 'within_budget': total['p50_ms'] <= budget_ms}
+
+
+def _metadata():
+    """运行环境信息，便于跨提交对比"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+    }
+
+
+def compare(results, baseline):
+    """打印与基线结果的平均耗时对比（比值 < 1 表示变快）"""
+    base, current = baseline.get('startup'), results.get('startup')
+    if base and current:
+        print(f"[启动] {base['total']['p50_ms']:.0f} -> {current['total']['p50_ms']:.0f} ms"
+              f"（预算 {current['budget_ms']:.0f} ms）")
+    base, current = baseline.get('multi_board'), results.get('multi_board')
+    if base and current:
+        for count, stat in current['boards'].items():
+            old = base['boards'].get(str(count))
+            if old:
+                print(f"[多棋盘 x{count}] {old['boards_per_second']:.1f} -> {stat['boards_per_second']:.1f} 棋盘/秒"
+                      f"（加速比 {stat['speedup']:.2f}，效率 {stat['efficiency']:.2f}）")
+    for size, current in results['results'].items():
+        base = baseline.get('results', {}).get(size)
+        if not base:
+            continue
+        print(f"[{size}] 准确率 {base['accuracy']:.3f} -> {current['accuracy']:.3f}")
+        old_memory, memory = base.get('memory'), current.get('memory')
+        if old_memory and memory:
+            print(f"  {'memory.frame_peak':32s} {old_memory['frame_peak']['mean'] / 1e6:9.2f} -> "
+                  f"{memory['frame_peak']['mean'] / 1e6:9.2f} MB")
+        for stage, stat in current['stages'].items():
+            old = base['stages'].get(stage)
+            if old and old['mean_ms'] > 0:
+                ratio = stat['mean_ms'] / old['mean_ms']
+                print(f"  {stage:32s} {old['mean_ms']:9.2f} -> {stat['mean_ms']:9.2f} ms  x{ratio:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="方块识别基准测试（使用合成棋盘）")
+    parser.add_argument("--templates", default="block_templates", help="模板目录")
+    parser.add_argument("--sizes", nargs="+", default=["6x8", "10x14"], help="棋盘尺寸 列x行")
+    parser.add_argument("--repeat", type=int, default=20, help="每个阶段的重复次数")
+    parser.add_argument("--seed", type=int, default=0, help="合成棋盘的随机种子")
+    parser.add_argument("--output", help="结果 JSON 文件路径（默认输出到标准输出）")
+    parser.add_argument("--baseline", help="用于对比的历史结果 JSON 文件")
+    parser.add_argument("--matcher-profile", help="使用匹配配置档案（autotune.py 的输出）代替默认配置")
+    parser.add_argument("--memory-frames", type=int, default=30,
+                        help="逐帧内存统计的帧数（0 为不统计；tracemalloc 会拖慢运行，不影响耗时统计）")
+    parser.add_argument("--multi-boards", type=int, nargs="+", default=[1, 2, 4], help="多棋盘吞吐量测试的棋盘数")
+    parser.add_argument("--multi-frames", type=int, default=20, help="多棋盘吞吐量测试的周期数（0 为不测量）")
+    parser.add_argument("--startup-repeat", type=int, default=5, help="启动耗时的测量次数（0 为不测量）")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET_MS, help="启动耗时预算（毫秒）")
+    args = parser.parse_args(argv)
+
+    # 识别过程中的提示信息输出到标准错误，标准输出只保留 JSON 结果
+    with contextlib.redirect_stdout(sys.stderr):
+        templates = load_templates(args.templates)
+        match_config = DEFAULT_CONFIG
+        if args.matcher_profile:
+            match_config = load_matcher_profile(args.matcher_profile)
+            if match_config is None:
+                print(f"无法读取匹配配置档案 {args.matcher_profile}")
+                return 1
+        results = {'meta': dict(_metadata(), match_config=match_config), 'results': {}}
+        for size in args.sizes:
+            cols, rows = (int(v) for v in size.lower().split("x"))
+            results['results'][size] = bench_board(templates, cols, rows, args.repeat, args.seed, match_config)
+            if args.memory_frames > 0:
+                results['results'][size]['memory'] = bench_memory(templates, cols, rows, args.memory_frames,
+                                                                  args.seed, match_config=match_config)
+        if args.multi_frames > 0:
+            results['multi_board'] = bench_multi_board(args.templates, templates, args.multi_boards,
+                                                       args.multi_frames, seed=args.seed)
+        if args.startup_repeat > 0:
+            results['startup'] = bench_startup(args.templates, args.startup_repeat, args.startup_budget)
+            if not results['startup']['within_budget']:
+                print(f"警告: 启动耗时 {results['startup']['total']['p50_ms']:.0f} ms 超出预算 {args.startup_budget:.0f} ms")
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
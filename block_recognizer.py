@@ -1,92 +1,305 @@
 import cv2
 import utils
+import threading
+import features
 import numpy as np
-from PIL import ImageGrab
 from debug_window import DebugWindow
-from concurrent.futures import ThreadPoolExecutor
-from skimage.metrics import structural_similarity as ssim
+from frame_source import ScreenSource
+from solver import BoardSolver
+from pair_finder import PairFinder
+from matcher_profile import create_matcher, read_matcher_profile, describe_matcher_profile, normalize_config
+from calibration import PyramidCalibrator, CalibrationProfiles, estimate_pitch
+from template_loader import TemplateBank, PYRAMID_SCALES
+from instrumentation import Instrumentation
+from board_state import BoardState, LABELS, EMPTY
+from change_detector import FrameChangeDetector
+from buffer_pool import BufferPool
 
 class BlockRecognizer:
-    def __init__(self, screen_region, templates):
+    def __init__(self, screen_region, templates, frame_source=None, debug_window=None, instruments=None,
+                 match_config=None):
         """
         初始化方块识别器
         :param screen_region: 屏幕区域 (x1, y1, x2, y2)
-        :param templates: 模板字典 {name: image}
+        :param templates: 模板特征库 TemplateBank，或模板字典 {name: image}
+        :param frame_source: 帧来源 FrameSource，默认截取 screen_region 所在屏幕区域
+        :param debug_window: 调试窗口，默认创建 DebugWindow（没有 HighGUI 时自动以无界面模式运行）
+        :param instruments: 性能埋点 Instrumentation，默认关闭（运行时可设置 instruments.enabled）
+        :param match_config: 匹配配置 {'weights', 'hist_bins', 'resolution'}（见 matcher_profile），
+                             默认读取 autotune.py 写入的 matcher_profile.json，不存在时使用默认配置
         """
         self.screen_region = screen_region
-        self.templates = templates
-        self.block_w, self.block_h = 78, 82  # 每个方块的尺寸
+        self.frame_source = frame_source or ScreenSource(screen_region)
+        if not isinstance(templates, TemplateBank):
+            templates = TemplateBank.from_images(templates)
+        self.templates = templates  # 当前使用的模板金字塔层（校准时按画面选定）
+        # 工作缓冲区池：帧级变化检测、方块切片和匹配的中间数组复用其中的缓冲区，稳定运行后每帧不再分配
+        self.buffers = BufferPool()
+        # 级联匹配引擎（逐帧热路径）；需要对所有模板完整打分时可替换为 BatchMatcher
+        if match_config is None:  # 读取调优档案；只在合成棋盘上验证过的档案给出提示
+            profile = read_matcher_profile()
+            if profile is not None:
+                match_config = profile['config']
+                warning = describe_matcher_profile(profile)
+                if warning:
+                    print(warning)
+        self.match_config = normalize_config(match_config)
+        self.matcher = create_matcher(templates, self.match_config, buffers=self.buffers)
+        self.block_h, self.block_w = templates.size  # 每个方块的尺寸（78×82，随模板缩放比例变化）
         self.grid_cols, self.grid_rows = 10, 14  # 横向10个，纵向14个方块
-        self.last_state = None  # 上一次识别结果
+        self.last_state = None  # 上一次识别结果 BoardState
 
         # 调试窗口
-        self.debug_window = DebugWindow()
+        self.debug_window = debug_window or DebugWindow()
+
+        # 性能埋点：帧来源和调试窗口共用同一实例
+        self.instruments = instruments or Instrumentation()
+        self.frame_source.instruments = self.instruments
+        self.debug_window.instruments = self.instruments
         self.scale = utils.get_scaling_factor()
 
+        # 模板金字塔：校准时从系统缩放比例开始依次尝试，选定后按原尺寸切片匹配，不再逐格缩放
+        self.template_scales = PYRAMID_SCALES
+        self.template_scale = templates.scale
+        self.scale_accept = 0.85  # 精匹配得分达到该值时只再尝试相邻的缩放比例
+        self.scale_exact = 0.97  # 精匹配得分达到该值时直接采用该缩放比例
+        self.scale_refine = 0.025  # 选定层后细化缩放比例的步长，为 0 时只使用金字塔中的比例
+        self.scale_extend = 2  # 各层均未达到 scale_accept 时，按阶梯两端的间距向外追加尝试的层数
+        self._matchers = {templates.scale: self.matcher}  # 各层的匹配引擎（首次使用时创建）
+        self._calibrators = {}  # 各层的校准引擎
+
         # 校准参数
         self.calibrated = False
         self.start_x = self.start_y = 0  # 第一个方块的左上角坐标
         self.h_gap = 7  # 横向间隙
         self.v_gap = 3  # 纵向间隙
+        self.calibrator = None  # 选定模板层的由粗到精校准引擎
+        self.grid_origin = None  # 检测到的棋盘左上角方块（相对校准方块的列号、行号）
+        self.grid_confidence = 1.2  # 网格检测时判定为方块的最低综合评分
+        self.profiles = CalibrationProfiles()  # 校准档案，重启时验证后直接复用
+        self.use_profiles = True
+        self.layout = "lattice"  # 方块布局: lattice 按规则网格直接切片，bfs 逐层扩展（不规则布局）
+
+        # 增量识别：只重新匹配外观发生变化的方块，其余沿用 last_state 中的结果
+        self.incremental = True
+        self.change_threshold = 4.0  # 方块缩略图平均灰度差超过该值视为变化
+        self.recognition_stats = {'frames': 0, 'reused': 0, 'recomputed': 0}
+        self._cell_signatures = None  # (网格参数, 上一帧各方块缩略图)
+        self._signature_slot = 0  # 缩略图在两块缓冲区间交替写入
+        self._rematch = None  # 模板热更新后需要重新匹配的方块编号（对应的模板已删除）
+
+        # 模板热更新：新特征库由 update_templates 登记，在两次识别之间整体替换
+        self._template_update = None  # (新特征库, 变化的模板名)
+        self._template_lock = threading.Lock()
+
+        # 帧级变化检测：画面指纹与上一帧相同时跳过整个识别阶段
+        self.change_detector = FrameChangeDetector(buffers=self.buffers)
+        self.skip_unchanged = True
+        self.frame_changed = True  # 最近一次 process_frame 的画面是否变化
+        self.last_frame = None  # 最近一次 process_frame 读取的画面（帧来源的复用缓冲区）
+
+        # 消除规则：路径最多拐点数，是否允许绕行棋盘外圈
+        # 默认为游戏的规则（直线或单拐点，不绕行外圈）；max_turns=2、edge_routes=True 为可选的扩展规则
+        self.max_turns = 1
+        self.edge_routes = False
+        self._finder = None  # (棋盘状态对象, PairFinder)：最近一次查找所依据的状态及其引擎
+        self.solve_budget = 0.5  # 整盘求解的时间预算（秒），为 0 时只提示第一个可消除对
 
     def process_frame(self):
         """
         处理每一帧图像，包括校准、识别和状态检测
+        每次调用只读取一帧（保存在 last_frame），画面与上一帧相同时跳过识别（frame_changed 为 False）
+        :return: 本帧是否用于校准
         """
-        screen_img = self._capture_screen()
+        inst = self.instruments
+        self._apply_template_update()
+        with inst.stage("capture"):
+            screen_img = self._capture_screen()
+        self.last_frame = screen_img
+        inst.value("bytes.frame", screen_img.nbytes)
         if not self.calibrated:
-            self._auto_calibrate(screen_img)
+            with inst.stage("calibrate"):
+                if not self._load_profile(screen_img):
+                    self._auto_calibrate(screen_img)
+            self.frame_changed = True
+            self.change_detector.reset()
+            inst.end_frame(calibrated=self.calibrated)
             return True
         else:
-            self.last_state = self._recognize_blocks(screen_img)
+            with inst.stage("detect"):
+                changed = self.change_detector.update(screen_img)
+            self.frame_changed = changed or not self.skip_unchanged or self.last_state is None
+            if not self.frame_changed:
+                inst.count("frames.unchanged")
+                inst.end_frame(unchanged=True)
+                return False
+            with inst.stage("recognize"):
+                self.last_state = self._recognize_blocks(screen_img)
+            inst.end_frame(blocks=len(self.last_state))
             return False
 
     def _capture_screen(self):
         """
-        捕获屏幕区域
-        :return: 彩色图像
+        从帧来源读取一帧
+        :return: 彩色图像（帧来源的复用缓冲区）
         """
-        img = ImageGrab.grab(bbox=self.screen_region)
-        screen_img = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+        screen_img = self.frame_source.read()
+        if screen_img is None:
+            raise Exception("帧来源没有更多图像")
 
         # 检查捕获的图像是否为空
-        if screen_img is None or screen_img.size == 0:
+        if screen_img.size == 0:
             raise Exception("捕获的屏幕图像为空，请检查 screen_region 参数")
 
         return screen_img
 
+    def _scale_candidates(self):
+        """模板缩放比例的尝试顺序：离系统缩放比例（及当前比例）越近越先尝试"""
+        scales = set(self.template_scales) | {self.template_scale}
+        return sorted(scales, key=lambda s: (abs(s - self.scale), abs(s - self.template_scale)))
+
+    def _use_scale(self, scale):
+        """切换到模板金字塔的指定层：模板、匹配引擎和方块尺寸"""
+        scale = round(float(scale), 4)
+        if scale == self.template_scale and self.templates.scale == scale:
+            return
+        self.templates = self.templates.scaled(scale)
+        matcher = self._matchers.get(scale)
+        if matcher is None:
+            matcher = self._matchers[scale] = create_matcher(self.templates, self.match_config, type(self.matcher),
+                                                             self.buffers)
+        self.matcher = matcher
+        self.template_scale = scale
+        self.block_h, self.block_w = self.templates.size
+        self._cell_signatures = None
+        self._finder = None
+
+    def update_templates(self, bank, changes=None):
+        """
+        登记新的模板特征库（可在其他线程中调用，如 TemplateWatcher 的回调）
+        替换在下一次识别开始前进行，进行中的识别始终使用完整的旧模板集；之后画面视为已变化：
+        - 只删除了模板时，只重新匹配上次识别为已删除模板的方块，其余方块沿用结果
+        - 新增或修改了模板时，任何方块都可能改为匹配该模板（包括修正前被误识别为其他模板的方块），整盘重新匹配一次
+        :param bank: 新特征库（TemplateBank.updated 的结果）
+        :param changes: 变化的模板名 {'added', 'changed', 'removed'}
+        """
+        changes = changes or {}
+        with self._template_lock:
+            pending = self._template_update
+            changed, removed = set(changes.get('changed', ())), set(changes.get('removed', ()))
+            rematch_all = bool(changes.get('added') or changed)
+            if pending is not None:  # 上一次更新尚未替换，合并变化的模板名
+                changed |= pending[1]
+                removed |= pending[2]
+                rematch_all |= pending[3]
+            self._template_update = (bank, changed, removed, rematch_all)
+        self.change_detector.reset()
+
+    def _apply_template_update(self):
+        """在识别线程中替换模板特征库和匹配引擎（没有待替换的更新时立即返回）"""
+        if self._template_update is None:
+            return
+        with self._template_lock:
+            (bank, changed, removed, rematch_all), self._template_update = self._template_update, None
+        self.templates = bank.scaled(self.template_scale)
+        self.matcher = self.matcher.updated(bank.scaled(self.matcher.bank.scale), changed)
+        self._matchers = {self.template_scale: self.matcher}  # 其余层的匹配引擎和校准引擎用到时重新建立
+        self._calibrators = {}
+        if self.calibrator is not None:
+            self.calibrator = PyramidCalibrator(self.templates)
+        self.block_h, self.block_w = self.templates.size
+        if rematch_all:
+            self._cell_signatures = None
+        rematch = LABELS.encode(sorted(removed))
+        if self._rematch is not None:
+            rematch = np.union1d(rematch, self._rematch)
+        self._rematch = rematch
+
+    def _locate_scaled(self, screen_img):
+        """
+        在模板金字塔各层中定位最匹配的模板
+        按 _scale_candidates 的顺序尝试，精匹配得分达到 scale_exact 时直接采用；
+        达到 scale_accept 后只向相邻比例爬山，直到得分不再提高（相邻层的得分也可能达到该阈值）；
+        金字塔各层均未达到时再尝试阶梯两端外推的 scale_extend 层（画面比例可能超出金字塔范围），
+        仍未达到时若最佳比例在阶梯端点，继续以 scale_refine 为步长向外细化
+        :return: (缩放比例, 该层的校准引擎, PyramidCalibrator.locate 的结果)，均未找到时结果为 None
+        """
+        results = {}
+
+        def locate(scale):
+            if scale not in results:
+                calibrator = self._calibrators.get(scale)
+                if calibrator is None:
+                    calibrator = self._calibrators[scale] = PyramidCalibrator(self.templates.scaled(scale))
+                results[scale] = (calibrator, calibrator.locate(screen_img))
+            return results[scale][1][2] if results[scale][1] is not None else -1.0
+
+        def climb(scale, neighbors, gain=0.0):
+            while True:
+                step = max(neighbors(scale), key=locate, default=None)
+                if step is None or locate(step) <= locate(scale) + gain:
+                    return scale
+                scale = step
+
+        def refine(scale):
+            return [s for s in (round(scale - self.scale_refine, 4), round(scale + self.scale_refine, 4)) if s > 0]
+
+        ladder = sorted(set(self.template_scales) | {self.template_scale})
+        extension = self._scale_extension(ladder)
+        ladder = sorted(set(ladder) | set(extension))
+        for scale in self._scale_candidates() + extension:
+            if locate(scale) < self.scale_accept:
+                continue
+            if locate(scale) >= self.scale_exact:
+                return (scale,) + results[scale]  # 几乎完全吻合（通常是系统缩放比例），不再爬山
+            # 先在金字塔各层间爬山，再以 scale_refine 为步长细化（画面比例不一定正好落在某一层上）；
+            # 偏小的模板在精匹配窗口内总略占优，细化只在得分明显提高时才采用
+            scale = climb(scale, lambda s: [ladder[j] for j in (ladder.index(s) - 1, ladder.index(s) + 1)
+                                            if 0 <= j < len(ladder)])
+            if self.scale_refine:
+                scale = climb(scale, refine, gain=0.01)
+            return (scale,) + results[scale]
+        if not results:
+            return self.template_scale, None, None
+        scale = max(results, key=locate)
+        if self.scale_refine and not min(self.template_scales) < scale < max(self.template_scales):
+            scale = climb(scale, refine, gain=0.01)
+        return (scale,) + results[scale]
+
+    def _scale_extension(self, ladder):
+        """
+        阶梯两端外推的缩放比例：按两端相邻层的比值各向外延伸 scale_extend 层
+        :param ladder: 升序排列的缩放比例
+        :return: [较小的比例..., 较大的比例...]，由近到远
+        """
+        if len(ladder) < 2:
+            return []
+        low, high = ladder[0] / ladder[1], ladder[-1] / ladder[-2]
+        return ([round(ladder[0] * low ** k, 4) for k in range(1, self.scale_extend + 1)] +
+                [round(ladder[-1] * high ** k, 4) for k in range(1, self.scale_extend + 1)])
+
     def _auto_calibrate(self, screen_img):
-        """并行匹配多模板进行校准"""
-        debug_img = screen_img.copy()
-    
-        def match_template(name, template):
-            res = cv2.matchTemplate(screen_img, template, cv2.TM_CCOEFF_NORMED)
-            _, max_val, _, max_loc = cv2.minMaxLoc(res)
-            return name, template, max_val, max_loc
-    
-        # 并行匹配所有非空白模板
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for name, template in self.templates.items():
-                if name == "None":
-                    continue
-                futures.append(executor.submit(match_template, name, template))
-    
-            # 找到匹配值最高的模板
-            best_match = None
-            best_val = -1
-            for future in futures:
-                name, template, max_val, max_loc = future.result()
-                if max_val > best_val:
-                    best_val = max_val
-                    best_match = (name, template, max_loc)
+        """由粗到精匹配多模板进行校准（同时选定模板金字塔的层）"""
+        # 缩小画面粗匹配全部非空白模板，只对最佳候选做原分辨率精匹配
+        scale, calibrator, located = self._locate_scaled(screen_img)
+        best_val = located[2] if located else -1
     
         if best_val < 0.6:
-            cv2.imwrite("debug_failed_calibration.png", debug_img)
+            cv2.imwrite("debug_failed_calibration.png", screen_img)
             raise Exception("校准失败：未找到匹配的模板")
+        low, high = min(self.template_scales), max(self.template_scales)
+        if not low < scale < high:
+            # 落在金字塔端点或之外：得分不高时很可能锁定在错误的比例上（间隙和行列数随之出错），不予采用
+            if best_val < self.scale_accept:
+                cv2.imwrite("debug_failed_calibration.png", screen_img)
+                raise Exception(f"校准失败：画面缩放比例可能超出模板金字塔范围 {low:g}-{high:g}"
+                                f"（最佳比例 {scale:g}，得分 {best_val:.2f}）")
+            print(f"警告: 画面缩放比例 {scale:g} 位于模板金字塔范围 {low:g}-{high:g} 的边缘或之外")
     
-        # 使用最佳匹配模板进行校准
-        name, template, max_loc = best_match
+        # 使用最佳匹配模板进行校准，之后按该层的原尺寸切片匹配
+        self._use_scale(scale)
+        self.calibrator = calibrator
+        name, template, _, max_loc = located
         self.start_x, self.start_y = max_loc
         roi = screen_img[self.start_y:self.start_y + self.block_h,
               self.start_x:self.start_x + self.block_w]
@@ -96,124 +309,374 @@ class BlockRecognizer:
         if local_max_val < 0.7:
             raise Exception("二次校准失败")
 
-        cv2.rectangle(debug_img, (int(self.start_x), int(self.start_y)), (int(self.start_x + self.block_w), int(self.start_y + self.block_h)), (0, 255, 0), 3)
+        # 从画面估计间隙和棋盘行列数，并保存校准档案
+        self._estimate_grid(screen_img)
+        self._save_profile(screen_img, name)
+
         # 显示校准结果
-        self.debug_window.update(debug_img, f"校准成功（使用模板: {name}）")
+        box = (self.start_x, self.start_y, self.start_x + self.block_w, self.start_y + self.block_h)
+        self.debug_window.show(screen_img, info=f"校准成功（使用模板: {name}）", boxes=[(box, (0, 255, 0), 3)],
+                               force=True)
         self.calibrated = True
-        print(f"校准成功: 使用模板 '{name}'，起点({self.start_x}, {self.start_y}) 横向间隙{self.h_gap} 纵向间隙{self.v_gap}")
+        print(f"校准成功: 使用模板 '{name}'（缩放 {self.template_scale:g}），起点({self.start_x}, {self.start_y}) "
+              f"横向间隙{self.h_gap} 纵向间隙{self.v_gap} 网格{self.grid_cols}x{self.grid_rows}")
+
+    def _estimate_grid(self, screen_img):
+        """
+        估计网格几何参数
+        - 间隙：画面梯度投影的自相关周期减去方块尺寸
+        - 行列数：整个网格批量匹配，取评分达到 grid_confidence 的方块的外接范围
+        """
+        pitch_x = estimate_pitch(screen_img, self.block_w, axis=1)
+        pitch_y = estimate_pitch(screen_img, self.block_h, axis=0)
+        if pitch_x is not None:
+            self.h_gap = pitch_x - self.block_w
+        if pitch_y is not None:
+            self.v_gap = pitch_y - self.block_h
+
+        self.grid_origin = None
+        geometry = self._lattice_geometry(screen_img.shape)
+        col0, row0, cols, rows = geometry[:4]
+        if cols == 0 or rows == 0:
+            return
+        cells = self._slice_lattice(screen_img, geometry)
+        _, confidences = self._match_blocks(self._gather_cells(cells))
+        found = (confidences >= self.grid_confidence).reshape(rows, cols)
+        if not found.any():
+            return
+        found_rows = np.flatnonzero(found.any(axis=1))
+        found_cols = np.flatnonzero(found.any(axis=0))
+        self.grid_origin = (col0 + int(found_cols[0]), row0 + int(found_rows[0]))
+        self.grid_cols = int(found_cols[-1] - found_cols[0] + 1)
+        self.grid_rows = int(found_rows[-1] - found_rows[0] + 1)
+
+    def calibration_params(self):
+        """
+        当前校准参数（可序列化为 JSON，用于校准档案和会话录制）
+        :return: {'start_x', 'start_y', 'block_w', 'block_h', 'template_scale', 'h_gap', 'v_gap',
+                  'grid_cols', 'grid_rows', 'grid_origin'}
+        """
+        return {
+            'start_x': int(self.start_x), 'start_y': int(self.start_y),
+            'block_w': int(self.block_w), 'block_h': int(self.block_h),
+            'template_scale': self.template_scale,
+            'h_gap': int(self.h_gap), 'v_gap': int(self.v_gap),
+            'grid_cols': self.grid_cols, 'grid_rows': self.grid_rows,
+            'grid_origin': list(self.grid_origin) if self.grid_origin else None,
+        }
+
+    def apply_calibration(self, params):
+        """
+        直接使用给定的校准参数（不做匹配验证），标记为已校准
+        :param params: calibration_params() 的结果
+        """
+        self._use_scale(params.get('template_scale', 1.0))
+        self.start_x, self.start_y = params['start_x'], params['start_y']
+        self.h_gap, self.v_gap = params['h_gap'], params['v_gap']
+        self.grid_cols, self.grid_rows = params['grid_cols'], params['grid_rows']
+        self.grid_origin = tuple(params['grid_origin']) if params['grid_origin'] else None
+        self._cell_signatures = None
+        self.calibrated = True
+
+    def _save_profile(self, screen_img, template_name):
+        """保存校准档案（按区域尺寸和缩放比例区分）"""
+        if not self.use_profiles:
+            return
+        try:
+            self.profiles.put(self.profiles.key(screen_img, self.scale),
+                              dict(self.calibration_params(), template=template_name))
+        except OSError as e:
+            print(f"警告: 无法保存校准档案 {e}")
+
+    def _load_profile(self, screen_img):
+        """
+        读取校准档案，并用一次匹配验证起点方块仍与网格对齐
+        :return: 是否已使用档案完成校准
+        """
+        if not self.use_profiles:
+            return False
+        key = self.profiles.key(screen_img, self.scale)
+        profile = self.profiles.get(key)
+        if not profile:
+            return False
+
+        self._use_scale(profile.get('template_scale', 1.0))
+        x, y = profile['start_x'], profile['start_y']
+        w, h = self.block_w, self.block_h
+        roi = screen_img[y:y + h, x:x + w]
+        if roi.shape[:2] != (h, w):
+            return False
+        # 起点方块可能已被消除，按当前内容匹配最接近的模板再验证对齐程度
+        names, _ = self._match_blocks(roi[None])
+        if names[0] not in self.templates:
+            return False
+        res = cv2.matchTemplate(roi, self.templates[names[0]], cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, _ = cv2.minMaxLoc(res)
+        if max_val < 0.7:
+            return False
+
+        self.apply_calibration(profile)
+        print(f"使用校准档案 {key}: 起点({x}, {y}) 横向间隙{self.h_gap} 纵向间隙{self.v_gap} "
+              f"网格{self.grid_cols}x{self.grid_rows}")
+        return True
 
     def _find_all_blocks(self, screen_img):
-        """从校准方块开始，向四周逐个遍历，找到所有方块"""
-        positions = {}  # 存储方块位置 {(col, row): (x1, y1, x2, y2)}
-        visited = set()  # 记录已访问的方块
-    
+        """
+        找到所有方块
+        规则网格直接按校准参数切片并整体匹配；网格切片失败或布局不规则时退回逐层扩展
+        """
+        if self.layout == "lattice":
+            positions = self._find_blocks_lattice(screen_img)
+            if positions is not None:
+                return positions
+        return self._find_blocks_bfs(screen_img)
+
+    def _lattice_geometry(self, img_shape):
+        """
+        计算规则网格中完整落在图像内的方块范围
+        :param img_shape: 图像尺寸
+        :return: (首列号, 首行号, 列数, 行数, 首个方块x, 首个方块y)，列号行号相对校准方块
+        """
+        img_h, img_w = img_shape[:2]
+        pitch_x = self.block_w + self.h_gap
+        pitch_y = self.block_h + self.v_gap
+        start_x, start_y = int(self.start_x), int(self.start_y)
+
+        # 从校准方块向左、向上回退到图像内的第一个方块
+        left, up = start_x // pitch_x, start_y // pitch_y
+        x0, y0 = start_x - left * pitch_x, start_y - up * pitch_y
+        cols = max(0, (img_w - x0 - self.block_w) // pitch_x + 1)
+        rows = max(0, (img_h - y0 - self.block_h) // pitch_y + 1)
+        col0, row0 = -left, -up
+
+        # 已检测到棋盘范围时，只保留棋盘内的方块
+        if self.grid_origin is not None:
+            first_col = max(col0, self.grid_origin[0])
+            first_row = max(row0, self.grid_origin[1])
+            cols = max(0, min(col0 + cols, self.grid_origin[0] + self.grid_cols) - first_col)
+            rows = max(0, min(row0 + rows, self.grid_origin[1] + self.grid_rows) - first_row)
+            x0 += (first_col - col0) * pitch_x
+            y0 += (first_row - row0) * pitch_y
+            col0, row0 = first_col, first_row
+        return col0, row0, cols, rows, x0, y0
+
+    def _slice_lattice(self, screen_img, geometry):
+        """
+        以跨步视图取出网格中的所有方块（零拷贝）
+        :return: 视图 (rows, cols, block_h, block_w, 3)
+        """
+        _, _, cols, rows, x0, y0 = geometry
+        s_y, s_x, s_c = screen_img.strides
+        return np.lib.stride_tricks.as_strided(
+            screen_img[y0:, x0:],
+            shape=(rows, cols, self.block_h, self.block_w, screen_img.shape[2]),
+            strides=((self.block_h + self.v_gap) * s_y, (self.block_w + self.h_gap) * s_x, s_y, s_x, s_c),
+            writeable=False)
+
+    def _find_blocks_lattice(self, screen_img):
+        """
+        按规则网格切片并一次批量匹配所有方块
+        :return: 棋盘状态 BoardState，校准方块不在图像内时返回 None
+        """
+        geometry = self._lattice_geometry(screen_img.shape)
+        col0, row0, cols, rows, x0, y0 = geometry
+        if not (0 <= -col0 < cols and 0 <= -row0 < rows):
+            return None
+
+        cells = self._slice_lattice(screen_img, geometry)
+        labels, confidences, _ = self._match_changed_cells(cells, geometry)
+        return BoardState.from_lattice(labels, confidences, geometry, self.block_w, self.block_h,
+                                       self.block_w + self.h_gap, self.block_h + self.v_gap)
+
+    def _gather_cells(self, cells, index=None):
+        """
+        将网格视图中的方块复制为缓冲区池中的连续张量
+        :param cells: _slice_lattice 的视图 (rows, cols, block_h, block_w, 3)
+        :param index: 按行排列的方块下标，默认为全部方块
+        :return: 方块张量 (M, block_h, block_w, 3)
+        """
+        rows, cols = cells.shape[:2]
+        if index is None:
+            out = self.buffers.get("cells.blocks", (rows * cols,) + cells.shape[2:])
+            np.copyto(out.reshape(cells.shape), cells)
+            return out
+        out = self.buffers.get("cells.blocks", (len(index),) + cells.shape[2:])
+        for i, (r, c) in enumerate(zip(*np.divmod(index, cols))):
+            out[i] = cells[r, c]
+        return out
+
+    def _match_changed_cells(self, cells, geometry):
+        """
+        增量匹配：比较每个方块与上一帧的缩略图，只重新匹配变化的方块
+        :param cells: 网格方块视图 (rows, cols, block_h, block_w, 3)
+        :param geometry: 网格参数（见 _lattice_geometry）
+        :return: (方块编号数组 (N,)，未识别为 EMPTY；置信度数组 (N,)；已重新匹配的方块下标)，N = rows × cols
+        """
+        col0, row0, cols = geometry[:3]
+        n = cells.shape[0] * cells.shape[1]
+        inst = self.instruments
+        # 方块缩略图：每隔 6 像素取样，足以反映方块替换或消除；在两块缓冲区间交替写入，另一块保留上一帧
+        with inst.stage("extract"):
+            sampled = cells[:, :, ::6, ::6]
+            self._signature_slot ^= 1
+            signatures = self.buffers.get(f"cells.signatures.{self._signature_slot}",
+                                          (n,) + sampled.shape[2:], np.int16)
+            np.copyto(signatures.reshape(sampled.shape), sampled)
+        inst.value("bytes.signatures", signatures.nbytes)
+        labels = np.full(n, EMPTY, dtype=np.int16)
+        confidences = np.zeros(n, dtype=np.float32)
+        changed = np.ones(n, dtype=bool)
+
+        previous = self._cell_signatures
+        if self.incremental and self.last_state and previous is not None and previous[0] == geometry:
+            diff = self.buffers.get("cells.diff", signatures.shape, np.int16)
+            np.subtract(signatures, previous[1], out=diff)
+            np.abs(diff, out=diff)
+            diff = diff.reshape(n, -1).mean(axis=1)
+            # 未变化的方块按网格坐标从上一帧的棋盘状态中取编号和置信度
+            prev = BoardState.from_dict(self.last_state)
+            stable = np.flatnonzero(diff <= self.change_threshold)
+            r, c = np.divmod(stable, cols)
+            pr, pc = r + row0 - prev.row0, c + col0 - prev.col0
+            inside = (pr >= 0) & (pr < prev.shape[0]) & (pc >= 0) & (pc < prev.shape[1])
+            stable, pr, pc = stable[inside], pr[inside], pc[inside]
+            old = prev.labels[pr, pc]
+            keep = old != EMPTY
+            if self._rematch is not None:
+                keep &= ~np.isin(old, self._rematch)
+            stable = stable[keep]
+            labels[stable] = old[keep]
+            confidences[stable] = prev.confidence[pr[keep], pc[keep]]
+            changed[stable] = False
+        self._cell_signatures = (geometry, signatures)
+        self._rematch = None
+
+        recomputed = np.flatnonzero(changed)
+        if recomputed.size:
+            with inst.stage("extract"):
+                changed_cells = self._gather_cells(cells, recomputed if recomputed.size < n else None)
+            inst.value("bytes.cells", changed_cells.nbytes)
+            names, confidences[recomputed] = self._match_blocks(changed_cells)
+            labels[recomputed] = LABELS.encode(names)
+
+        stats = self.recognition_stats
+        stats['frames'] += 1
+        stats['recomputed'] += int(recomputed.size)
+        stats['reused'] += n - int(recomputed.size)
+        return labels, confidences, recomputed
+
+    def _find_blocks_bfs(self, screen_img):
+        """
+        从校准方块开始，逐层向四周扩展，每一层的方块批量匹配
+        :return: 棋盘状态 BoardState
+        """
+        positions = {}  # 存储方块位置 {(col, row): {'name', 'coordinate'}}
+        confidences = {}  # {(col, row): 置信度}
+        visited = {(0, 0)}  # 记录已入队的方块，每个方块只匹配一次
+        img_h, img_w = screen_img.shape[:2]
+
         # 定义方向：右、左、下、上
         directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]
-    
-        # 初始化队列：从校准方块开始
-        queue = [(0, 0, int(self.start_x), int(self.start_y))]  # (col, row, x, y)
-    
-        while queue:
-            col, row, x, y = queue.pop(0)
-            if (col, row) in visited:
-                continue
-            visited.add((col, row))
-    
-            # 截取方块区域
-            x1, y1 = int(x), int(y)
-            x2, y2 = int(x + self.block_w), int(y + self.block_h)
-    
-            # 检查坐标是否在图像范围内
-            if x1 < 0 or y1 < 0 or x2 > screen_img.shape[1] or y2 > screen_img.shape[0]:
-                continue
-    
-            # 截取方块图像
-            block = screen_img[y1:y2, x1:x2]
-            if block.size == 0:
-                continue
-    
-            # 匹配方块
-            best_match, confidence = self._match_block(block)
-            if best_match == "unknown":
-                continue  # 如果匹配结果为未知，停止向该方向扩展
-    
-            # 记录方块位置
-            positions[(col, row)] = {
-                'name': best_match,
-                'coordinate': (x1, y1, x2, y2)
-            }
-    
-            # 向四周扩展
-            for dx, dy in directions:
-                new_col = col + dx
-                new_row = row + dy
-                new_x = x + dx * (self.block_w + self.h_gap)
-                new_y = y + dy * (self.block_h + self.v_gap)
-                queue.append((new_col, new_row, int(new_x), int(new_y)))
-    
-        return positions
 
-    def _recognize_blocks(self, screen_img):
-        """识别所有方块"""
-        debug_img = screen_img.copy()
-    
+        # 初始化当前层：从校准方块开始
+        frontier = [(0, 0, int(self.start_x), int(self.start_y))]  # (col, row, x, y)
+
+        while frontier:
+            cells, blocks = [], []
+            for col, row, x, y in frontier:
+                x2, y2 = x + self.block_w, y + self.block_h
+
+                # 检查坐标是否在图像范围内
+                if x < 0 or y < 0 or x2 > img_w or y2 > img_h:
+                    continue
+                cells.append((col, row, x, y))
+                blocks.append(screen_img[y:y2, x:x2])
+
+            # 整层方块一次匹配
+            names, scores = self._match_blocks(blocks)
+
+            frontier = []
+            for (col, row, x, y), name, score in zip(cells, names, scores):
+                if name == "unknown":
+                    continue  # 如果匹配结果为未知，停止向该方向扩展
+
+                # 记录方块位置
+                positions[(col, row)] = {
+                    'name': name,
+                    'coordinate': (x, y, x + self.block_w, y + self.block_h)
+                }
+                confidences[(col, row)] = score
+
+                # 向四周扩展
+                for dx, dy in directions:
+                    key = (col + dx, row + dy)
+                    if key in visited:
+                        continue
+                    visited.add(key)
+                    frontier.append((col + dx, row + dy,
+                                     x + dx * (self.block_w + self.h_gap),
+                                     y + dy * (self.block_h + self.v_gap)))
+
+        return BoardState.from_dict(positions, confidences)
+
+    def _recognize_blocks(self, screen_img, render=True):
+        """
+        识别所有方块
+        :param render: 是否在调试窗口中绘制识别结果（流水线模式下由显示线程负责绘制）
+        """
+        self._apply_template_update()
         # 获取所有方块的位置
         positions = self._find_all_blocks(screen_img)
-    
-        for _, value in positions.items():
-            name = value['name']
-            x1, y1, x2, y2 = value['coordinate']
-            if value['name'] != "None":
-                # 绘制方块的矩形框
-                cv2.rectangle(debug_img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-                
-                # 添加文字标注（带背景矩形）
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                font_scale = 0.4
-                font_thickness = 1
-                text_size, _ = cv2.getTextSize(name, font, font_scale, font_thickness)
-        
-                # 计算背景矩形位置
-                text_x = int(x1) + 5
-                text_y = int(y1) + 20
-                bg_x1 = text_x
-                bg_y1 = text_y - text_size[1]
-                bg_x2 = text_x + text_size[0]
-                bg_y2 = text_y
-        
-                # 绘制背景矩形
-                cv2.rectangle(debug_img, (bg_x1, bg_y1), (bg_x2, bg_y2), (255, 255, 255), -1)  # 白色背景
-        
-                # 绘制文字
-                cv2.putText(debug_img, name, (text_x, text_y), font, font_scale, (0, 0, 0), font_thickness)
-    
-        self.debug_window.update(debug_img, "识别完成")
+        if render:
+            self._render_blocks(screen_img, positions, "识别完成")
         return positions
 
+    def _render_blocks(self, screen_img, positions, info=""):
+        """在调试窗口中绘制识别结果（标注由调试窗口在后台线程中绘制，超过显示帧率的帧被跳过）"""
+        self.debug_window.show(screen_img, positions, info)
+
+    def _match_blocks(self, blocks):
+        """
+        批量匹配多个方块
+        :param blocks: 方块图像列表或 (N, 82, 78, 3) 数组
+        :return: (名称数组, 置信度数组)
+        """
+        inst = self.instruments
+        with inst.stage("match"):
+            names, confidences = self.matcher.match(blocks)
+        if inst.enabled:
+            inst.count("match.cells", len(names))
+            inst.count_all(names, "match.")
+        return names, confidences
+
     def _match_block(self, block):
-        """多维度特征匹配"""
+        """
+        多维度特征匹配（逐模板的参考实现，批量路径见 BatchMatcher）
+        :param block: 按当前模板层尺寸切出的原尺寸区块
+        """
         best_match = "unknown"
         max_confidence = 0
+        bank = self.templates
+        if block.shape[:2] != bank.size:  # 模板已按校准选定的比例缩放，区块不再缩放
+            return best_match, max_confidence
 
-        # 统一区块尺寸（解决缩放问题）
-        resized_block = cv2.resize(block, (78, 82))
+        # 区块特征只计算一次，模板特征取自预计算的特征库
+        gray_block = cv2.cvtColor(block, cv2.COLOR_BGR2GRAY)
+        hist_block = cv2.calcHist([block], [0,1,2], None, [8,8,8], [0,256]*3)
+        hist_scores = bank.hist_vecs @ features.normalize_rows(hist_block.reshape(1, -1))[0]
 
-        for name, template in self.templates.items():
+        for i, name in enumerate(bank.names):
             # if name == "None":
             #     continue
 
             # 特征1: 结构相似性（SSIM）
-            gray_block = cv2.cvtColor(resized_block, cv2.COLOR_BGR2GRAY)
-            gray_template = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
-            ssim_score = ssim(gray_block, gray_template)
+            ssim_score = features.structural_similarity(gray_block, bank.grays[i])
 
-            # 特征2: 颜色直方图
-            hist_block = cv2.calcHist([resized_block], [0,1,2], None, [8,8,8], [0,256]*3)
-            hist_template = cv2.calcHist([template], [0,1,2], None, [8,8,8], [0,256]*3)
-            hist_score = cv2.compareHist(hist_block, hist_template, cv2.HISTCMP_CORREL)
+            # 特征2: 颜色直方图（相关系数）
+            hist_score = float(hist_scores[i])
 
             # 特征3: 模板匹配
-            match_result = cv2.matchTemplate(resized_block, template, cv2.TM_CCOEFF_NORMED)
+            match_result = cv2.matchTemplate(block, bank.images[i], cv2.TM_CCOEFF_NORMED)
             _, template_score, _, _ = cv2.minMaxLoc(match_result)
 
             # 综合评分（可调节权重）
@@ -225,96 +688,64 @@ class BlockRecognizer:
 
         return best_match, max_confidence
 
-    def _highlight_removable_pairs(self, screen_img):
-        """高亮显示所有可消除的方块对"""
-        debug_img = screen_img.copy()
-        removable_pairs = []
+    def _pair_finder(self, state=None):
+        """
+        获取与棋盘状态对应的可消除对查找引擎（识别结果不变时复用）
+        :param state: 棋盘状态，默认为 last_state；其他线程发布 last_state 时应传入显示的状态
+        :return: PairFinder，其 state 属性为查找所依据的 BoardState
+        """
+        if state is None:
+            state = self.last_state = BoardState.from_dict(self.last_state)
+        cached = self._finder
+        if cached is not None and cached[0] is state:
+            return cached[1]
+        # 以传入的原对象为键缓存（字典状态每次包装都是新的 BoardState，不能用包装后的对象比较）
+        finder = PairFinder(BoardState.from_dict(state), self.max_turns, self.edge_routes)
+        self._finder = (state, finder)
+        return finder
+
+    def _highlight_removable_pairs(self, screen_img, state=None):
+        """
+        高亮显示所有可消除的方块对
+        :param screen_img: 要绘制的帧
+        :param state: 该帧的识别结果，默认为 last_state
+        """
+        inst = self.instruments
+        with inst.stage("pairs"):
+            finder = self._pair_finder(state)
+            removable_pairs = finder.removable_pairs()
+        state = finder.state  # 查找、求解和绘制都使用同一份识别结果
 
-        # 检查所有可能的方块对
-        positions = list(self.last_state.keys())
-        for i in range(len(positions)):
-            for j in range(i + 1, len(positions)):
-                pos1, pos2 = positions[i], positions[j]
-                if self.check_elimination(pos1, pos2):
-                    removable_pairs.append((pos1, pos2))
+        # 优先提示整盘求解顺序的第一步，避免贪心选择导致棋盘无法清空
+        hint = removable_pairs[:1]
+        if self.solve_budget > 0 and removable_pairs:
+            with inst.stage("solve"):
+                result = self.solve_board(self.solve_budget, state)
+            print(f"求解: {result.summary()}")
+            hint = result.sequence[:1] or hint
 
-        # 高亮显示可消除的方块对
-        for pos1, pos2 in removable_pairs[:1]:
-            x1, y1, x2, y2 = self.last_state[pos1]['coordinate']
-            cv2.rectangle(debug_img, (int(x1), int(y1)), (int(x2), int(y2)), (255, 255, 0), 3)  # 青色框
-            x1, y1, x2, y2 = self.last_state[pos2]['coordinate']
-            cv2.rectangle(debug_img, (int(x1), int(y1)), (int(x2), int(y2)), (255, 255, 0), 3)  # 青色框
+        # 高亮显示可消除的方块对（青色框）
+        boxes = [(state[pos]['coordinate'], (255, 255, 0), 3) for pair in hint for pos in pair]
+        self.debug_window.show(screen_img, info=f"可消除的方块对: {len(removable_pairs)} 对", boxes=boxes, force=True)
 
-        self.debug_window.update(debug_img, f"可消除的方块对: {len(removable_pairs)} 对")
+    def solve_board(self, time_budget=1.0, state=None):
+        """
+        搜索清空当前棋盘的消除顺序
+        :param time_budget: 时间预算（秒）
+        :param state: 要求解的棋盘状态，默认为 last_state
+        :return: SolveResult（含消除顺序、搜索深度、节点速度、置换表命中率）
+        """
+        return BoardSolver(self.max_turns, self.edge_routes).solve(self.last_state if state is None else state,
+                                                                   time_budget)
 
-    def check_elimination(self, pos1, pos2):
+    def check_elimination(self, pos1, pos2, state=None):
         """
         检查两个方块是否可以消除
         :param pos1: 第一个方块的网格坐标 (col1, row1)
         :param pos2: 第二个方块的网格坐标 (col2, row2)
+        :param state: 要检查的棋盘状态 BoardState（或字典形式），默认为 last_state
         :return: 是否可以消除
         """
-        # 基础检查：类型相同且不为空
-        if self.last_state[pos1]['name'] != self.last_state[pos2]['name']:
-            return False
-        if self.last_state[pos1]['name'] == "None" or self.last_state[pos2]['name'] == "None":
-            return False
-    
-        # 检查直接相连的直线路径
-        if self._is_directly_connected(pos1, pos2):
-            return True
-    
-        # 检查单拐点路径（两种类型）
-        return (self._check_corner_path(pos1, pos2) or
-                self._check_corner_path(pos2, pos1))
-    
-    def _is_directly_connected(self, pos1, pos2):
-        """检查直线连通性"""
-        col1, row1 = pos1
-        col2, row2 = pos2
-    
-        if col1 == col2:
-            return self._is_vertical_clear(col1, row1, row2)
-        if row1 == row2:
-            return self._is_horizontal_clear(col1, row1, col2)
-        return False
-    
-    def _check_corner_path(self, posA, posB):
-        """检查拐点路径（A->拐点->B）"""
-        colA, rowA = posA
-        colB, rowB = posB
-    
-        # 水平拐点检查（A先水平移动，再垂直移动）
-        if self._is_horizontal_clear(colA, rowA, colB) and \
-                self._is_vertical_clear(colB, rowA, rowB) and \
-                self.last_state.get((colB, rowA), {}).get('name') == "None":
-            return True
-    
-        # 垂直拐点检查（A先垂直移动，再水平移动）
-        if self._is_vertical_clear(colA, rowA, rowB) and \
-                self._is_horizontal_clear(colA, rowB, colB) and \
-                self.last_state.get((colA, rowB), {}).get('name') == "None":
-            return True
-    
-        return False
-    
-    def _is_horizontal_clear(self, start_col, row, end_col):
-        """检查水平路径是否畅通"""
-        if start_col == end_col:
-            return True
-        step = 1 if end_col > start_col else -1
-        for col in range(start_col + step, end_col, step):
-            if self.last_state.get((col, row), {}).get('name') != "None":
-                return False
-        return True
-    
-    def _is_vertical_clear(self, col, start_row, end_row):
-        """检查垂直路径是否畅通"""
-        if start_row == end_row:
-            return True
-        step = 1 if end_row > start_row else -1
-        for row in range(start_row + step, end_row, step):
-            if self.last_state.get((col, row), {}).get('name') != "None":
-                return False
-        return True
-                
\ No newline at end of file
+        if state is not None and state is not self.last_state:
+            return PairFinder(state, self.max_turns, self.edge_routes).can_eliminate(pos1, pos2)
+        return self._pair_finder().can_eliminate(pos1, pos2)
@@ -0,0 +1,286 @@
+import json
+import struct
+import threading
+import numpy as np
+from collections.abc import Mapping
+
+EMPTY = -1  # 没有方块（未识别或超出棋盘）的格子编号
+NONE_ID = 0  # 空白方块 "None" 的编号
+
+class LabelTable:
+    """
+    方块名称与编号的对照表（进程内共享，编号按首次出现的顺序分配）
+    "None" 固定为 0，未识别的 "unknown" 对应 EMPTY
+    """
+
+    def __init__(self):
+        self.names = ["None"]
+        self.ids = {"None": NONE_ID}
+        self._lock = threading.Lock()
+
+    def id(self, name):
+        """名称对应的编号（新名称自动分配）"""
+        label = self.ids.get(name)
+        if label is None:
+            if name == "unknown":
+                return EMPTY
+            with self._lock:
+                label = self.ids.get(name)
+                if label is None:
+                    label = self.ids[name] = len(self.names)
+                    self.names.append(name)
+        return label
+
+    def encode(self, names):
+        """名称序列转为编号数组 (N,)，int16"""
+        ids = self.ids
+        return np.fromiter((ids[n] if n in ids else self.id(n) for n in names), dtype=np.int16, count=len(names))
+
+    def name(self, label):
+        """编号对应的名称，EMPTY 为 None"""
+        return self.names[label] if label >= 0 else None
+
+
+LABELS = LabelTable()  # 默认的共享名称表
+
+
+class BoardState(Mapping):
+    """
+    紧凑的棋盘状态：以数组保存整盘识别结果
+    - labels: 方块编号 (rows, cols)，int16，EMPTY 表示没有方块
+    - confidence: 匹配置信度 (rows, cols)，float32
+    - coords: 方块像素坐标 (rows, cols, 4)，int32，依次为 x1, y1, x2, y2
+    - col0, row0: labels[0, 0] 对应的网格坐标（相对校准方块，可为负）
+    同时是只读的 {(col, row): {'name', 'coordinate'}} 映射，兼容原有的字典形式
+    哈希和相等只比较网格位置、方块类型和坐标，不含置信度；作为字典键使用时不应再修改数组
+    """
+    __slots__ = ("col0", "row0", "labels", "confidence", "coords", "table")
+    MAGIC = b"BST1"
+    _HEADER = struct.Struct("<4siiiiI")  # 标识, col0, row0, rows, cols, 名称表字节数
+
+    def __init__(self, col0, row0, labels, confidence=None, coords=None, table=LABELS):
+        """
+        :param labels: 方块编号 (rows, cols)
+        :param confidence: 置信度 (rows, cols)，默认全为 0
+        :param coords: 像素坐标 (rows, cols, 4)，默认全为 0
+        :param table: 名称表 LabelTable
+        """
+        self.col0, self.row0 = int(col0), int(row0)
+        self.labels = np.asarray(labels, dtype=np.int16)
+        shape = self.labels.shape
+        self.confidence = (np.zeros(shape, dtype=np.float32) if confidence is None
+                           else np.asarray(confidence, dtype=np.float32).reshape(shape))
+        self.coords = (np.zeros(shape + (4,), dtype=np.int32) if coords is None
+                       else np.asarray(coords, dtype=np.int32).reshape(shape + (4,)))
+        self.table = table
+
+    @classmethod
+    def empty(cls, col0=0, row0=0, cols=0, rows=0, table=LABELS):
+        """没有方块的棋盘"""
+        return cls(col0, row0, np.full((rows, cols), EMPTY, dtype=np.int16), table=table)
+
+    @classmethod
+    def from_lattice(cls, labels, confidences, geometry, block_w, block_h, pitch_x, pitch_y, table=LABELS):
+        """
+        由规则网格的匹配结果构建
+        :param labels: 方块编号 (rows * cols,)，按行排列
+        :param confidences: 置信度 (rows * cols,)
+        :param geometry: 网格参数 (首列号, 首行号, 列数, 行数, 首个方块x, 首个方块y)
+        """
+        col0, row0, cols, rows, x0, y0 = geometry
+        xs = x0 + pitch_x * np.arange(cols, dtype=np.int32)
+        ys = y0 + pitch_y * np.arange(rows, dtype=np.int32)
+        coords = np.empty((rows, cols, 4), dtype=np.int32)
+        coords[..., 0] = xs[None, :]
+        coords[..., 1] = ys[:, None]
+        coords[..., 2] = coords[..., 0] + block_w
+        coords[..., 3] = coords[..., 1] + block_h
+        return cls(col0, row0, np.reshape(labels, (rows, cols)), confidences, coords, table)
+
+    @classmethod
+    def from_dict(cls, state, confidences=None, table=LABELS):
+        """
+        由字典形式的识别结果构建
+        :param state: {(col, row): {'name': ..., 'coordinate': ...}}
+        :param confidences: 可选的置信度 {(col, row): 置信度}
+        """
+        if isinstance(state, BoardState):
+            return state
+        if not state:
+            return cls.empty(table=table)
+        cols = [col for col, _ in state]
+        rows = [row for _, row in state]
+        col0, row0 = min(cols), min(rows)
+        board = cls.empty(col0, row0, max(cols) - col0 + 1, max(rows) - row0 + 1, table)
+        for (col, row), value in state.items():
+            r, c = row - row0, col - col0
+            board.labels[r, c] = table.id(value['name'])
+            board.coords[r, c] = value['coordinate']
+            if confidences is not None:
+                board.confidence[r, c] = confidences.get((col, row), 0.0)
+        return board
+
+    # ---- 格子查询 ----
+
+    @property
+    def shape(self):
+        """(行数, 列数)"""
+        return self.labels.shape
+
+    def _index(self, pos):
+        """网格坐标 (col, row) 转为数组下标 (r, c)，超出范围时返回 None"""
+        r, c = pos[1] - self.row0, pos[0] - self.col0
+        rows, cols = self.labels.shape
+        if 0 <= r < rows and 0 <= c < cols:
+            return r, c
+        return None
+
+    def label_at(self, pos):
+        """格子的方块编号，没有方块时为 EMPTY"""
+        index = self._index(pos)
+        return EMPTY if index is None else int(self.labels[index])
+
+    def name_at(self, pos):
+        """格子的方块名称，没有方块时为 None"""
+        return self.table.name(self.label_at(pos))
+
+    def coordinate(self, pos):
+        """格子的像素坐标 (x1, y1, x2, y2)"""
+        return tuple(int(v) for v in self.coords[self._index(pos)])
+
+    def positions(self, mask=None):
+        """
+        满足条件的格子坐标（按行排列）
+        :param mask: 布尔数组 (rows, cols)，默认为所有有方块的格子
+        """
+        rs, cs = np.nonzero(self.labels != EMPTY if mask is None else mask)
+        return [(int(c) + self.col0, int(r) + self.row0) for r, c in zip(rs, cs)]
+
+    # ---- 兼容字典形式的只读映射 ----
+
+    def __getitem__(self, pos):
+        index = self._index(pos)
+        if index is None or self.labels[index] == EMPTY:
+            raise KeyError(pos)
+        return {'name': self.table.names[self.labels[index]],
+                'coordinate': tuple(int(v) for v in self.coords[index])}
+
+    def __contains__(self, pos):
+        return self.label_at(pos) != EMPTY
+
+    def __iter__(self):
+        return iter(self.positions())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.labels != EMPTY))
+
+    def to_dict(self):
+        """转为字典形式 {(col, row): {'name', 'coordinate'}}"""
+        return {pos: self[pos] for pos in self.positions()}
+
+    # ---- 复制、比较、哈希 ----
+
+    def copy(self):
+        """复制（三个数组各复制一次，名称表共享）"""
+        return BoardState(self.col0, self.row0, self.labels.copy(), self.confidence.copy(),
+                          self.coords.copy(), self.table)
+
+    def _aligned(self, other):
+        """
+        两个棋盘对齐到共同范围
+        :return: (col0, row0, 本棋盘编号, 另一棋盘编号)，超出各自范围的格子为 EMPTY
+        """
+        (rows_a, cols_a), (rows_b, cols_b) = self.labels.shape, other.labels.shape
+        col0, row0 = min(self.col0, other.col0), min(self.row0, other.row0)
+        cols = max(self.col0 + cols_a, other.col0 + cols_b) - col0
+        rows = max(self.row0 + rows_a, other.row0 + rows_b) - row0
+        grids = []
+        for board, rows_x, cols_x in ((self, rows_a, cols_a), (other, rows_b, cols_b)):
+            grid = np.full((rows, cols), EMPTY, dtype=np.int16)
+            r, c = board.row0 - row0, board.col0 - col0
+            grid[r:r + rows_x, c:c + cols_x] = board.labels
+            grids.append(grid)
+        a, b = grids
+        if other.table is not self.table:
+            b = self._translate(b, other.table)
+        return col0, row0, a, b
+
+    def _translate(self, labels, table):
+        """将另一名称表的编号转换为本名称表的编号"""
+        lookup = np.array([self.table.id(name) for name in table.names] + [EMPTY], dtype=np.int16)
+        return lookup[labels]  # EMPTY (-1) 取到末尾的 EMPTY
+
+    def diff(self, other):
+        """
+        与另一棋盘比较方块类型
+        :return: {(col, row): (本棋盘名称, 另一棋盘名称)}，没有方块的一侧为 None
+        """
+        other = BoardState.from_dict(other, table=self.table)
+        col0, row0, a, b = self._aligned(other)
+        rs, cs = np.nonzero(a != b)
+        names = self.table.names
+        return {(int(c) + col0, int(r) + row0): (names[a[r, c]] if a[r, c] >= 0 else None,
+                                                 names[b[r, c]] if b[r, c] >= 0 else None)
+                for r, c in zip(rs, cs)}
+
+    def __eq__(self, other):
+        if not isinstance(other, BoardState):
+            return Mapping.__eq__(self, other) if isinstance(other, Mapping) else NotImplemented
+        if (self.col0, self.row0) != (other.col0, other.row0) or self.labels.shape != other.labels.shape:
+            return False
+        labels = other.labels if other.table is self.table else self._translate(other.labels, other.table)
+        return bool(np.array_equal(self.labels, labels) and np.array_equal(self.coords, other.coords))
+
+    def __hash__(self):
+        names = self.table.names
+        # 以名称而非编号参与哈希，不同名称表中的相同棋盘哈希一致
+        return hash((self.col0, self.row0, self.labels.shape,
+                     tuple(names[v] if v >= 0 else None for v in self.labels.ravel().tolist()),
+                     self.coords.tobytes()))
+
+    def __repr__(self):
+        rows, cols = self.labels.shape
+        return f"BoardState({cols}x{rows} @ ({self.col0}, {self.row0}), {len(self)} 个方块)"
+
+    # ---- 二进制序列化 ----
+
+    def to_bytes(self):
+        """
+        序列化为字节串：头部 + 用到的名称 (JSON) + 编号、置信度、坐标数组
+        编号按本棋盘用到的名称重新编号，反序列化时映射到目标名称表
+        """
+        used = np.unique(self.labels[self.labels != EMPTY])
+        lookup = np.full(len(self.table.names) + 1, EMPTY, dtype=np.int16)
+        lookup[used] = np.arange(len(used), dtype=np.int16)
+        local = lookup[self.labels]
+        names = json.dumps([self.table.names[v] for v in used.tolist()], ensure_ascii=False).encode("utf-8")
+        rows, cols = self.labels.shape
+        header = self._HEADER.pack(self.MAGIC, self.col0, self.row0, rows, cols, len(names))
+        return b"".join((header, names, local.astype("<i2").tobytes(),
+                         self.confidence.astype("<f4").tobytes(), self.coords.astype("<i4").tobytes()))
+
+    @classmethod
+    def from_bytes(cls, data, table=LABELS):
+        """
+        从 to_bytes 的结果恢复
+        :param table: 目标名称表
+        """
+        magic, col0, row0, rows, cols, name_len = cls._HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError("不是有效的棋盘状态数据")
+        offset = cls._HEADER.size
+        names = json.loads(bytes(data[offset:offset + name_len]).decode("utf-8"))
+        offset += name_len
+        n = rows * cols
+        local = np.frombuffer(data, dtype="<i2", count=n, offset=offset).reshape(rows, cols)
+        offset += 2 * n
+        confidence = np.frombuffer(data, dtype="<f4", count=n, offset=offset).reshape(rows, cols)
+        offset += 4 * n
+        coords = np.frombuffer(data, dtype="<i4", count=4 * n, offset=offset).reshape(rows, cols, 4)
+        lookup = np.array([table.id(name) for name in names] + [EMPTY], dtype=np.int16)
+        return cls(col0, row0, lookup[local], confidence.copy(), coords.copy(), table)
+
+    @property
+    def nbytes(self):
+        """三个数组占用的字节数"""
+        return self.labels.nbytes + self.confidence.nbytes + self.coords.nbytes
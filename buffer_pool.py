@@ -0,0 +1,37 @@
+import numpy as np
+
+class BufferPool:
+    """
+    工作缓冲区池：各阶段按名称取得复用的数组，配合 dst= / out= 参数原地写入，稳定运行后每帧不再分配
+    每个名称对应一块只增不减的连续内存，所需元素数不超过容量时直接返回其前部的视图（形状可变，如变化方块数）
+    同一名称的缓冲区在下次 get() 前有效；不同阶段（包括不同线程中的阶段）应使用不同的名称
+    """
+
+    def __init__(self):
+        self._buffers = {}  # {名称: 一维数组}
+        self.stats = {'allocations': 0, 'reuses': 0}
+
+    def get(self, name, shape, dtype=np.uint8):
+        """
+        取得指定形状的缓冲区（内容未初始化）
+        :param name: 缓冲区名称
+        :return: 连续数组视图
+        """
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        buf = self._buffers.get(name)
+        if buf is None or buf.dtype != dtype or buf.size < size:
+            buf = self._buffers[name] = np.empty(size, dtype=dtype)
+            self.stats['allocations'] += 1
+        else:
+            self.stats['reuses'] += 1
+        return buf[:size].reshape(shape)
+
+    @property
+    def nbytes(self):
+        """池中缓冲区占用的总字节数"""
+        return sum(buf.nbytes for buf in self._buffers.values())
+
+    def clear(self):
+        """释放所有缓冲区"""
+        self._buffers.clear()
@@ -0,0 +1,173 @@
+import os
+import json
+import cv2
+import numpy as np
+
+class PyramidCalibrator:
+    """
+    由粗到精的校准引擎
+    1. 在缩小的灰度画面上匹配缩小的灰度模板（可选：所有模板一次性 FFT 批量相关）
+    2. 只对得分最高的几个候选，在原分辨率彩色画面的小范围内精确匹配
+    """
+
+    def __init__(self, templates, scale=0.25, top_k=3, use_fft=False):
+        """
+        :param templates: 模板字典 {name: image}（空白模板 None 不参与校准）
+        :param scale: 粗匹配的缩放比例
+        :param top_k: 进入精匹配的候选数量
+        :param use_fft: 粗匹配是否使用 FFT 批量相关代替逐模板 matchTemplate
+        """
+        self.templates = {name: img for name, img in templates.items() if name != "None"}
+        self.scale = scale
+        self.top_k = top_k
+        self.use_fft = use_fft
+        self.names = list(self.templates)
+        self.small = np.stack([self._shrink(self.templates[name]) for name in self.names])
+        # FFT 相关只需去均值后的模板及其能量，预先算好
+        centered = self.small.astype(np.float32)
+        centered -= centered.mean(axis=(1, 2), keepdims=True)
+        self._centered = centered
+        self._energy = np.sqrt((centered * centered).sum(axis=(1, 2)))
+        self._tsize = self.small.shape[1:3]
+
+    def _shrink(self, img):
+        """缩小并转为灰度（单通道匹配比三通道快数倍）"""
+        small = cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def _coarse_scores(self, small_img):
+        """
+        逐模板在缩小画面上匹配
+        :return: [(得分, 位置), ...]，与 self.names 对应
+        """
+        results = []
+        for tmpl in self.small:
+            res = cv2.matchTemplate(small_img, tmpl, cv2.TM_CCOEFF_NORMED)
+            _, max_val, _, max_loc = cv2.minMaxLoc(res)
+            results.append((max_val, max_loc))
+        return results
+
+    def _fft_scores(self, small_img):
+        """
+        所有模板一次 FFT 批量计算 TM_CCOEFF_NORMED
+        分子：画面与去均值模板的互相关（频域相乘），分母：模板能量 × 画面局部标准差（积分图）
+        :return: [(得分, 位置), ...]，与 self.names 对应
+        """
+        th, tw = self._tsize
+        h, w = small_img.shape[:2]
+        fh, fw = cv2.getOptimalDFTSize(h), cv2.getOptimalDFTSize(w)
+        img = small_img.astype(np.float32)
+
+        img_f = np.fft.rfft2(img, s=(fh, fw))
+        tmpl_f = np.fft.rfft2(self._centered, s=(fh, fw), axes=(1, 2))  # (K, fh, fw//2+1)
+        corr = np.fft.irfft2(img_f[None] * np.conj(tmpl_f), s=(fh, fw), axes=(1, 2))
+        corr = corr[:, :h - th + 1, :w - tw + 1]
+
+        # 画面各位置窗口内去均值后的平方和（积分图）
+        sums, sqsums = cv2.integral2(img, sdepth=cv2.CV_64F)
+        s1 = sums[th:, tw:] - sums[:-th, tw:] - sums[th:, :-tw] + sums[:-th, :-tw]
+        s2 = sqsums[th:, tw:] - sqsums[:-th, tw:] - sqsums[th:, :-tw] + sqsums[:-th, :-tw]
+        local_var = s2 - s1 * s1 / (th * tw)
+        denom = np.sqrt(np.maximum(local_var, 1e-6))[None] * self._energy[:, None, None]
+        scores = corr / denom
+
+        results = []
+        for k in range(len(self.names)):
+            idx = int(np.argmax(scores[k]))
+            y, x = divmod(idx, scores.shape[2])
+            results.append((float(scores[k, y, x]), (x, y)))
+        return results
+
+    def locate(self, screen_img):
+        """
+        在画面中定位最匹配的模板
+        :param screen_img: 彩色画面
+        :return: (模板名, 模板图像, 原分辨率匹配得分, 左上角坐标)，画面过小时返回 None
+        """
+        th, tw = self._tsize
+        small_img = self._shrink(screen_img)
+        if small_img.shape[0] < th or small_img.shape[1] < tw:
+            return None
+
+        coarse = self._fft_scores(small_img) if self.use_fft else self._coarse_scores(small_img)
+        candidates = sorted(range(len(self.names)), key=lambda k: coarse[k][0], reverse=True)[:self.top_k]
+
+        # 原分辨率精匹配：只搜索粗匹配位置附近的小窗口
+        margin = int(np.ceil(1 / self.scale)) + 2
+        img_h, img_w = screen_img.shape[:2]
+        best = None
+        for k in candidates:
+            name = self.names[k]
+            template = self.templates[name]
+            h, w = template.shape[:2]
+            cx, cy = coarse[k][1]
+            x1 = max(0, int(cx / self.scale) - margin)
+            y1 = max(0, int(cy / self.scale) - margin)
+            x2 = min(img_w, int(cx / self.scale) + w + margin)
+            y2 = min(img_h, int(cy / self.scale) + h + margin)
+            if x2 - x1 < w or y2 - y1 < h:
+                continue
+            res = cv2.matchTemplate(screen_img[y1:y2, x1:x2], template, cv2.TM_CCOEFF_NORMED)
+            _, max_val, _, max_loc = cv2.minMaxLoc(res)
+            if best is None or max_val > best[2]:
+                best = (name, template, max_val, (x1 + max_loc[0], y1 + max_loc[1]))
+        return best
+
+
+def estimate_pitch(screen_img, block_size, axis):
+    """
+    用自相关估计方块排列的周期（方块尺寸 + 间隙）
+    :param screen_img: 彩色画面
+    :param block_size: 该方向上的方块尺寸
+    :param axis: 1 为横向（列周期），0 为纵向（行周期）
+    :return: 周期像素数，无法估计时返回 None
+    """
+    gray = cv2.cvtColor(screen_img, cv2.COLOR_BGR2GRAY).astype(np.float32)
+    # 沿该方向的梯度强度投影：方块边缘和间隙形成周期性的峰
+    profile = np.abs(np.diff(gray, axis=axis)).mean(axis=1 - axis)
+    profile -= profile.mean()
+    n = len(profile)
+    max_lag = int(block_size * 1.5)
+    if n <= max_lag:
+        return None
+    spectrum = np.fft.rfft(profile, 2 * n)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+    lags = autocorr[block_size:max_lag + 1]
+    if lags.max() <= 0:
+        return None
+    return block_size + int(np.argmax(lags))
+
+
+class CalibrationProfiles:
+    """
+    校准参数档案：按区域尺寸和缩放比例保存，重启时用一次匹配验证后直接复用
+    """
+
+    def __init__(self, path="calibration_profiles.json"):
+        self.path = path
+
+    @staticmethod
+    def key(screen_img, scale):
+        """档案名：区域尺寸@缩放比例"""
+        h, w = screen_img.shape[:2]
+        return f"{w}x{h}@{scale:g}"
+
+    def _load_all(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        """读取档案，不存在时返回 None"""
+        return self._load_all().get(key)
+
+    def put(self, key, profile):
+        """写入档案"""
+        profiles = self._load_all()
+        profiles[key] = profile
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(profiles, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
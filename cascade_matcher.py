@@ -0,0 +1,221 @@
+import cv2
+import numpy as np
+import features
+from batch_matcher import BatchMatcher
+from embedding_index import EmbeddingIndex
+
+class CascadeMatcher(BatchMatcher):
+    """
+    级联匹配引擎：先用廉价特征筛选候选模板，只对候选计算昂贵特征
+    0. 嵌入索引拒识：与最近模板的嵌入距离超出拒识半径的区块判为 "unknown"
+    1. 预筛选：嵌入相似度减去颜色矩距离，每个区块保留前 top_k 个候选；
+       最佳与次佳的差距达到 prefilter_margin 时直接采用最佳候选
+    2. 候选的颜色直方图和归一化互相关：加权得分的差距达到 partial_margin 时采用最佳候选
+    3. 候选的 SSIM：按完整综合评分选择
+    提前结束的区块仍对选中的模板计算完整综合评分，置信度与 BatchMatcher 含义相同
+    """
+    STAGES = ("rejected", "prefilter", "partial", "full")
+
+    def __init__(self, bank, weights=(0.8, 0.8, 0.8), ssim_stride=features.SSIM_WIN, top_k=4,
+                 prefilter_margin=0.25, partial_margin=0.25, moment_weight=1.0, index=None, buffers=None,
+                 hist_bins=features.HIST_BINS):
+        """
+        :param bank: 模板特征库 TemplateBank
+        :param weights: (SSIM, 直方图, 模板匹配) 的权重，权重为 0 的特征不计算（SSIM 为 0 时没有第三阶段）
+        :param ssim_stride: SSIM 窗口步长（见 BatchMatcher）
+        :param top_k: 预筛选保留的候选模板数
+        :param prefilter_margin: 预筛选阶段提前结束所需的得分差距，设为 inf 时不在该阶段结束
+        :param partial_margin: 第二阶段提前结束所需的得分差距，设为 inf 时所有候选都计算 SSIM
+        :param moment_weight: 预筛选中颜色矩距离的权重
+        :param index: 模板嵌入索引 EmbeddingIndex，默认在第一次匹配时由 bank 建立（或读取缓存）
+        :param buffers: 工作缓冲区池 BufferPool，默认新建
+        :param hist_bins: 颜色直方图每个通道的分箱数
+        """
+        super().__init__(bank, weights, ssim_stride, buffers, hist_bins)
+        self.top_k = top_k
+        self.prefilter_margin = prefilter_margin
+        self.partial_margin = partial_margin
+        self.moment_weight = moment_weight
+
+        self._index = index
+        self._moments = features.color_moments(features.thumbnails(bank.images))
+        self._moment_sq = (self._moments * self._moments).sum(axis=1)
+        self._ncc_rows = bank.ncc_vecs  # (K, D)，按模板取行比按列取连续
+        self.exits = np.zeros(len(self.STAGES), dtype=np.int64)  # 各阶段结束的区块数
+
+    @property
+    def index(self):
+        """模板嵌入索引（建立需要生成增强样本并做 PCA，推迟到第一次使用时）"""
+        if self._index is None:
+            self._index = EmbeddingIndex.for_bank(self.bank)
+        return self._index
+
+    @index.setter
+    def index(self, index):
+        self._index = index
+
+    def updated(self, bank, changed=()):
+        """
+        模板热更新后的匹配引擎：嵌入索引已建立时增量更新（只为新增或修改的模板计算嵌入），否则在新引擎中按需建立
+        :param bank: 更新后的模板特征库（同一金字塔层）
+        :param changed: 修改过的模板名
+        """
+        index = self._index.updated(bank, changed) if self._index is not None else None
+        return type(self)(bank, self.weights, self.ssim_stride, self.top_k, self.prefilter_margin,
+                          self.partial_margin, self.moment_weight, index=index, buffers=self.buffers,
+                          hist_bins=self.hist_bins)
+
+    def exit_fractions(self):
+        """
+        各阶段结束的区块比例
+        :return: {阶段名: 比例}
+        """
+        total = max(1, int(self.exits.sum()))
+        return {stage: int(n) / total for stage, n in zip(self.STAGES, self.exits)}
+
+    def reset_stats(self):
+        self.exits[:] = 0
+
+    def prefilter(self, stack):
+        """
+        预筛选
+        :return: (得分 (N, K) = 嵌入余弦相似度 - moment_weight × 颜色矩欧氏距离,
+                  拒识标记 (N,)：与最近模板的嵌入距离超出其拒识半径)
+        """
+        thumbs = features.thumbnails(stack)
+        sims = self.index.similarities(self.index.embed_thumbnails(thumbs))
+        nearest = sims.argmax(axis=1)
+        rejected = self.index.rejected(nearest, self.index.distance(sims[np.arange(len(sims)), nearest]))
+        moments = features.color_moments(thumbs)
+        dist2 = (moments * moments).sum(axis=1)[:, None] + self._moment_sq[None] - 2 * moments @ self._moments.T
+        sims -= self.moment_weight * np.sqrt(np.maximum(dist2, 0))
+        return sims, rejected
+
+    def _cell_features(self, stack):
+        """区块侧特征（每次匹配只计算一次，权重为 0 的特征跳过）"""
+        n = len(stack)
+        w_ssim, w_hist, w_tmpl = self.weights
+        cells = {}
+        if w_hist:
+            cells['hist'] = features.normalize_rows(features.color_histograms(stack, self.hist_bins))
+        if w_tmpl:
+            flat = self._flat(stack)
+            # 各通道像素和与平方和（逐图 OpenCV 归约比在三维数组上按轴求和快得多）
+            sums = np.array([cv2.sumElems(img)[:3] for img in stack], dtype=np.float64)
+            sq = np.array([cv2.norm(img, cv2.NORM_L2SQR) for img in stack])
+            norm2 = sq - (sums * sums).sum(axis=1) / (flat.shape[1] // 3)
+            cells['flat'] = flat
+            cells['norm'] = np.sqrt(np.maximum(norm2, 1e-6))
+        if not w_ssim:
+            return cells
+        cells['gray'] = self._gray(stack)
+        if self.ssim_stride > 1:
+            patches = self._window_patches(cells['gray'], pooled=True)  # (P, N, 49)
+            area = float(features.SSIM_WIN ** 2)
+            mu = patches.mean(axis=2)
+            cells['patches'] = patches
+            cells['mu'] = mu
+            cells['var'] = area / (area - 1) * (np.einsum("pni,pni->pn", patches, patches) / area - mu * mu)
+        else:
+            mu, var = features.ssim_stats(cells['gray'])
+            cells['mu'] = mu.reshape(n, -1).T
+            cells['var'] = var.reshape(n, -1).T
+        return cells
+
+    def _partial_scores(self, cells, rows, cols):
+        """
+        (区块, 模板) 对的直方图相关系数和归一化互相关加权和
+        :param rows: 区块下标 (M,)
+        :param cols: 模板下标 (M,)
+        """
+        _, w_hist, w_tmpl = self.weights
+        ru, ri = np.unique(rows, return_inverse=True)
+        tu, ti = np.unique(cols, return_inverse=True)
+        scores = np.zeros(len(rows), dtype=np.float32)
+        if w_hist:
+            scores += w_hist * (cells['hist'][ru] @ self._hist_t[:, tu])[ri, ti]
+        if w_tmpl:
+            flat = cells['flat'] if len(ru) == len(cells['flat']) else cells['flat'][ru]
+            scores += w_tmpl * (flat @ self._ncc_rows[tu].T)[ri, ti] / cells['norm'][rows]
+        return scores
+
+    def _ssim_pairs(self, cells, rows, cols):
+        """(区块, 模板) 对的 SSIM (M,)"""
+        win = features.SSIM_WIN
+        area = float(win * win)
+        cov_norm = area / (area - 1)
+        if self.ssim_stride > 1:
+            ru, ri = np.unique(rows, return_inverse=True)
+            tu, ti = np.unique(cols, return_inverse=True)
+            cross = np.matmul(cells['patches'][:, ru], self._patches_t[:, :, tu])[:, ri, ti] / area  # (P, M)
+        else:
+            g = cells['gray'].astype(np.float32)
+            t = self.bank.grays.astype(np.float32)
+            cross = np.empty((self._mu_t.shape[0], len(rows)), dtype=np.float32)
+            for k in np.unique(cols):  # 按模板分组计算
+                idx = np.flatnonzero(cols == k)
+                cross[:, idx] = (features.box_sum(g[rows[idx]] * t[k]) / area).reshape(len(idx), -1).T
+
+        mu_b, var_b = cells['mu'][:, rows], cells['var'][:, rows]
+        mu_t, var_t = self._mu_t[:, cols], self._var_t[:, cols]
+        cov = cov_norm * (cross - mu_b * mu_t)
+        num = (2 * mu_b * mu_t + features.SSIM_C1) * (2 * cov + features.SSIM_C2)
+        den = (mu_b * mu_b + mu_t * mu_t + features.SSIM_C1) * (var_b + var_t + features.SSIM_C2)
+        return (num / den).mean(axis=0)
+
+    def match(self, blocks):
+        """
+        级联匹配
+        :param blocks: 区块列表或 (N, H, W, 3) 张量
+        :return: (名称数组 (N,), 置信度数组 (N,))，被嵌入索引拒识的区块名称为 "unknown"、置信度为 0
+        """
+        if len(blocks) == 0:
+            return np.array([], dtype=object), np.zeros(0, dtype=np.float32)
+        stack = self.stack_blocks(blocks)
+        n = len(stack)
+        k = min(self.top_k, len(self.names))
+        w_ssim = self.weights[0]
+
+        # 第一阶段：嵌入索引拒识并预筛选候选
+        pre, rejected = self.prefilter(stack)
+        candidates = np.argsort(-pre, axis=1)[:, :k]  # (N, k)，按预筛选得分降序
+        top = np.take_along_axis(pre, candidates, axis=1)
+        margin = top[:, 0] - top[:, 1] if k > 1 else np.full(n, np.inf)
+        cells = self._cell_features(stack)
+
+        best = candidates[:, 0].copy()
+        confidences = np.zeros(n, dtype=np.float32)
+        stage0 = np.flatnonzero(rejected)
+        stage1 = np.flatnonzero(~rejected & (margin >= self.prefilter_margin))
+        rest = np.flatnonzero(~rejected & (margin < self.prefilter_margin))
+
+        # 第二阶段：直方图和归一化互相关（预筛选结束的区块只算最佳候选，其余区块算全部候选）
+        rows = np.concatenate([stage1, np.repeat(rest, k)])
+        cols = np.concatenate([best[stage1], candidates[rest].ravel()])
+        scores = self._partial_scores(cells, rows, cols)
+        confidences[stage1] = scores[:len(stage1)]
+        partial = scores[len(stage1):].reshape(len(rest), k)
+        order = np.argsort(-partial, axis=1)
+        ranked = np.take_along_axis(partial, order, axis=1)
+        gap = ranked[:, 0] - ranked[:, 1] if k > 1 else np.full(len(rest), np.inf)
+        passed = gap >= self.partial_margin
+        stage2, stage3 = rest[passed], rest[~passed]
+        best[stage2] = candidates[stage2, order[passed, 0]]
+        confidences[stage2] = ranked[passed, 0]
+
+        # 第三阶段：SSIM（提前结束的区块只算选中的模板，其余区块算全部候选）
+        done = np.concatenate([stage1, stage2])
+        rows = np.concatenate([done, np.repeat(stage3, k)])
+        cols = np.concatenate([best[done], candidates[stage3].ravel()])
+        ssim = w_ssim * self._ssim_pairs(cells, rows, cols) if w_ssim else np.zeros(len(rows), dtype=np.float32)
+        confidences[done] += ssim[:len(done)]
+        if stage3.size:
+            total = partial[~passed] + ssim[len(done):].reshape(len(stage3), k)
+            pick = total.argmax(axis=1)
+            best[stage3] = candidates[stage3, pick]
+            confidences[stage3] = total[np.arange(len(stage3)), pick]
+
+        self.exits += (stage0.size, stage1.size, stage2.size, stage3.size)
+        names = self.names[best].astype(object)
+        names[stage0] = "unknown"
+        return names, confidences
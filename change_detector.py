@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+from buffer_pool import BufferPool
+
+class FrameChangeDetector:
+    """
+    帧级变化检测：将画面缩小为指纹，与上一帧的指纹比较
+    指纹先按 step 隔点取样，再用区域平均缩小一半（平滑噪声），约为原图的 1/(2 × step)
+    差值超过 pixel_threshold 的指纹数值（像素 × 通道）达到 min_pixels 个时视为画面变化
+    （一个方块被消除约对应 (82 / 8) × (78 / 8) ≈ 100 个指纹像素、最多 300 个数值）
+    """
+
+    def __init__(self, step=4, pixel_threshold=20, min_pixels=12, buffers=None):
+        """
+        :param step: 取样间隔（像素）
+        :param pixel_threshold: 单个指纹数值视为变化的最小差值
+        :param min_pixels: 视为画面变化的最少变化数值个数
+        :param buffers: 工作缓冲区池 BufferPool（取样、指纹和差值写入其中），默认新建
+        """
+        self.step = step
+        self.pixel_threshold = pixel_threshold
+        self.min_pixels = min_pixels
+        self.buffers = buffers or BufferPool()
+        self.changed_pixels = 0  # 最近一次比较的变化数值个数
+        self.stats = {'frames': 0, 'changed': 0}
+        self._fingerprint = None  # 上一帧的指纹
+        self._slot = 0  # 指纹在两块缓冲区间交替写入
+
+    def fingerprint(self, frame, name="detect.fingerprint"):
+        """
+        画面指纹
+        :param frame: BGR 图像
+        :param name: 指纹写入的缓冲区名称
+        :return: 缩小的 BGR 图像（缓冲区池中的数组，下次写入同名缓冲区前有效）
+        """
+        step = self.step
+        h = frame.shape[0] // (2 * step) * 2 * step
+        w = frame.shape[1] // (2 * step) * 2 * step
+        sampled = frame[:h:step, :w:step]
+        buf = self.buffers.get("detect.sampled", sampled.shape)
+        np.copyto(buf, sampled)
+        out = self.buffers.get(name, (h // (2 * step), w // (2 * step), frame.shape[2]))
+        cv2.resize(buf, out.shape[1::-1], dst=out, interpolation=cv2.INTER_AREA)
+        return out
+
+    def update(self, frame):
+        """
+        与上一帧比较并记录当前帧
+        :return: 画面是否变化（第一帧或尺寸变化时为 True）
+        """
+        self._slot ^= 1
+        current = self.fingerprint(frame, f"detect.fingerprint.{self._slot}")
+        previous, self._fingerprint = self._fingerprint, current
+        self.stats['frames'] += 1
+        if previous is None or previous.shape != current.shape:
+            self.changed_pixels = current.size
+        else:
+            diff = self.buffers.get("detect.diff", current.shape)
+            cv2.absdiff(current, previous, dst=diff)
+            cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY, dst=diff)
+            self.changed_pixels = cv2.countNonZero(diff.reshape(diff.shape[0], -1))
+        changed = self.changed_pixels >= self.min_pixels
+        self.stats['changed'] += changed
+        return changed
+
+    def reset(self):
+        """丢弃上一帧指纹（下一帧必定视为变化，如重新校准后）"""
+        self._fingerprint = None
+
+
+class AdaptivePoller:
+    """
+    自适应轮询间隔：画面变化（动画进行中）时立即回到最短间隔，
+    画面静止时每次乘以 backoff，直到最长间隔
+    """
+
+    def __init__(self, min_interval=0.02, max_interval=0.5, backoff=1.5):
+        """
+        :param min_interval: 最短轮询间隔（秒）
+        :param max_interval: 最长轮询间隔（秒）
+        :param backoff: 画面静止时间隔的增长倍数
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+
+    def next(self, changed):
+        """
+        根据本次画面是否变化计算下一次轮询前的等待时间
+        :return: 等待时间（秒）
+        """
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.interval
+
+    def next_ms(self, changed):
+        """同 next()，返回整数毫秒（至少 1，供 cv2.waitKey 使用）"""
+        return max(1, int(round(self.next(changed) * 1000)))
+
+    def reset(self):
+        """回到最短间隔（如用户按键后）"""
+        self.interval = self.min_interval
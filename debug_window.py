@@ -1,55 +1,339 @@
+import os
+import sys
 import cv2
+import time
+import queue
+import threading
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from functools import lru_cache
+from instrumentation import DISABLED
+
+@lru_cache(maxsize=8)
+def _load_font(font_path, size):
+    """加载字体（按路径和字号缓存），字体文件不存在时使用 PIL 默认字体"""
+    from PIL import ImageFont  # 首次绘制文字时才导入 PIL
+    try:
+        return ImageFont.truetype(font_path, size)
+    except OSError:
+        print(f"警告: 无法加载字体 {font_path}，使用默认字体（可能无法显示中文）")
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=64)
+def _text_mask(text, font_path, size):
+    """
+    将一行文字渲染为小尺寸的透明度蒙版（按文字内容缓存）
+    :return: float32 蒙版 (h, w, 1)，取值 0~1
+    """
+    from PIL import Image, ImageDraw
+    font = _load_font(font_path, size)
+    _, _, right, bottom = font.getbbox(text)
+    mask = Image.new("L", (max(1, right), max(1, bottom)), 0)
+    ImageDraw.Draw(mask).text((0, 0), text, font=font, fill=255)
+    return np.asarray(mask, dtype=np.float32)[..., None] / 255
+
+
+class ConsoleKeys:
+    """
+    控制台按键：后台线程从控制台读取按键放入队列，没有调试窗口（尚未创建或无界面模式）时代替 cv2.waitKey
+    Windows 下逐键读取（msvcrt）；其他系统按行读取标准输入（输入 q 后回车）；标准输入不是终端时不读取
+    读取线程只在 wait_key 需要时启动，窗口创建后由 stop() 结束，不再占用标准输入
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
 
-class DebugWindow:
     def __init__(self):
-        self.window_name = "Debug"
-        cv2.namedWindow(self.window_name, cv2.WINDOW_NORMAL)
-        cv2.resizeWindow(self.window_name, 921, 1297)  # 初始默认尺寸
-
-    def update(self, img, info="", pairs = []):
-        """动态调整窗口尺寸并优化文字显示（支持中文）"""
-        # 计算合适窗口尺寸（原图尺寸+20像素边框）
-        h, w = img.shape[:2]
-
-        # 提高分辨率：将图像放大到更高分辨率
-        target_w = int(w)
-        target_h = int(h)
-
-        # 高质量缩放（使用 Lanczos 插值）
-        display_img = cv2.resize(img, (target_w, target_h), interpolation=cv2.INTER_LANCZOS4)
-
-        # 如果 info 不为空，添加中文文字
-        if info:
-            # 将 OpenCV 图像转换为 PIL 图像
-            display_img_pil = Image.fromarray(cv2.cvtColor(display_img, cv2.COLOR_BGR2RGB))
-            draw = ImageDraw.Draw(display_img_pil)
-
-            # 加载中文字体（确保字体文件路径正确）
-            font_path = "simsun.ttc"  # 使用宋体，或者替换为其他支持中文的字体文件
-            font = ImageFont.truetype(font_path, 24)  # 字体大小随分辨率放大
-
-            # 绘制中文文字（启用抗锯齿）
-            draw.text((20, 20), info, font=font, fill=(255, 0, 0), antialias=True)
-
-            # 将 PIL 图像转换回 OpenCV 格式
-            display_img = cv2.cvtColor(np.array(display_img_pil), cv2.COLOR_RGB2BGR)
-
-        if pairs:
-            for (a, b) in pairs:
-                (col1, row1), (col2, row2) = a, b
-                x1 = (a_coord[0] + a_coord[2]) // 2  # 方块中心坐标
-                y1 = (a_coord[1] + a_coord[3]) // 2
-                x2 = (b_coord[0] + b_coord[2]) // 2
-                y2 = (b_coord[1] + b_coord[3]) // 2
-                cv2.line(display_img, (x1, y1), (x2, y2), (0, 255, 255), 2)
-                cv2.putText(display_img, f"Pair", (x1+5, y1-5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,255,255), 1)
-
-        # 更新窗口
-        cv2.imshow(self.window_name, display_img)
-        cv2.waitKey(1)
+        self.keys = queue.Queue()
+        self._stop = threading.Event()
+        self.active = sys.stdin is not None and sys.stdin.isatty()
+        if self.active:
+            threading.Thread(target=self._read_loop, daemon=True).start()
+
+    @classmethod
+    def shared(cls):
+        """进程内共用的实例（控制台只有一个，同时只运行一个读取线程）"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def stop(self):
+        """结束读取线程（最多在一个轮询周期内退出），之后再调用 shared() 会重新启动"""
+        self._stop.set()
+        with ConsoleKeys._shared_lock:
+            if ConsoleKeys._shared is self:
+                ConsoleKeys._shared = None
+
+    def _read_loop(self):
+        """后台读取线程：短周期轮询，不在读取中阻塞，stop() 后即退出"""
+        try:
+            if os.name == "nt":
+                import msvcrt
+                while not self._stop.is_set():
+                    if msvcrt.kbhit():
+                        self.keys.put(ord(msvcrt.getwch()))
+                    else:
+                        time.sleep(0.01)
+                return
+            import select
+            while not self._stop.is_set():
+                if select.select([sys.stdin], [], [], 0.05)[0]:
+                    line = sys.stdin.readline()
+                    if not line:
+                        return  # 标准输入已关闭
+                    for ch in line.strip():
+                        self.keys.put(ord(ch))
+        except (OSError, ValueError):
+            pass  # 标准输入已关闭
+
+    def get(self, delay_ms=0):
+        """
+        取一个按键，最多等待 delay_ms（不读取控制台时只休眠）
+        :return: 按键码，没有按键时为 -1
+        """
+        try:
+            if delay_ms > 0:
+                return self.keys.get(timeout=delay_ms / 1000)
+            return self.keys.get_nowait()
+        except queue.Empty:
+            return -1
+
+
+class DebugWindow:
+    """
+    调试窗口
+    show() 只记录画面快照和要绘制的内容，标注在后台线程中完成，HighGUI 显示在调用线程中进行：
+    - 超过最高帧率的画面直接跳过（不复制）
+    - 画面复制到复用的缓冲区中，原地绘制标注
+    - 中文文字渲染为小蒙版并缓存，只与文字区域混合，不再整帧转换 PIL 图像
+    窗口在第一次显示画面时才创建；没有 HighGUI 支持（如 opencv-python-headless）或 headless=True 时不做任何显示
+    """
+    instruments = DISABLED  # 性能埋点（由 BlockRecognizer 设置）
+
+    def __init__(self, window_name="Debug", max_fps=30, threaded=True, headless=False,
+                 font_path="simsun.ttc", font_size=24, scale=1.0):
+        """
+        :param max_fps: 最高显示帧率，为 0 时不限制
+        :param threaded: 是否在后台线程中绘制标注
+        :param headless: 无界面模式
+        :param font_path: 中文字体文件（使用宋体，或者替换为其他支持中文的字体文件）
+        :param scale: 显示缩放比例，为 1.0 时不缩放
+        """
+        self.window_name = window_name
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.threaded = threaded
+        self.font_path = font_path
+        self.font_size = font_size
+        self.scale = scale
+        self.headless = headless
+        self.skipped = 0  # 因帧率限制跳过的画面数
+        self.window_created = False
+
+        self._last_submit = 0.0
+        self._lock = threading.Condition()
+        self._free = []  # 空闲的画面缓冲区
+        self._pending = None  # 等待绘制的快照
+        self._ready = None  # 已绘制、等待显示的画面
+        self._thread = None
+        self._closed = False
+        self._console = None  # 窗口创建前（及无界面模式下）的按键来源，在 wait_key 中按需启动
+
+    def update(self, img, info="", pairs=[]):
+        """
+        显示已绘制好的图像（兼容接口）
+        :param pairs: 要连线的方块坐标对 [((x1, y1, x2, y2), (x1, y1, x2, y2)), ...]
+        """
+        self.show(img, info=info, pairs=pairs, force=True)
+
+    def show(self, frame, blocks=None, info="", boxes=(), pairs=(), force=False):
+        """
+        提交一帧画面及其标注
+        :param frame: 彩色画面（只读，调用返回后即可被覆盖）
+        :param blocks: 识别结果 BoardState 或 {(col, row): {'name', 'coordinate'}}，绘制方块框和名称
+        :param info: 左上角显示的文字
+        :param boxes: 额外的矩形框 [((x1, y1, x2, y2), 颜色, 线宽), ...]
+        :param pairs: 要连线的方块坐标对
+        :param force: 为 True 时不受帧率限制（一次性的结果，如校准和提示）
+        :return: 是否接受了该帧
+        """
+        if self.headless or self._closed:
+            return False
+        now = time.perf_counter()
+        if not force and now - self._last_submit < self.min_interval:
+            self.skipped += 1
+            return False
+        self._last_submit = now
+
+        with self._lock:
+            buf = self._take_buffer(frame.shape)
+        np.copyto(buf, frame)
+        snapshot = (buf, blocks.copy() if blocks else None, info, tuple(boxes), tuple(pairs))
+
+        if not self.threaded:
+            self._render(snapshot)
+            self._present(buf)
+            return True
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._render_loop, daemon=True)
+                self._thread.start()
+            if self._pending is not None:
+                self._free.append(self._pending[0])  # 未来得及绘制的旧快照直接丢弃
+            self._pending = snapshot
+            self._lock.notify()
+        self.poll()
+        return True
+
+    def poll(self):
+        """显示后台线程已绘制完成的最新画面（在 HighGUI 所在线程中调用）"""
+        if self._ready is None:
+            return
+        with self._lock:
+            buf, self._ready = self._ready, None
+        if buf is not None:
+            self._present(buf)
+            with self._lock:
+                self._free.append(buf)
+
+    def _take_buffer(self, shape):
+        """取一个空闲缓冲区（需持有锁），尺寸不符时重新分配"""
+        while self._free:
+            buf = self._free.pop()
+            if buf.shape == shape:
+                return buf
+        return np.empty(shape, dtype=np.uint8)
+
+    def _render_loop(self):
+        """后台绘制线程"""
+        while True:
+            with self._lock:
+                while self._pending is None and not self._closed:
+                    self._lock.wait()
+                if self._closed:
+                    return
+                snapshot, self._pending = self._pending, None
+            self._render(snapshot)
+            with self._lock:
+                if self._ready is not None:
+                    self._free.append(self._ready)
+                self._ready = snapshot[0]
+
+    def _render(self, snapshot):
+        """在快照缓冲区上原地绘制标注"""
+        img, blocks, info, boxes, pairs = snapshot
+        with self.instruments.stage("display.draw"):
+            if blocks:
+                self._draw_blocks(img, blocks)
+            for (x1, y1, x2, y2), color, thickness in boxes:
+                cv2.rectangle(img, (int(x1), int(y1)), (int(x2), int(y2)), color, thickness)
+            for a_coord, b_coord in pairs:
+                x1 = int(a_coord[0] + a_coord[2]) // 2  # 方块中心坐标
+                y1 = int(a_coord[1] + a_coord[3]) // 2
+                x2 = int(b_coord[0] + b_coord[2]) // 2
+                y2 = int(b_coord[1] + b_coord[3]) // 2
+                cv2.line(img, (x1, y1), (x2, y2), (0, 255, 255), 2)
+                cv2.putText(img, "Pair", (x1 + 5, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+            if info:
+                self._draw_text(img, info, (20, 20), (0, 0, 255))
+
+    @staticmethod
+    def _draw_blocks(img, blocks):
+        """绘制方块框和带白色背景的名称"""
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        font_scale = 0.4
+        font_thickness = 1
+        for value in blocks.values():
+            name = value['name']
+            if name == "None":
+                continue
+            x1, y1, x2, y2 = (int(v) for v in value['coordinate'])
+            cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            (text_w, text_h), _ = cv2.getTextSize(name, font, font_scale, font_thickness)
+            text_x, text_y = x1 + 5, y1 + 20
+            cv2.rectangle(img, (text_x, text_y - text_h), (text_x + text_w, text_y), (255, 255, 255), -1)
+            cv2.putText(img, name, (text_x, text_y), font, font_scale, (0, 0, 0), font_thickness)
+
+    def _draw_text(self, img, text, origin, color):
+        """用缓存的文字蒙版在文字区域内混合颜色（支持中文）"""
+        mask = _text_mask(text, self.font_path, self.font_size)
+        x, y = origin
+        h = min(mask.shape[0], img.shape[0] - y)
+        w = min(mask.shape[1], img.shape[1] - x)
+        if h <= 0 or w <= 0:
+            return
+        alpha = mask[:h, :w]
+        roi = img[y:y + h, x:x + w]
+        blended = roi * (1 - alpha) + np.asarray(color, dtype=np.float32) * alpha
+        np.copyto(roi, blended, casting="unsafe")
+
+    def _create_window(self):
+        """创建窗口（第一次显示时调用）"""
+        try:
+            cv2.namedWindow(self.window_name, cv2.WINDOW_NORMAL)
+            cv2.resizeWindow(self.window_name, 921, 1297)  # 初始默认尺寸
+        except cv2.error:
+            print("警告: OpenCV 不支持 HighGUI，调试窗口以无界面模式运行")
+            self.headless = True
+            return False
+        self.window_created = True
+        return True
+
+    def wait_key(self, delay_ms):
+        """
+        等待按键：窗口已创建时为 cv2.waitKey（控制台读取线程随之结束，其中剩余的按键优先）；
+        窗口尚未创建或无界面模式时从控制台按键队列中读取（首次调用时启动读取线程），最多等待 delay_ms
+        :return: 按键码，没有按键时为 -1
+        """
+        if not self.window_created:
+            if self._console is None:
+                self._console = ConsoleKeys.shared()
+            return self._console.get(delay_ms)
+        if self._console is not None:
+            console, self._console = self._console, None
+            console.stop()
+            key = console.get()
+            if key != -1:
+                return key
+        return cv2.waitKey(delay_ms)
+
+    def _present(self, img):
+        """缩放（如需要）并显示"""
+        if not self.window_created and (self.headless or not self._create_window()):
+            return
+        with self.instruments.stage("display.show"):
+            if self.scale != 1.0:
+                img = cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+            cv2.imshow(self.window_name, img)
+            cv2.waitKey(1)
 
     def close(self):
         """关闭调试窗口"""
-        cv2.destroyAllWindows()
\ No newline at end of file
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        if self.window_created:
+            cv2.destroyAllWindows()
+
+
+class NullDebugWindow:
+    """无界面调试窗口：接口与 DebugWindow 相同但不做任何显示（用于基准测试和无 HighGUI 环境）"""
+    instruments = DISABLED
+
+    def update(self, img, info="", pairs=[]):
+        pass
+
+    def show(self, frame, blocks=None, info="", boxes=(), pairs=(), force=False):
+        return False
+
+    def poll(self):
+        pass
+
+    def wait_key(self, delay_ms):
+        """从控制台按键队列中读取（见 ConsoleKeys）"""
+        return ConsoleKeys.shared().get(delay_ms)
+
+    def close(self):
+        pass
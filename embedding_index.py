@@ -0,0 +1,212 @@
+import os
+import cv2
+import json
+import numpy as np
+import features
+from utils import atomic_write
+
+CACHE_FILE = "index.npz"  # 索引缓存文件名（位于特征库缓存目录下）
+
+class EmbeddingIndex:
+    """
+    模板嵌入索引
+    每个区块和模板投影为紧凑的单位向量：缩略图（去均值归一化）经 PCA 降维后再归一化，
+    PCA 和各模板的拒识半径由模板及其增强样本（亮度、噪声、缩放、平移扰动）学习得到
+    查找为嵌入空间中的最近邻：每个区块一次 (D, dim) 投影加一次 (dim, K) 点积，
+    模板数量增加到数百个时，单个区块的开销仍主要由与模板数无关的投影决定
+    与最近模板的距离超过该模板的拒识半径时判为 "unknown"
+    """
+
+    ARRAYS = ("mean", "components", "embeddings", "radius")
+
+    def __init__(self, bank, dim=32, augment=16, radius_scale=1.5, seed=0):
+        """
+        :param bank: 模板特征库 TemplateBank
+        :param dim: 嵌入维数
+        :param augment: 每个模板生成的增强样本数
+        :param radius_scale: 拒识半径相对增强样本最大距离的倍数
+        :param seed: 增强样本的随机种子
+        """
+        self.names = np.array(bank.names)
+        vectors, labels = self._samples(bank.images, augment, np.random.default_rng(seed))
+
+        # PCA：中心化后取前 dim 个主成分
+        self.mean = vectors.mean(axis=0)
+        _, _, vt = np.linalg.svd(vectors - self.mean, full_matrices=False)
+        self.components = np.ascontiguousarray(vt[:dim].T)  # (D, dim)
+        self.dim = self.components.shape[1]
+
+        self.embeddings, spread = self._centroids(vectors, labels, len(self.names))
+        self._embeddings_t = np.ascontiguousarray(self.embeddings.T)
+        # 拒识半径：增强样本到所属模板嵌入的最大距离 × radius_scale；
+        # 纹理很少的模板（如空白）增强后几乎不变，半径不低于各模板的中位数
+        self.radius = np.maximum(spread, np.median(spread)) * radius_scale
+
+    def _samples(self, images, augment, rng):
+        """
+        模板及其增强样本的向量
+        :return: (向量 (M, D)，所属模板下标 (M,))
+        """
+        thumbs = [features.thumbnails(images).astype(np.float32)]
+        thumbs += [self._augment(images, rng) for _ in range(augment)]
+        labels = np.tile(np.arange(len(images)), len(thumbs))
+        return self._vectors(np.concatenate(thumbs)), labels
+
+    def _centroids(self, vectors, labels, count):
+        """
+        每个模板的嵌入取其全部样本嵌入的均值方向
+        :return: (模板嵌入 (count, dim)，各模板样本到其嵌入的最大距离 (count,))
+        """
+        embedded = self._project(vectors)
+        centroids = np.zeros((count, self.dim), dtype=np.float32)
+        np.add.at(centroids, labels, embedded)
+        embeddings = centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-6)
+        dist = self.distance((embedded * embeddings[labels]).sum(axis=1))
+        spread = np.zeros(count, dtype=np.float32)
+        np.maximum.at(spread, labels, dist)
+        return embeddings, spread
+
+    def updated(self, bank, changed=(), augment=16, radius_scale=1.5, seed=0):
+        """
+        模板增删改后的增量索引：沿用 PCA 基，只为新增或修改的模板生成增强样本、计算嵌入和拒识半径，
+        其余模板直接复制；新模板的拒识半径下限取原索引的中位数。原索引保持不变
+        （增量索引不写入缓存，下次启动时按完整的模板集重新建立）
+        :param bank: 更新后的模板特征库
+        :param changed: 修改过的模板名（新增的模板按名称自动识别）
+        :param augment: 每个模板生成的增强样本数
+        :param radius_scale: 拒识半径相对增强样本最大距离的倍数
+        :param seed: 增强样本的随机种子
+        """
+        index = self.__class__.__new__(self.__class__)
+        index.names = np.array(bank.names)
+        index.mean, index.components, index.dim = self.mean, self.components, self.dim
+        old = {name: i for i, name in enumerate(self.names)}
+        changed = set(changed)
+        fresh = [i for i, name in enumerate(bank.names) if name in changed or name not in old]
+        kept = [i for i, name in enumerate(bank.names) if not (name in changed or name not in old)]
+        source = [old[bank.names[i]] for i in kept]
+        index.embeddings = np.empty((len(bank.names), self.dim), dtype=self.embeddings.dtype)
+        index.radius = np.empty(len(bank.names), dtype=self.radius.dtype)
+        index.embeddings[kept] = self.embeddings[source]
+        index.radius[kept] = self.radius[source]
+        if fresh:
+            vectors, labels = self._samples(bank.images[fresh], augment, np.random.default_rng(seed))
+            index.embeddings[fresh], spread = index._centroids(vectors, labels, len(fresh))
+            index.radius[fresh] = np.maximum(spread * radius_scale, np.median(self.radius))
+        index._embeddings_t = np.ascontiguousarray(index.embeddings.T)
+        return index
+
+    @classmethod
+    def for_bank(cls, bank, **params):
+        """
+        模板特征库对应的索引：特征库有磁盘缓存时读写同目录下的索引缓存，
+        缓存以特征库的缓存键和建立参数校验，模板未变化时跳过增强样本生成和 PCA
+        :param params: 建立参数（见 __init__）
+        """
+        if not (bank.cache_dir and bank.key):
+            return cls(bank, **params)
+        path = os.path.join(bank.cache_dir, CACHE_FILE)
+        meta = json.dumps({'key': bank.key, 'params': params}, sort_keys=True)
+        try:
+            with np.load(path) as data:
+                if str(data['meta']) == meta:
+                    index = cls.__new__(cls)
+                    index.names = np.array(bank.names)
+                    for attr in cls.ARRAYS:
+                        setattr(index, attr, data[attr])
+                    index.dim = index.components.shape[1]
+                    index._embeddings_t = np.ascontiguousarray(index.embeddings.T)
+                    return index
+        except (OSError, KeyError, ValueError):
+            pass
+        index = cls(bank, **params)
+        try:
+            atomic_write(path, lambda f: np.savez(f, meta=np.array(meta),
+                                                  **{attr: getattr(index, attr) for attr in cls.ARRAYS}))
+        except OSError as e:
+            print(f"警告: 无法写入索引缓存 {e}")
+        return index
+
+    @staticmethod
+    def _augment(images, rng, brightness=25.0, noise=16.0, scale=0.05, shift=2):
+        """
+        生成一组增强样本的缩略图：随机缩放、平移、亮度偏移和高斯噪声
+        噪声直接加在缩略图上，标准差按缩略图像素对应的原图面积折算
+        :return: 缩略图 (N, h, w, 3)，float32
+        """
+        n, h, w = images.shape[:3]
+        warped = np.empty_like(images)
+        for i, img in enumerate(images):
+            s = 1 + rng.uniform(-scale, scale)
+            dx, dy = rng.integers(-shift, shift + 1, size=2)
+            m = np.float32([[s, 0, (1 - s) * w / 2 + dx], [0, s, (1 - s) * h / 2 + dy]])
+            warped[i] = cv2.warpAffine(img, m, (w, h), borderMode=cv2.BORDER_REPLICATE)
+        thumbs = features.thumbnails(warped).astype(np.float32)
+        thumbs += rng.uniform(-brightness, brightness, (n, 1, 1, 1)).astype(np.float32)
+        thumbs += rng.normal(0, noise / np.sqrt(np.prod(features.THUMB_CELL)), thumbs.shape).astype(np.float32)
+        return np.clip(thumbs, 0, 255)
+
+    @staticmethod
+    def _vectors(thumbs):
+        """缩略图展平后去均值归一化（对亮度和对比度不敏感）"""
+        return features.normalize_rows(thumbs.reshape(len(thumbs), -1))
+
+    @staticmethod
+    def distance(similarity):
+        """单位向量的余弦相似度换算为欧氏距离"""
+        return np.sqrt(np.maximum(2 - 2 * similarity, 0))
+
+    def _project(self, vectors):
+        emb = (vectors - self.mean) @ self.components
+        return emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-6)
+
+    def embed_thumbnails(self, thumbs):
+        """
+        缩略图的嵌入
+        :param thumbs: features.thumbnails 的结果 (N, h, w, 3)
+        :return: 单位向量 (N, dim)
+        """
+        return self._project(self._vectors(thumbs))
+
+    def embed(self, stack):
+        """区块组 (N, H, W, 3) 的嵌入 (N, dim)"""
+        return self.embed_thumbnails(features.thumbnails(stack))
+
+    def similarities(self, embeddings):
+        """与全部模板嵌入的余弦相似度 (N, K)"""
+        return embeddings @ self._embeddings_t
+
+    def search(self, embeddings, k=1):
+        """
+        最近邻查找
+        :return: (模板下标 (N, k), 距离 (N, k))，按距离升序
+        """
+        sims = self.similarities(embeddings)
+        k = min(k, sims.shape[1])
+        idx = np.argpartition(-sims, k - 1, axis=1)[:, :k] if k < sims.shape[1] else np.argsort(-sims, axis=1)
+        top = np.take_along_axis(sims, idx, axis=1)
+        order = np.argsort(-top, axis=1)
+        return np.take_along_axis(idx, order, axis=1), self.distance(np.take_along_axis(top, order, axis=1))
+
+    def rejected(self, nearest, distances):
+        """
+        距离拒识
+        :param nearest: 最近模板下标 (N,)
+        :param distances: 到最近模板的距离 (N,)
+        :return: 布尔数组，True 表示超出该模板的拒识半径
+        """
+        return distances > self.radius[nearest]
+
+    def classify(self, stack):
+        """
+        仅凭嵌入分类
+        :param stack: 区块组 (N, H, W, 3)
+        :return: (名称数组，超出拒识半径的为 "unknown"；距离数组)
+        """
+        if len(stack) == 0:
+            return np.array([], dtype=object), np.zeros(0, dtype=np.float32)
+        idx, dist = self.search(self.embed(stack), 1)
+        nearest, dist = idx[:, 0], dist[:, 0]
+        names = self.names[nearest].astype(object)
+        names[self.rejected(nearest, dist)] = "unknown"
+        return names, dist
@@ -0,0 +1,167 @@
+import cv2
+import numpy as np
+
+# 特征参数（与 _match_block 的原始实现保持一致）
+HIST_BINS = 8  # 每个通道的直方图分箱数
+SSIM_WIN = 7  # SSIM 滑动窗口边长（skimage 默认值）
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+THUMB_CELL = (8, 6)  # 缩略图每个像素对应的原图区域 (高, 宽)
+
+
+def to_gray(stack, out=None):
+    """
+    批量灰度转换，一次 cvtColor 处理整组图像
+    :param stack: 彩色图像组 (N, H, W, 3)，uint8
+    :param out: 可选的输出数组 (N, H, W)，uint8，连续
+    :return: 灰度图像组 (N, H, W)，uint8
+    """
+    n, h, w = stack.shape[:3]
+    flat = np.ascontiguousarray(stack).reshape(n * h, w, 3)
+    if out is not None:
+        cv2.cvtColor(flat, cv2.COLOR_BGR2GRAY, dst=out.reshape(n * h, w))
+        return out
+    return cv2.cvtColor(flat, cv2.COLOR_BGR2GRAY).reshape(n, h, w)
+
+
+def color_histograms(stack, bins=HIST_BINS):
+    """
+    批量计算三维颜色直方图（等价于 calcHist([img], [0,1,2], None, [bins]*3, [0,256]*3)）
+    :param stack: 彩色图像组 (N, H, W, 3)，uint8
+    :param bins: 每个通道的分箱数
+    :return: 直方图矩阵 (N, bins^3)，float32
+    """
+    ranges = [0, 256] * 3
+    return np.stack([cv2.calcHist([img], [0, 1, 2], None, [bins] * 3, ranges).ravel() for img in stack])
+
+
+def thumbnails(stack, cell=THUMB_CELL):
+    """
+    批量生成缩略图：居中裁剪到 cell 的整数倍后按区域平均缩小
+    整组图像纵向拼接后一次 cv2.resize，缩放倍数为整数，相邻图像之间不会混合
+    :param stack: 彩色图像组 (N, H, W, 3)，uint8
+    :param cell: 每个缩略图像素对应的原图区域 (高, 宽)
+    :return: 缩略图组 (N, H // cell_h, W // cell_w, 3)，uint8
+    """
+    n, h, w = stack.shape[:3]
+    ch, cw = cell
+    th, tw = h // ch, w // cw
+    top, left = (h - th * ch) // 2, (w - tw * cw) // 2
+    crop = np.ascontiguousarray(stack[:, top:top + th * ch, left:left + tw * cw])
+    small = cv2.resize(crop.reshape(n * th * ch, tw * cw, 3), (tw, n * th), interpolation=cv2.INTER_AREA)
+    return small.reshape(n, th, tw, 3)
+
+
+def color_moments(thumbs):
+    """
+    颜色矩：各通道的均值和标准差（由缩略图近似），归一化到 0~1
+    :param thumbs: 缩略图组 (N, h, w, 3)
+    :return: 矩阵 (N, 6)，float32
+    """
+    pixels = thumbs.reshape(len(thumbs), -1, 3).astype(np.float32) / 255
+    return np.hstack([pixels.mean(axis=1), pixels.std(axis=1)])
+
+
+def normalize_rows(mat):
+    """
+    行向量去均值并归一化，使两行的点积等于它们的皮尔逊相关系数（HISTCMP_CORREL）
+    :param mat: 矩阵 (N, D)
+    :return: 归一化后的矩阵 (N, D)，float32
+    """
+    mat = mat.astype(np.float32)
+    mat -= mat.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(mat, axis=1, keepdims=True)
+    return mat / np.maximum(norm, 1e-6)
+
+
+def ncc_vectors(stack):
+    """
+    生成归一化互相关向量，两向量点积等于同尺寸 TM_CCOEFF_NORMED 的结果
+    :param stack: 彩色图像组 (N, H, W, C)
+    :return: 向量矩阵 (N, H*W*C)，float32
+    """
+    n = stack.shape[0]
+    vec = stack.reshape(n, -1, stack.shape[-1]).astype(np.float32)
+    vec -= vec.mean(axis=1, keepdims=True)  # 按通道去均值
+    vec = vec.reshape(n, -1)
+    norm = np.linalg.norm(vec, axis=1, keepdims=True)
+    return vec / np.maximum(norm, 1e-6)
+
+
+def box_sum(planes, win=SSIM_WIN, stride=1):
+    """
+    对最后两维做 valid 模式的窗口求和
+    :param planes: 图像组 (..., H, W)
+    :param win: 窗口边长
+    :param stride: 窗口步长，等于 win 时为不重叠分块
+    :return: 窗口和 (..., H', W')
+    """
+    h, w = planes.shape[-2:]
+    if stride == win:
+        hb, wb = h // win, w // win
+        blocks = planes[..., :hb * win, :wb * win]
+        blocks = blocks.reshape(planes.shape[:-2] + (hb, win, wb, win))
+        return blocks.sum(axis=(-3, -1))
+    out_h, out_w = h - win + 1, w - win + 1
+    rows = planes[..., 0:out_h, :].copy()
+    for k in range(1, win):
+        rows += planes[..., k:k + out_h, :]
+    out = rows[..., 0:out_w].copy()
+    for k in range(1, win):
+        out += rows[..., k:k + out_w]
+    if stride > 1:
+        out = out[..., ::stride, ::stride]
+    return out
+
+
+def ssim_stats(gray, win=SSIM_WIN, stride=1):
+    """
+    预计算 SSIM 所需的局部均值和方差（与 skimage 默认参数一致：均匀窗口、样本协方差）
+    :param gray: 灰度图像组 (N, H, W)
+    :param win: 窗口边长
+    :param stride: 窗口步长
+    :return: (局部均值, 局部方差)，均为 (N, H', W') float32
+    """
+    g = gray.astype(np.float32)
+    area = float(win * win)
+    cov_norm = area / (area - 1)
+    mu = box_sum(g, win, stride) / area
+    var = cov_norm * (box_sum(g * g, win, stride) / area - mu * mu)
+    return mu, var
+
+
+def ssim_single(gray_a, mu_a, var_a, gray_b, mu_b, var_b, win=SSIM_WIN):
+    """
+    利用预计算统计量计算两幅灰度图的 SSIM（等价于 skimage 的 structural_similarity）
+    :return: SSIM 平均值
+    """
+    area = float(win * win)
+    cov_norm = area / (area - 1)
+    a = gray_a.astype(np.float32)
+    b = gray_b.astype(np.float32)
+    cov = cov_norm * (box_sum(a * b, win) / area - mu_a * mu_b)
+    num = (2 * mu_a * mu_b + SSIM_C1) * (2 * cov + SSIM_C2)
+    den = (mu_a * mu_a + mu_b * mu_b + SSIM_C1) * (var_a + var_b + SSIM_C2)
+    return float(np.mean(num / den))
+
+
+_skimage_ssim = None  # skimage 的 structural_similarity（首次调用时导入，未安装时为 False）
+
+
+def structural_similarity(gray_a, gray_b):
+    """
+    两幅同尺寸灰度图的 SSIM：优先使用 skimage（首次调用时才导入），
+    未安装 skimage 时使用等价的 NumPy 实现
+    """
+    global _skimage_ssim
+    if _skimage_ssim is None:
+        try:
+            from skimage.metrics import structural_similarity as ssim
+        except ImportError:
+            ssim = False
+        _skimage_ssim = ssim
+    if _skimage_ssim:
+        return _skimage_ssim(gray_a, gray_b)
+    mu_a, var_a = ssim_stats(gray_a[None])
+    mu_b, var_b = ssim_stats(gray_b[None])
+    return ssim_single(gray_a, mu_a[0], var_a[0], gray_b, mu_b[0], var_b[0])
@@ -0,0 +1,204 @@
+import os
+import cv2
+import numpy as np
+from instrumentation import DISABLED
+
+class FrameSource:
+    """
+    帧来源基类
+    read() 返回 BGR 图像；图像写入预分配的缓冲区并轮换使用，
+    调用方若需在读取后续帧之后继续持有某一帧，应自行复制
+    """
+    instruments = DISABLED  # 性能埋点（由 BlockRecognizer 设置）
+
+    def __init__(self, region=None, buffers=2):
+        """
+        :param region: 裁剪区域 (x1, y1, x2, y2)，为 None 时使用整帧
+        :param buffers: 轮换使用的缓冲区数量
+        """
+        self.region = region
+        self._buffers = [None] * max(1, buffers)
+        self._index = 0
+
+    def _next_buffer(self, shape):
+        """取下一个预分配缓冲区，尺寸变化时才重新分配"""
+        self._index = (self._index + 1) % len(self._buffers)
+        buf = self._buffers[self._index]
+        if buf is None or buf.shape != shape:
+            buf = self._buffers[self._index] = np.empty(shape, dtype=np.uint8)
+        return buf
+
+    def _crop(self, img):
+        """按 region 裁剪（视图，不复制）"""
+        if self.region is None:
+            return img
+        x1, y1, x2, y2 = self.region
+        return img[y1:y2, x1:x2]
+
+    def _store(self, img):
+        """将解码得到的 BGR 图像裁剪后写入缓冲区"""
+        img = self._crop(img)
+        buf = self._next_buffer(img.shape)
+        np.copyto(buf, img)
+        return buf
+
+    def read(self):
+        """
+        读取下一帧
+        :return: BGR 图像，没有更多帧时返回 None
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """释放资源"""
+        pass
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ScreenSource(FrameSource):
+    """屏幕截图来源（PIL.ImageGrab，首次截图时才导入）"""
+
+    def __init__(self, region, buffers=2):
+        super().__init__(region, buffers)
+        self._grab = None
+
+    def read(self):
+        if self._grab is None:
+            from PIL import ImageGrab
+            self._grab = ImageGrab.grab
+        with self.instruments.stage("capture.grab"):
+            img = np.asarray(self._grab(bbox=self.region))
+        with self.instruments.stage("capture.convert"):
+            code = cv2.COLOR_RGBA2BGR if img.shape[2] == 4 else cv2.COLOR_RGB2BGR
+            buf = self._next_buffer(img.shape[:2] + (3,))
+            cv2.cvtColor(img, code, dst=buf)
+        return buf
+
+
+class ImageDirSource(FrameSource):
+    """图片文件来源：目录（按文件名排序）或文件列表"""
+    EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+    def __init__(self, path, region=None, buffers=2):
+        """
+        :param path: 图片目录、单个图片文件或文件路径列表
+        """
+        super().__init__(region, buffers)
+        if isinstance(path, (list, tuple)):
+            self.files = list(path)
+        elif os.path.isdir(path):
+            self.files = [os.path.join(path, f) for f in sorted(os.listdir(path))
+                          if f.lower().endswith(self.EXTENSIONS)]
+        else:
+            self.files = [path]
+        self.current = None  # 最近读取的图片路径
+        self._pos = 0
+
+    def read(self):
+        while self._pos < len(self.files):
+            path = self.files[self._pos]
+            self._pos += 1
+            with self.instruments.stage("capture.decode"):
+                img = cv2.imread(path, cv2.IMREAD_COLOR)
+            if img is None:
+                print(f"警告: 无法读取图片 {path}")
+                continue
+            self.current = path
+            return self._store(img)
+        return None
+
+
+class VideoSource(FrameSource):
+    """视频文件来源（cv2.VideoCapture），解码直接写入复用的缓冲区"""
+
+    def __init__(self, path, region=None, buffers=2, start=0, count=None):
+        """
+        :param start: 第一帧的序号（从该帧开始解码）
+        :param count: 最多读取的帧数，为 None 时读到视频末尾
+        """
+        super().__init__(region, buffers)
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise Exception(f"无法打开视频文件 {path}")
+        if start > 0:
+            self._seek(path, start)
+        self.remaining = count
+        self._decoded = [None] * len(self._buffers)  # 整帧解码缓冲区，与裁剪缓冲区一一对应
+
+    def _seek(self, path, start):
+        """定位到第 start 帧；部分编码格式按帧号定位不精确，此时重新打开并逐帧跳过"""
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        if int(self.capture.get(cv2.CAP_PROP_POS_FRAMES)) == start:
+            return
+        self.capture.release()
+        self.capture = cv2.VideoCapture(path)
+        for _ in range(start):
+            if not self.capture.grab():
+                break
+
+    @staticmethod
+    def frame_count(path):
+        """
+        视频的总帧数（读取容器信息，不解码）
+        :return: 帧数，无法获取时返回 0
+        """
+        capture = cv2.VideoCapture(path)
+        try:
+            return max(0, int(capture.get(cv2.CAP_PROP_FRAME_COUNT))) if capture.isOpened() else 0
+        finally:
+            capture.release()
+
+    def read(self):
+        if self.remaining is not None:
+            if self.remaining <= 0:
+                return None
+            self.remaining -= 1
+        slot = (self._index + 1) % len(self._buffers)
+        with self.instruments.stage("capture.decode"):
+            ok, frame = self.capture.read(self._decoded[slot])
+        if not ok:
+            return None
+        self._decoded[slot] = frame
+        if self.region is None:
+            self._index = slot
+            self._buffers[slot] = frame
+            return frame
+        return self._store(frame)
+
+    def close(self):
+        self.capture.release()
+
+
+class ReplaySource(FrameSource):
+    """内存回放来源：按顺序输出给定的帧序列"""
+
+    def __init__(self, frames, region=None, loop=False, buffers=2):
+        """
+        :param frames: BGR 图像序列
+        :param loop: 播放完毕后是否从头循环
+        """
+        super().__init__(region, buffers)
+        self.frames = list(frames)
+        self.loop = loop
+        self._pos = 0
+
+    def read(self):
+        if self._pos >= len(self.frames):
+            if not self.loop or not self.frames:
+                return None
+            self._pos = 0
+        frame = self.frames[self._pos]
+        self._pos += 1
+        return self._store(frame)
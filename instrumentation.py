@@ -0,0 +1,397 @@
+import io
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+import numpy as np
+from collections import deque, Counter
+
+_NULL_STAGE = contextlib.nullcontext()  # 关闭时所有阶段共用的空上下文，不产生任何计时开销
+
+
+class RollingHistogram:
+    """滚动直方图：保留最近 window 个样本，用于统计分位数和分布"""
+
+    def __init__(self, window=300):
+        self.values = deque(maxlen=window)
+        self.total = 0  # 累计样本数（含已滚出窗口的）
+
+    def add(self, value):
+        self.values.append(value)
+        self.total += 1
+
+    def _array(self):
+        return np.fromiter(self.values, dtype=np.float64, count=len(self.values))
+
+    def stats(self):
+        """
+        窗口内统计
+        :return: {'count', 'mean', 'p50', 'p90', 'p99', 'max'}，无样本时只有 count
+        """
+        if not self.values:
+            return {'count': self.total}
+        arr = self._array()
+        p50, p90, p99 = np.percentile(arr, (50, 90, 99))
+        return {'count': self.total, 'mean': float(arr.mean()), 'p50': float(p50),
+                'p90': float(p90), 'p99': float(p99), 'max': float(arr.max())}
+
+    def histogram(self, bins=10):
+        """
+        窗口内样本分布
+        :return: (各区间计数, 区间边界)
+        """
+        counts, edges = np.histogram(self._array(), bins=bins)
+        return counts.tolist(), edges.tolist()
+
+
+class _Stage:
+    """阶段计时上下文"""
+    __slots__ = ("inst", "name", "start")
+
+    def __init__(self, inst, name):
+        self.inst = inst
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.inst.record(self.name, time.perf_counter() - self.start)
+
+
+class _Sampler(threading.Thread):
+    """采样分析器：定时抓取目标线程的调用栈，统计各函数出现的次数"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.own = Counter()  # 位于栈顶的次数（函数自身耗时）
+        self.cumulative = Counter()  # 出现在栈中的次数（含调用的子函数）
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            seen = set()
+            top = True
+            while frame is not None:
+                code = frame.f_code
+                key = f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+                if top:
+                    self.own[key] += 1
+                    top = False
+                if key not in seen:
+                    seen.add(key)
+                    self.cumulative[key] += 1
+                frame = frame.f_back
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+    def report(self, limit=20):
+        lines = [f"采样 {self.samples} 次（间隔 {self.interval * 1000:.0f} ms）",
+                 f"{'自身%':>7s} {'累计%':>7s}  函数"]
+        total = max(1, self.samples)
+        for key, n in self.cumulative.most_common(limit):
+            lines.append(f"{100 * self.own[key] / total:7.1f} {100 * n / total:7.1f}  {key}")
+        return "\n".join(lines)
+
+
+class Instrumentation:
+    """
+    轻量级性能埋点
+    - stage(name)：阶段计时，写入滚动直方图（毫秒）
+    - value(name, x)：数值样本，如分配的字节数
+    - count(name, n)：计数，如各模板的匹配次数
+    - end_frame()：结束一帧，开启跟踪文件时写入一行 JSON
+    - track_memory()：用 tracemalloc 统计每帧的内存峰值和帧间常驻内存
+    - start_profile()/stop_profile()：运行时开关 cProfile 或采样分析
+    关闭（enabled=False）时 stage() 返回共享的空上下文，其余方法立即返回
+    """
+
+    def __init__(self, enabled=False, window=300):
+        """
+        :param enabled: 是否记录
+        :param window: 滚动直方图保留的样本数
+        """
+        self.enabled = enabled
+        self.window = window
+        self.timings = {}  # 阶段名 -> RollingHistogram（毫秒）
+        self.values = {}  # 数值名 -> RollingHistogram
+        self.counts = Counter()
+        self.frames = 0
+        self._current = self._new_frame()
+        self._trace = None
+        self._trace_lock = threading.Lock()
+        self._profiler = None
+        self._sampler = None
+        self._memory_base = None  # 跟踪内存时上一帧结束时的已分配字节数
+
+    @staticmethod
+    def _new_frame():
+        return {'stages': {}, 'values': {}, 'counts': Counter()}
+
+    @staticmethod
+    def _histogram(table, name, window):
+        hist = table.get(name)
+        if hist is None:
+            hist = table.setdefault(name, RollingHistogram(window))
+        return hist
+
+    def stage(self, name):
+        """阶段计时上下文：with instruments.stage("match"): ..."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        """记录一次阶段耗时（秒）"""
+        if not self.enabled:
+            return
+        ms = seconds * 1000
+        self._histogram(self.timings, name, self.window).add(ms)
+        stages = self._current['stages']
+        stages[name] = stages.get(name, 0.0) + ms
+
+    def value(self, name, amount):
+        """记录一个数值样本（如分配的字节数）"""
+        if not self.enabled:
+            return
+        self._histogram(self.values, name, self.window).add(amount)
+        values = self._current['values']
+        values[name] = values.get(name, 0) + amount
+
+    def count(self, name, n=1):
+        """累加计数"""
+        if not self.enabled:
+            return
+        self.counts[name] += n
+        self._current['counts'][name] += n
+
+    def count_all(self, names, prefix=""):
+        """按名称批量计数（如一批方块的匹配结果）"""
+        if not self.enabled:
+            return
+        counted = Counter(prefix + str(name) for name in names)
+        self.counts.update(counted)
+        self._current['counts'].update(counted)
+
+    def end_frame(self, **extra):
+        """
+        结束一帧：开启跟踪文件时写入该帧各阶段耗时、数值和计数
+        :param extra: 额外写入跟踪记录的字段
+        """
+        if not self.enabled:
+            return
+        if self._memory_base is not None:
+            self._sample_memory()
+        current, self._current = self._current, self._new_frame()
+        self.frames += 1
+        if self._trace is None:
+            return
+        record = {'frame': self.frames, 'time': time.time(),
+                  'stages_ms': current['stages'], 'values': current['values'],
+                  'counts': dict(current['counts'])}
+        record.update(extra)
+        with self._trace_lock:
+            if self._trace is not None:
+                self._trace.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    @property
+    def tracking_memory(self):
+        return self._memory_base is not None
+
+    def track_memory(self, enabled=True):
+        """
+        开关每帧内存统计（tracemalloc 会拖慢分配密集的代码，只在需要时开启）
+        开启后 end_frame() 记录两个数值（字节）：
+        - memory.frame_peak：本帧相对上一帧结束时的峰值增量，即一帧内的临时分配
+        - memory.current：帧结束时的已分配内存，持续增长说明有泄漏或缓存未设上限
+        """
+        if enabled and self._memory_base is None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._memory_base = tracemalloc.get_traced_memory()[0]
+        elif not enabled and self._memory_base is not None:
+            self._memory_base = None
+            tracemalloc.stop()
+
+    def _sample_memory(self):
+        current, peak = tracemalloc.get_traced_memory()
+        self.value("memory.frame_peak", max(peak - self._memory_base, 0))
+        self.value("memory.current", current)
+        self._memory_base = current
+        tracemalloc.reset_peak()
+
+    def memory_stats(self):
+        """
+        每帧内存统计（未开启 track_memory 时为空字典）
+        :return: {'frame_peak': 统计, 'current': 统计, 'growth': 窗口内首尾帧的常驻内存差}
+        """
+        peak, current = self.values.get("memory.frame_peak"), self.values.get("memory.current")
+        if peak is None or current is None:
+            return {}
+        return {'frame_peak': peak.stats(), 'current': current.stats(),
+                'growth': current.values[-1] - current.values[0]}
+
+    def open_trace(self, path):
+        """开始写入 JSON lines 跟踪文件（每帧一行）"""
+        self.close_trace()
+        self._trace = open(path, "a", encoding="utf-8")
+
+    def close_trace(self):
+        with self._trace_lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+    @property
+    def profiling(self):
+        return self._profiler is not None or self._sampler is not None
+
+    def start_profile(self, mode="cprofile", interval=0.005):
+        """
+        开始性能分析（在要分析的线程中调用）
+        :param mode: cprofile 为确定性分析（开销较大），sampling 为定时采样调用栈（开销很小）
+        :param interval: 采样间隔（秒）
+        """
+        if self.profiling:
+            return
+        if mode == "sampling":
+            self._sampler = _Sampler(threading.get_ident(), interval)
+            self._sampler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop_profile(self, limit=20):
+        """
+        停止性能分析
+        :param limit: 报告中列出的函数数
+        :return: 文本报告，未在分析时返回空字符串
+        """
+        if self._sampler is not None:
+            sampler, self._sampler = self._sampler, None
+            sampler.stop()
+            return sampler.report(limit)
+        if self._profiler is not None:
+            profiler, self._profiler = self._profiler, None
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+            return out.getvalue()
+        return ""
+
+    def toggle_profile(self, mode="cprofile"):
+        """切换性能分析开关，停止时返回报告"""
+        if self.profiling:
+            return self.stop_profile()
+        self.start_profile(mode)
+        return ""
+
+    def stats(self):
+        """
+        汇总统计
+        :return: {'frames', 'stages_ms': {阶段: 统计}, 'values': {名称: 统计}, 'counts': {名称: 次数}}
+        """
+        return {
+            'frames': self.frames,
+            'stages_ms': {name: hist.stats() for name, hist in self.timings.items()},
+            'values': {name: hist.stats() for name, hist in self.values.items()},
+            'counts': dict(self.counts),
+        }
+
+    def summary(self, top=10):
+        """多行文本汇总：各阶段耗时分位数、数值统计和最常见的计数"""
+        lines = [f"已记录 {self.frames} 帧"]
+        if self.timings:
+            lines.append(f"{'阶段':24s} {'次数':>6s} {'平均':>8s} {'p50':>8s} {'p90':>8s} {'p99':>8s} {'最大':>8s} (ms)")
+            for name, hist in sorted(self.timings.items()):
+                s = hist.stats()
+                if 'mean' in s:
+                    lines.append(f"{name:24s} {s['count']:6d} {s['mean']:8.2f} {s['p50']:8.2f} "
+                                 f"{s['p90']:8.2f} {s['p99']:8.2f} {s['max']:8.2f}")
+        for name, hist in sorted(self.values.items()):
+            s = hist.stats()
+            if 'mean' in s:
+                lines.append(f"{name:24s} 平均 {s['mean']:.0f} 最大 {s['max']:.0f}")
+        if self.counts:
+            lines.append("计数: " + ", ".join(f"{name}={n}" for name, n in self.counts.most_common(top)))
+        return "\n".join(lines)
+
+    def reset(self):
+        """清空已记录的统计"""
+        self.timings.clear()
+        self.values.clear()
+        self.counts.clear()
+        self.frames = 0
+        self._current = self._new_frame()
+
+    def close(self):
+        """停止分析和内存统计，关闭跟踪文件"""
+        self.stop_profile()
+        self.track_memory(False)
+        self.close_trace()
+
+
+DISABLED = Instrumentation()  # 默认的关闭状态实例，供未指定埋点的组件共用
+
+STARTUP_BUDGET_MS = 500  # 启动耗时预算（导入模块、加载模板、初始化识别器，不含框选区域等交互）
+
+
+class StartupTimer:
+    """
+    启动耗时统计：按阶段记录从开始导入到可以处理第一帧的耗时，并与预算比较
+    mark(name) 记录自上一个标记以来的耗时，skip() 丢弃期间的耗时（如等待用户框选区域）
+    """
+
+    def __init__(self, budget_ms=STARTUP_BUDGET_MS, start=None):
+        """
+        :param budget_ms: 启动耗时预算（毫秒）
+        :param start: 开始时刻（time.perf_counter()），默认为创建时刻
+        """
+        self.budget_ms = budget_ms
+        self.phases = {}  # {阶段名: 毫秒}
+        self._last = time.perf_counter() if start is None else start
+
+    def mark(self, name):
+        """记录自上一个标记以来的耗时"""
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+    def skip(self):
+        """丢弃自上一个标记以来的耗时"""
+        self._last = time.perf_counter()
+
+    @property
+    def total_ms(self):
+        return sum(self.phases.values())
+
+    @property
+    def within_budget(self):
+        return self.total_ms <= self.budget_ms
+
+    def to_dict(self):
+        """{'phases': {阶段名: 毫秒}, 'total_ms', 'budget_ms', 'within_budget'}"""
+        return {'phases': {name: round(ms, 2) for name, ms in self.phases.items()},
+                'total_ms': round(self.total_ms, 2), 'budget_ms': self.budget_ms,
+                'within_budget': self.within_budget}
+
+    def report(self):
+        """一行文字报告"""
+        phases = ", ".join(f"{name} {ms:.0f}" for name, ms in self.phases.items())
+        status = "" if self.within_budget else "，超出预算"
+        return f"启动耗时 {self.total_ms:.0f} ms（预算 {self.budget_ms:.0f} ms{status}）: {phases}"
@@ -1,44 +1,144 @@
+import time
+_STARTED = time.perf_counter()  # 开始导入模块的时刻（统计启动耗时）
+
 from debug_window import DebugWindow
-from screen_selector import select_region
-from template_loader import load_templates
+from template_loader import load_templates, TemplateWatcher
 from block_recognizer import BlockRecognizer
-import cv2
+from matcher_profile import MATCHER_PROFILE, normalize_config
+from instrumentation import Instrumentation, StartupTimer, STARTUP_BUDGET_MS
+from change_detector import AdaptivePoller
+import contextlib
+import argparse
+import json
+import sys
+
+TEMPLATE_DIR = "block_templates"
+
+
+def startup_probe(template_dir=TEMPLATE_DIR, started=None, budget_ms=STARTUP_BUDGET_MS):
+    """
+    测量启动耗时（不框选区域、不显示窗口），结果以一行 JSON 输出到标准输出
+    用于在新进程中测量：python -c "import time; t = time.perf_counter(); import main; main.startup_probe(started=t)"
+    """
+    startup = StartupTimer(budget_ms, started if started is not None else _STARTED)
+    startup.mark("imports")
+    with contextlib.redirect_stdout(sys.stderr):
+        templates = load_templates(template_dir)
+        startup.mark("templates")
+        BlockRecognizer((0, 0, 1, 1), templates, debug_window=DebugWindow())
+        recognizer.max_turns = args.max_turns
+        recognizer.edge_routes = args.edge_routes
+        startup.mark("recognizer")
+    print(json.dumps(startup.to_dict(), ensure_ascii=False))
+
 
 def main():
+    parser = argparse.ArgumentParser(description="方块识别器")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="采集、识别、显示分线程并行运行，识别跟不上时丢弃旧帧")
+    parser.add_argument("--instrument", action="store_true",
+                        help="记录各阶段耗时，退出时打印汇总（运行中按 i 打印）")
+    parser.add_argument("--trace", help="每帧写入一行 JSON 的跟踪文件路径（隐含 --instrument）")
+    parser.add_argument("--memory", action="store_true",
+                        help="统计每帧内存峰值和常驻内存（tracemalloc，会拖慢运行；隐含 --instrument）")
+    parser.add_argument("--profile", choices=["cprofile", "sampling"], default="cprofile",
+                        help="按 p 开关的性能分析方式")
+    parser.add_argument("--max-fps", type=float, default=30, help="调试窗口最高刷新帧率（0 为不限制）")
+    parser.add_argument("--min-poll", type=float, default=20, help="画面变化时的轮询间隔（毫秒）")
+    parser.add_argument("--max-poll", type=float, default=500, help="画面静止时的最长轮询间隔（毫秒）")
+    parser.add_argument("--record", help="录制会话文件路径（画面、校准参数和识别结果，用 session_recorder.py 回放）")
+    parser.add_argument("--no-watch", action="store_true",
+                        help="不监视模板目录（默认增删改 block_templates 中的图片后自动生效，无需重启）")
+    parser.add_argument("--max-turns", type=int, default=1, choices=[0, 1, 2],
+                        help="消除路径最多拐点数（默认 1 为游戏规则，2 为扩展规则）")
+    parser.add_argument("--edge-routes", action="store_true", help="扩展规则：消除路径允许绕行棋盘外圈")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET_MS, help="启动耗时预算（毫秒）")
+    args = parser.parse_args()
+
+    startup = StartupTimer(args.startup_budget, _STARTED)
+    startup.mark("imports")
+
+    instruments = Instrumentation(enabled=args.instrument or args.memory or bool(args.trace))
+    recorder = watcher = None
+    if args.trace:
+        instruments.open_trace(args.trace)
+    if args.memory:
+        instruments.track_memory()
+
     try:
-        # 选择屏幕区域
+        # 选择屏幕区域（框选界面依赖 tkinter 和 PIL，用到时才导入；等待框选的时间不计入启动耗时）
+        from screen_selector import select_region
         print("请框选游戏区域...")
         screen_region = select_region()
         print("已选择区域:", screen_region)
+        startup.skip()
 
         # 加载模板
-        template_dir = "block_templates"
-        templates = load_templates(template_dir)
+        templates = load_templates(TEMPLATE_DIR)
+        startup.mark("templates")
         if not templates:
             print("未找到模板图片，请检查block_templates文件夹")
             return
 
-        # 初始化识别器
-        recognizer = BlockRecognizer(screen_region, templates)
-        recognizer.debug_window = DebugWindow()
+        # 初始化识别器（调试窗口在第一次显示画面时才创建）
+        recognizer = BlockRecognizer(screen_region, templates, debug_window=DebugWindow(max_fps=args.max_fps),
+                                     instruments=instruments)
+        recognizer.max_turns = args.max_turns
+        recognizer.edge_routes = args.edge_routes
+        startup.mark("recognizer")
+        print(startup.report())
+        if recognizer.match_config != normalize_config():
+            print(f"使用匹配配置档案 {MATCHER_PROFILE}: {recognizer.match_config}")
+
+        if not args.no_watch:  # 模板更新在后台线程中增量建立，识别器在两帧之间整体替换
+            watcher = TemplateWatcher(TEMPLATE_DIR, templates)
+            watcher.start(recognizer.update_templates)
+
+        if args.record and not args.pipeline:  # 流水线模式不经过 process_frame，不支持录制
+            from session_recorder import SessionRecorder
+            recorder = SessionRecorder(recognizer, args.record)
+
+        if args.pipeline:
+            from pipeline import FramePipeline
+            pipeline = FramePipeline(recognizer)
+            pipeline.run()
+            print(f"流水线统计: {pipeline.summary()}")
+            return
 
-        bLoop = True
-        # 主循环
+        # 主循环：每轮读取一帧，画面未变化时跳过识别；动画进行中缩短轮询间隔，静止时逐步放慢
+        poller = AdaptivePoller(args.min_poll / 1000, args.max_poll / 1000)
+        delay_ms = poller.next_ms(True)
         while True:
-            if bLoop:
-                bLoop = recognizer.process_frame()
-            key = cv2.waitKey(100) & 0xFF
+            with instruments.stage("main.wait_key"):
+                key = recognizer.debug_window.wait_key(delay_ms) & 0xFF
             if key == ord('q'):
                 break
-            elif key == ord('h'):  # 按h显示可消除的方块对
-                screen_img = recognizer._capture_screen()
-                recognizer.process_frame()
-                recognizer._highlight_removable_pairs(screen_img)
+            recognizer.process_frame()  # 每轮（包括按键时）只截取一帧
+            recognizer.debug_window.poll()  # 显示后台线程绘制完成的画面
+            if key == ord('h'):  # 按h显示可消除的方块对
+                with instruments.stage("highlight"):
+                    recognizer._highlight_removable_pairs(recognizer.last_frame)
+            elif key == ord('i'):  # 按i打印各阶段耗时汇总
+                print(instruments.summary())
+            elif key == ord('p'):  # 按p开始/停止性能分析
+                report = instruments.toggle_profile(args.profile)
+                print(report or f"性能分析已开始（{args.profile}），再按 p 停止并输出报告")
+            delay_ms = poller.next_ms(recognizer.frame_changed or key != 0xFF)
 
     # except Exception as e:
     #     print(f"程序出错: {e}")
     finally:
+        if watcher is not None:
+            watcher.stop()
+        if recorder is not None:
+            recorder.close()
         recognizer.debug_window.close()
+        report = instruments.stop_profile()
+        if report:
+            print(report)
+        if instruments.enabled:
+            print(instruments.summary())
+        instruments.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,91 @@
+import os
+import json
+import features
+from cascade_matcher import CascadeMatcher
+
+MATCHER_PROFILE = "matcher_profile.json"  # autotune.py 写入、识别器启动时读取的匹配配置
+DEFAULT_CONFIG = {
+    'weights': (0.8, 0.8, 0.8),  # (SSIM, 直方图, 模板匹配) 的权重，为 0 的特征不计算
+    'hist_bins': features.HIST_BINS,  # 颜色直方图每个通道的分箱数
+    'resolution': 1.0,  # 工作分辨率：匹配前区块和模板按该比例缩小
+}
+
+
+def normalize_config(config=None):
+    """
+    补全并规范匹配配置（缺少的项取默认值，忽略其他字段）
+    :return: {'weights', 'hist_bins', 'resolution'}
+    """
+    config = dict(DEFAULT_CONFIG, **{k: v for k, v in (config or {}).items() if k in DEFAULT_CONFIG})
+    return {
+        'weights': tuple(float(w) for w in config['weights']),
+        'hist_bins': int(config['hist_bins']),
+        'resolution': float(config['resolution']),
+    }
+
+
+def read_matcher_profile(path=MATCHER_PROFILE):
+    """
+    读取匹配配置档案的全部内容
+    :return: {'config': 规范后的匹配配置, 调优信息...}，档案不存在或无法解析时返回 None
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+        return dict(profile, config=normalize_config(profile.get('config')))
+    except (OSError, ValueError, TypeError, AttributeError):
+        return None
+
+
+def load_matcher_profile(path=MATCHER_PROFILE):
+    """
+    读取匹配配置档案
+    :return: 规范后的匹配配置，档案不存在或无法解析时返回 None
+    """
+    profile = read_matcher_profile(path)
+    return profile['config'] if profile else None
+
+
+def describe_matcher_profile(profile):
+    """
+    档案的验证情况（单行），用于启动时提示
+    :param profile: read_matcher_profile 的结果
+    :return: 只在合成棋盘上验证过（或未记录验证数据）的档案返回警告文字，否则返回 None
+    """
+    data = profile.get('data')
+    if data == 'sessions':
+        return None
+    accuracy = profile.get('accuracy')
+    validated = f"，验证准确率 {accuracy:.4f}" if isinstance(accuracy, (int, float)) else ""
+    source = "只在合成棋盘上验证过" if data == 'synthetic' else "未记录验证数据"
+    return (f"警告: 匹配配置 {profile['config']} {source}{validated}，"
+            f"实际画面的准确率未知（用录制的会话运行 autotune.py --session 重新调优，或删除 {MATCHER_PROFILE}）")
+
+
+def save_matcher_profile(config, path=MATCHER_PROFILE, **info):
+    """
+    写入匹配配置档案
+    :param info: 一并保存的调优信息（验证数据 data: "synthetic" | "sessions"、目标、调优棋盘上的准确率 tune_accuracy，
+                 以及留出的验证棋盘上的准确率 accuracy、耗时和棋盘数 boards 等）
+    """
+    config = normalize_config(config)
+    profile = dict(info, config=dict(config, weights=list(config['weights'])))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def create_matcher(templates, config=None, matcher_cls=CascadeMatcher, buffers=None):
+    """
+    按匹配配置为模板金字塔的一层建立匹配引擎
+    工作分辨率小于 1 时使用同一金字塔中缩小的层，按原尺寸切出的区块在堆叠时整组一次缩小到该层尺寸
+    :param templates: 模板特征库（区块切片使用的层）
+    :param matcher_cls: 匹配引擎类型（CascadeMatcher 或 BatchMatcher）
+    :param buffers: 工作缓冲区池 BufferPool
+    """
+    config = normalize_config(config)
+    bank = templates
+    if config['resolution'] != 1.0:
+        bank = templates.scaled(templates.scale * config['resolution'])
+    return matcher_cls(bank, weights=config['weights'], buffers=buffers, hist_bins=config['hist_bins'])
@@ -0,0 +1,335 @@
+import sys
+import json
+import time
+import queue
+import argparse
+import contextlib
+import multiprocessing
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+from frame_source import FrameSource, ScreenSource, ImageDirSource, VideoSource
+from board_state import BoardState
+from debug_window import NullDebugWindow
+from template_loader import load_templates, PYRAMID_SCALES
+from block_recognizer import BlockRecognizer
+from batch_recognize import VIDEO_EXTENSIONS, board_records
+
+class SharedFrameRing:
+    """
+    共享内存中的帧环形缓冲区：slots 个同尺寸的 BGR 帧槽位
+    采集方每个周期写入一个槽位，工作进程按名称连接后直接以数组视图读取，不复制像素
+    """
+
+    def __init__(self, shape, slots=2, name=None):
+        """
+        :param shape: 帧尺寸 (高, 宽, 3)
+        :param slots: 槽位数（写入下一帧时，上一帧仍可被读取）
+        :param name: 已有共享内存的名称（工作进程连接时使用），为 None 时新建
+        """
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.owner = name is None
+        size = int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size * slots if self.owner else 0)
+        self.frames = [np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=i * size)
+                       for i in range(slots)]
+        self.next_slot = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, frame):
+        """
+        将一帧写入下一个槽位
+        :return: 槽位下标
+        """
+        if frame.shape != self.shape:
+            raise ValueError(f"帧尺寸 {frame.shape} 与共享缓冲区 {self.shape} 不一致")
+        slot = self.next_slot
+        np.copyto(self.frames[slot], frame)
+        self.next_slot = (slot + 1) % self.slots
+        return slot
+
+    def close(self):
+        """断开连接（创建方同时释放共享内存）；调用前应释放所有由槽位得到的数组"""
+        self.frames = []
+        try:
+            self.shm.close()
+        except BufferError:  # 仍有数组引用共享内存，由进程退出时释放
+            pass
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedSlotSource(FrameSource):
+    """共享帧来源：read() 返回指定槽位中本棋盘区域的视图（不复制）"""
+
+    def __init__(self, ring, region=None):
+        super().__init__(region, buffers=1)
+        self.ring = ring
+        self.slot = 0
+
+    def read(self):
+        return self._crop(self.ring.frames[self.slot])
+
+
+def _recognize(recognizer, slot):
+    """
+    识别一个棋盘的当前帧；未校准时先校准，成功后同一帧立即识别
+    :return: 结果字典，画面未变化时不含 state 和 pairs（沿用上一周期的结果）
+    """
+    recognizer.frame_source.slot = slot
+    result = {}
+    start = time.perf_counter()
+    try:
+        if recognizer.process_frame() and recognizer.calibrated:
+            recognizer.process_frame()
+        if recognizer.frame_changed and recognizer.last_state is not None:
+            result['state'] = recognizer.last_state.to_bytes()
+            result['pairs'] = recognizer._pair_finder().removable_pairs()
+    except Exception as e:
+        result['error'] = str(e)
+    result['calibrated'] = recognizer.calibrated
+    result['changed'] = recognizer.frame_changed
+    result['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def _worker_main(ring_name, shape, slots, boards, template_dir, options, tasks, results):
+    """
+    工作进程：连接共享帧缓冲区，为分配到的每个棋盘维护一个 BlockRecognizer（校准和增量识别状态常驻进程内）
+    :param boards: {棋盘编号: 区域 (x1, y1, x2, y2)}（相对共享帧）
+    :param options: 识别器属性 {'max_turns', 'edge_routes'}
+    :param tasks: 任务队列，每项为 (周期号, 槽位)，None 表示退出
+    :param results: 结果队列，每项为 (周期号, 棋盘编号, 结果)
+    """
+    sys.stdout = sys.stderr
+    cv2.setNumThreads(1)  # 并行由进程提供，避免每个进程再各自开满 OpenCV 线程
+    ring = SharedFrameRing(shape, slots, ring_name)
+    templates = load_templates(template_dir)
+    recognizers = {}
+    for board_id, region in boards.items():
+        recognizer = BlockRecognizer(region, templates, frame_source=SharedSlotSource(ring, region),
+                                     debug_window=NullDebugWindow())
+        recognizer.use_profiles = False  # 多进程时不读写共享的校准档案
+        recognizer.solve_budget = 0
+        for attr, value in options.items():
+            setattr(recognizer, attr, value)
+        recognizers[board_id] = recognizer
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            tick, slot = task
+            for board_id, recognizer in recognizers.items():
+                results.put((tick, board_id, _recognize(recognizer, slot)))
+    finally:
+        recognizers.clear()
+        ring.close()
+
+
+class MultiBoardRecognizer:
+    """
+    多棋盘识别：每个周期采集的一帧写入共享内存，多个已框选的棋盘区域由工作进程并行识别，结果按棋盘编号合并
+    每个棋盘固定由同一个工作进程处理（保留校准和增量识别状态），棋盘按轮转方式分配给各进程；
+    各进程相互独立，CPU 核数足够时吞吐量随进程数增长（用 benchmark.py 的多棋盘测试测量加速比）
+    submit() 和 collect() 分开调用时，下一帧的采集可以与上一帧的识别重叠
+    """
+
+    def __init__(self, regions, frame_shape, template_dir="block_templates", workers=None, slots=2,
+                 max_turns=1, edge_routes=False, timeout=30.0):
+        """
+        :param regions: {棋盘编号: 区域 (x1, y1, x2, y2)}，坐标相对采集的帧
+        :param frame_shape: 帧尺寸 (高, 宽, 3)
+        :param workers: 工作进程数，默认为 CPU 核数（不超过棋盘数）
+        :param slots: 共享帧槽位数（同时在途的周期数上限）
+        :param timeout: 等待单个结果的最长时间（秒）
+        """
+        self.regions = dict(regions)
+        self.timeout = timeout
+        # 先在主进程中建立（或验证）特征库和金字塔各层的磁盘缓存，工作进程启动后只读取缓存，
+        # 不会在冷缓存上同时重建并写入同一目录
+        with contextlib.redirect_stdout(sys.stderr):
+            load_templates(template_dir, scales=PYRAMID_SCALES)
+        self.ring = SharedFrameRing(frame_shape, slots)
+        workers = max(1, min(workers or multiprocessing.cpu_count(), len(self.regions)))
+        assignments = [{} for _ in range(workers)]
+        for i, (board_id, region) in enumerate(self.regions.items()):
+            assignments[i % workers][board_id] = tuple(region)
+
+        options = {'max_turns': max_turns, 'edge_routes': edge_routes}
+        self._results = multiprocessing.Queue()
+        self._tasks = []
+        self._processes = []
+        for boards in assignments:
+            tasks = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_worker_main, daemon=True,
+                args=(self.ring.name, self.ring.shape, slots, boards, template_dir, options, tasks, self._results))
+            process.start()
+            self._tasks.append(tasks)
+            self._processes.append(process)
+
+        self.ticks = 0
+        self._pending = {}  # {槽位: 尚未取回结果的周期号}
+        self._partial = {}  # {周期号: {棋盘编号: 结果}}
+        self.states = {board_id: None for board_id in self.regions}  # 各棋盘最近的 BoardState
+        self.pairs = {board_id: [] for board_id in self.regions}  # 各棋盘最近的可消除对
+
+    @property
+    def workers(self):
+        return len(self._processes)
+
+    def submit(self, frame):
+        """
+        写入一帧并分发给所有工作进程（槽位仍被占用时先取回其结果）
+        :return: 周期号
+        """
+        slot = self.ring.next_slot
+        if slot in self._pending:
+            self.collect(self._pending[slot])
+        self.ring.write(frame)
+        tick = self.ticks
+        self.ticks += 1
+        for tasks in self._tasks:
+            tasks.put((tick, slot))
+        self._pending[slot] = tick
+        return tick
+
+    def collect(self, tick):
+        """
+        等待并合并一个周期所有棋盘的结果
+        :return: {棋盘编号: {'state': BoardState | None, 'pairs', 'calibrated', 'changed', 'elapsed_ms'[, 'error']}}，
+                 画面未变化的棋盘沿用上一周期的 state 和 pairs
+        """
+        while len(self._partial.get(tick, ())) < len(self.regions):
+            try:
+                t, board_id, result = self._results.get(timeout=self.timeout)
+            except queue.Empty:
+                if not all(p.is_alive() for p in self._processes):
+                    raise RuntimeError("工作进程意外退出")
+                continue
+            self._partial.setdefault(t, {})[board_id] = result
+        for slot, pending in list(self._pending.items()):
+            if pending == tick:
+                del self._pending[slot]
+
+        merged = {}
+        for board_id, result in sorted(self._partial.pop(tick).items(), key=lambda item: str(item[0])):
+            if 'state' in result:
+                self.states[board_id] = BoardState.from_bytes(result.pop('state'))
+                self.pairs[board_id] = [tuple(map(tuple, pair)) for pair in result.pop('pairs')]
+            merged[board_id] = dict(result, state=self.states[board_id], pairs=self.pairs[board_id])
+        return merged
+
+    def recognize(self, frame):
+        """同步识别一帧：submit 后立即 collect"""
+        return self.collect(self.submit(frame))
+
+    def close(self):
+        """通知工作进程退出并释放共享内存"""
+        for tasks in self._tasks:
+            tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+        self.ring.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _record(tick, merged, elapsed):
+    """一个周期的合并结果转换为 JSON 行"""
+    boards = {}
+    for board_id, result in merged.items():
+        entry = {key: result[key] for key in ('calibrated', 'changed', 'elapsed_ms', 'error') if key in result}
+        if result['state'] is not None:
+            entry['board'] = board_records(result['state'])
+            entry['pairs'] = [[list(a), list(b)] for a, b in result['pairs']]
+        boards[str(board_id)] = entry
+    return json.dumps({'tick': tick, 'boards': boards, 'elapsed_ms': round(elapsed * 1000, 2)}, ensure_ascii=False)
+
+
+def _open_source(path, bbox):
+    """帧来源：未指定输入时截取覆盖所有棋盘的屏幕区域"""
+    if path is None:
+        return ScreenSource(bbox)
+    if path.lower().endswith(VIDEO_EXTENSIONS):
+        return VideoSource(path)
+    return ImageDirSource(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多棋盘识别（每周期采集一帧写入共享内存，工作进程并行识别各棋盘）")
+    parser.add_argument("--region", nargs=4, type=int, action="append", required=True,
+                        metavar=("X1", "Y1", "X2", "Y2"), help="一个棋盘区域（可重复指定）")
+    parser.add_argument("--input", help="图片目录或视频文件（默认截取屏幕，区域为屏幕坐标）")
+    parser.add_argument("--templates", default="block_templates", help="模板目录")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="工作进程数")
+    parser.add_argument("--interval", type=float, default=50, help="截屏间隔（毫秒）")
+    parser.add_argument("--max-ticks", type=int, default=0, help="最多处理的周期数（0 为不限）")
+    parser.add_argument("--max-turns", type=int, default=1, choices=[0, 1, 2],
+                        help="消除路径最多拐点数（默认 1 为游戏规则，2 为扩展规则）")
+    parser.add_argument("--edge-routes", action="store_true", help="扩展规则：消除路径允许绕行棋盘外圈")
+    parser.add_argument("--output", help="JSON lines 输出文件（默认输出到标准输出）")
+    args = parser.parse_args(argv)
+
+    # 截屏时只截取覆盖所有棋盘的外接矩形，棋盘区域换算为相对该矩形的坐标
+    regions = [tuple(region) for region in args.region]
+    if args.input is None:
+        bbox = (min(r[0] for r in regions), min(r[1] for r in regions),
+                max(r[2] for r in regions), max(r[3] for r in regions))
+        regions = [(x1 - bbox[0], y1 - bbox[1], x2 - bbox[0], y2 - bbox[1]) for x1, y1, x2, y2 in regions]
+    else:
+        bbox = None
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    source = _open_source(args.input, bbox)
+    ticks = 0
+    start = time.perf_counter()
+    try:
+        with source:
+            first = source.read()
+            if first is None:
+                print("没有可识别的画面", file=sys.stderr)
+                return 1
+            with MultiBoardRecognizer(dict(enumerate(regions)), first.shape, args.templates, args.workers,
+                                      max_turns=args.max_turns, edge_routes=args.edge_routes) as multi:
+                frame, previous = first, None
+                try:
+                    while frame is not None:
+                        submitted = (multi.submit(frame), time.perf_counter())
+                        if previous is not None:  # 本周期的识别进行时输出上一周期的结果
+                            out.write(_record(previous[0], multi.collect(previous[0]),
+                                              time.perf_counter() - previous[1]) + "\n")
+                            out.flush()
+                        previous = submitted
+                        ticks += 1
+                        if args.max_ticks and ticks >= args.max_ticks:
+                            break
+                        if args.input is None:
+                            time.sleep(args.interval / 1000)
+                        frame = source.read()
+                except KeyboardInterrupt:
+                    pass
+                if previous is not None:
+                    out.write(_record(previous[0], multi.collect(previous[0]), time.perf_counter() - previous[1]) + "\n")
+                workers = multi.workers
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print(f"完成 {ticks} 个周期 × {len(regions)} 个棋盘（{workers} 个工作进程），用时 {elapsed:.1f} 秒"
+          f"（{ticks * len(regions) / max(elapsed, 1e-9):.1f} 棋盘帧/秒）", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+import numpy as np
+from board_state import BoardState, NONE_ID
+from itertools import combinations
+
+class PairFinder:
+    """
+    可消除方块对查找引擎
+    - 按方块类型分桶，只检查同类型方块对
+    - 棋盘保存为稠密占用数组，并维护行、列前缀和，直线段是否畅通为 O(1) 查询
+    - 默认与 check_elimination 的原有规则一致（直连或单拐点，不绕行外圈）；
+      双拐点路径和绕行棋盘外圈为可选的扩展规则
+    """
+
+    def __init__(self, state, max_turns=1, edge_routes=False):
+        """
+        :param state: 识别结果 BoardState，或字典 {(col, row): {'name': ..., 'coordinate': ...}}
+        :param max_turns: 路径允许的最多拐点数（0~2）
+        :param edge_routes: 是否允许路径经过棋盘外圈
+        """
+        state = BoardState.from_dict(state)
+        self.state = state
+        self.max_turns = max_turns
+        self.edge_routes = edge_routes
+
+        pad = 1  # 外圈一格：允许绕行时为空，否则为阻挡
+        labels = state.labels
+        self._col0 = state.col0 - pad
+        self._row0 = state.row0 - pad
+        height, width = labels.shape[0] + 2 * pad, labels.shape[1] + 2 * pad
+
+        # 占用数组：1 表示有方块或未识别的格子，0 表示空格（None）
+        occupancy = np.ones((height, width), dtype=np.int32)
+        if edge_routes:
+            occupancy[0, :] = occupancy[-1, :] = 0
+            occupancy[:, 0] = occupancy[:, -1] = 0
+        occupancy[pad:-pad, pad:-pad][labels == NONE_ID] = 0
+
+        self.buckets = {}  # {方块类型: [网格坐标, ...]}
+        names = state.table.names
+        rs, cs = np.nonzero(labels > NONE_ID)
+        for r, c, label in zip(rs.tolist(), cs.tolist(), labels[rs, cs].tolist()):
+            self.buckets.setdefault(names[label], []).append((c + state.col0, r + state.row0))
+        for positions in self.buckets.values():
+            positions.sort()
+
+        self.occupancy = occupancy
+        self._occ = occupancy.tolist()  # 热路径用列表索引，避免 numpy 标量开销
+        self._row_prefix = [self._prefix(row) for row in self._occ]
+        self._col_prefix = [self._prefix(col) for col in occupancy.T.tolist()]
+        self._pairs = None
+
+    def copy(self):
+        """复制当前棋盘（共享只读的识别结果，占用数组与前缀和各自独立）"""
+        other = object.__new__(PairFinder)
+        other.state = self.state
+        other.max_turns = self.max_turns
+        other.edge_routes = self.edge_routes
+        other._col0, other._row0 = self._col0, self._row0
+        other.buckets = {name: list(positions) for name, positions in self.buckets.items()}
+        other.occupancy = self.occupancy.copy()
+        other._occ = [list(row) for row in self._occ]
+        other._row_prefix = list(self._row_prefix)  # 各前缀和列表只会被整体替换，可共享
+        other._col_prefix = list(self._col_prefix)
+        other._pairs = None if self._pairs is None else dict(self._pairs)
+        return other
+
+    @staticmethod
+    def _prefix(values):
+        """前缀和列表，prefix[i] 为前 i 个元素之和"""
+        prefix = [0]
+        for v in values:
+            prefix.append(prefix[-1] + v)
+        return prefix
+
+    def _cell(self, pos):
+        """网格坐标 (col, row) 转为占用数组下标 (r, c)"""
+        return pos[1] - self._row0, pos[0] - self._col0
+
+    def _row_open(self, r, c1, c2):
+        """第 r 行在 c1、c2 之间（不含两端）是否全为空"""
+        if c1 > c2:
+            c1, c2 = c2, c1
+        prefix = self._row_prefix[r]
+        return c2 - c1 <= 1 or prefix[c2] - prefix[c1 + 1] == 0
+
+    def _col_open(self, c, r1, r2):
+        """第 c 列在 r1、r2 之间（不含两端）是否全为空"""
+        if r1 > r2:
+            r1, r2 = r2, r1
+        prefix = self._col_prefix[c]
+        return r2 - r1 <= 1 or prefix[r2] - prefix[r1 + 1] == 0
+
+    def _connected(self, a, b):
+        """检查占用数组下标 a、b 之间是否存在不超过 max_turns 个拐点的路径"""
+        (ra, ca), (rb, cb) = a, b
+        occ = self._occ
+
+        # 直线路径
+        if ra == rb and self._row_open(ra, ca, cb):
+            return True
+        if ca == cb and self._col_open(ca, ra, rb):
+            return True
+        if self.max_turns < 1:
+            return False
+
+        # 单拐点路径：拐点 (ra, cb) 或 (rb, ca)
+        if occ[ra][cb] == 0 and self._row_open(ra, ca, cb) and self._col_open(cb, ra, rb):
+            return True
+        if occ[rb][ca] == 0 and self._col_open(ca, ra, rb) and self._row_open(rb, ca, cb):
+            return True
+        if self.max_turns < 2:
+            return False
+
+        # 双拐点路径：a 沿行走到第 c 列，竖直到 b 所在行，再沿行走到 b
+        for c in range(len(occ[0])):
+            if c == ca or c == cb or occ[ra][c] or occ[rb][c]:
+                continue
+            if self._row_open(ra, ca, c) and self._col_open(c, ra, rb) and self._row_open(rb, c, cb):
+                return True
+        # a 沿列走到第 r 行，水平到 b 所在列，再沿列走到 b
+        for r in range(len(occ)):
+            if r == ra or r == rb or occ[r][ca] or occ[r][cb]:
+                continue
+            if self._col_open(ca, ra, r) and self._row_open(r, ca, cb) and self._col_open(cb, r, rb):
+                return True
+        return False
+
+    def can_eliminate(self, pos1, pos2):
+        """
+        检查两个方块是否可以消除
+        :param pos1: 第一个方块的网格坐标 (col1, row1)
+        :param pos2: 第二个方块的网格坐标 (col2, row2)
+        """
+        label = self.state.label_at(pos1)
+        if pos1 == pos2 or label <= NONE_ID or label != self.state.label_at(pos2):
+            return False  # 没有方块、空白或类型不同
+        name = self.state.table.names[label]
+        if pos1 not in self.buckets.get(name, ()) or pos2 not in self.buckets.get(name, ()):
+            return False  # 已被移除
+        return self._connected(self._cell(pos1), self._cell(pos2))
+
+    def removable_pairs(self):
+        """
+        所有可消除的方块对
+        :return: [(pos1, pos2), ...]，按方块类型和坐标排序
+        """
+        if self._pairs is None:
+            self._pairs = {}
+            for name, positions in self.buckets.items():
+                for pos1, pos2 in combinations(positions, 2):
+                    if self._connected(self._cell(pos1), self._cell(pos2)):
+                        self._pairs[(pos1, pos2)] = name
+        return sorted(self._pairs, key=lambda pair: (self._pairs[pair], pair))
+
+    def remove(self, pos1, pos2):
+        """
+        移除一对方块并增量更新前缀和与可消除列表
+        移除方块只会打通路径，原有的可消除对仍然成立，只需复查其余同类型方块对
+        """
+        self.removable_pairs()
+        for pos in (pos1, pos2):
+            r, c = self._cell(pos)
+            name = self.state.name_at(pos)
+            self.buckets[name].remove(pos)
+            if not self.buckets[name]:
+                del self.buckets[name]
+            self._occ[r][c] = 0
+            self.occupancy[r, c] = 0
+            self._row_prefix[r] = self._prefix(self._occ[r])
+            self._col_prefix[c] = self._prefix(row[c] for row in self._occ)
+
+        self._pairs = {pair: name for pair, name in self._pairs.items()
+                       if pos1 not in pair and pos2 not in pair}
+        for name, positions in self.buckets.items():
+            for pair in combinations(positions, 2):
+                if pair not in self._pairs and self._connected(self._cell(pair[0]), self._cell(pair[1])):
+                    self._pairs[pair] = name
@@ -0,0 +1,213 @@
+import time
+import queue
+import threading
+import numpy as np
+from collections import deque
+from change_detector import AdaptivePoller
+
+class FramePipeline:
+    """
+    多线程流水线：采集、识别、显示三个阶段通过有界队列连接
+    - 下游处理不过来时丢弃旧帧，队列中只保留最新的帧，避免积压
+    - 统计端到端延迟（采集到显示）和持续帧率
+    - 采集阶段用识别器的帧级变化检测过滤静止画面，静止时按 poller 逐步放慢采集
+    显示阶段运行在调用 run() 的线程中（HighGUI 需要在主线程调用）
+    """
+
+    def __init__(self, recognizer, queue_size=1, window=120, poller=None):
+        """
+        :param recognizer: 已创建的 BlockRecognizer
+        :param queue_size: 各阶段之间队列的容量
+        :param window: 统计帧率和延迟的滑动窗口帧数
+        :param poller: 画面静止时的采集间隔 AdaptivePoller，默认 20~500 ms
+        """
+        self.recognizer = recognizer
+        self.poller = poller or AdaptivePoller()
+        self._frames = queue.Queue(queue_size)  # 采集 -> 识别
+        self._results = queue.Queue(queue_size)  # 识别 -> 显示
+        self._stop = threading.Event()
+        self._latencies = deque(maxlen=window)
+        self._shown = deque(maxlen=window)  # 各帧显示完成的时间
+        self.frames = 0  # 已显示的帧数
+        self.dropped = {'capture': 0, 'recognize': 0}  # 各阶段因下游繁忙丢弃的帧数
+        self.unchanged = 0  # 画面未变化、未送入识别的帧数
+        self.error = None
+
+        # 帧缓冲池：帧来源的缓冲区会被下一次读取覆盖，流水线中的帧各自占用一个池内缓冲区
+        # 同时在用的帧最多为：两个队列中的帧、采集/识别/显示各一帧
+        self._pool_size = 2 * queue_size + 3
+        self._allocated = 0
+        self._free = queue.Queue()
+
+    def _acquire(self, shape):
+        """从缓冲池取一个空闲缓冲区，池未满时按需分配"""
+        while not self._stop.is_set():
+            try:
+                buf = self._free.get_nowait()
+            except queue.Empty:
+                if self._allocated < self._pool_size:
+                    self._allocated += 1
+                    return np.empty(shape, dtype=np.uint8)
+                try:
+                    buf = self._free.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            if buf.shape != shape:
+                buf = np.empty(shape, dtype=np.uint8)
+            return buf
+        return None
+
+    def _release(self, buf):
+        """归还缓冲区"""
+        if buf is not None:
+            self._free.put(buf)
+
+    def _put_latest(self, q, item, frame_index):
+        """
+        放入队列，队列已满时丢弃最旧的一项并归还其缓冲区
+        :param frame_index: 队列元素中帧所在的下标
+        :return: 是否丢弃了旧帧
+        """
+        dropped = False
+        while True:
+            try:
+                q.put_nowait(item)
+                return dropped
+            except queue.Full:
+                try:
+                    stale = q.get_nowait()
+                except queue.Empty:
+                    continue
+                if stale is not None:
+                    self._release(stale[frame_index])
+                    dropped = True
+
+    def _finish(self, q):
+        """放入结束标记；不丢弃队列中尚未处理的帧"""
+        while True:
+            try:
+                q.put(None, timeout=0.1)
+                return
+            except queue.Full:
+                if self._stop.is_set():
+                    return
+
+    def _capture_loop(self):
+        """采集阶段"""
+        try:
+            while not self._stop.is_set():
+                frame = self.recognizer.frame_source.read()
+                if frame is None:
+                    break
+                captured = time.perf_counter()
+                if self.recognizer.skip_unchanged and not self.recognizer.change_detector.update(frame):
+                    self.unchanged += 1
+                    self._stop.wait(self.poller.next(False))
+                    continue
+                self.poller.next(True)
+                buf = self._acquire(frame.shape)
+                if buf is None:
+                    break
+                np.copyto(buf, frame)
+                if self._put_latest(self._frames, (captured, buf), 1):
+                    self.dropped['capture'] += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self._finish(self._frames)
+
+    def _recognize_loop(self):
+        """识别阶段"""
+        try:
+            while not self._stop.is_set():
+                item = self._frames.get()
+                if item is None:
+                    break
+                captured, frame = item
+                with self.recognizer.instruments.stage("recognize"):
+                    state = self.recognizer._recognize_blocks(frame, render=False)
+                self.recognizer.last_state = state
+                if self._put_latest(self._results, (captured, frame, state), 1):
+                    self.dropped['recognize'] += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self._finish(self._results)
+
+    def stats(self):
+        """
+        流水线统计
+        :return: {'fps', 'latency_ms', 'latency_p95_ms', 'frames', 'dropped', 'unchanged'}
+        """
+        fps = 0.0
+        if len(self._shown) > 1 and self._shown[-1] > self._shown[0]:
+            fps = (len(self._shown) - 1) / (self._shown[-1] - self._shown[0])
+        latencies = np.array(self._latencies) * 1000 if self._latencies else np.zeros(1)
+        return {
+            'fps': fps,
+            'latency_ms': float(np.median(latencies)),
+            'latency_p95_ms': float(np.percentile(latencies, 95)),
+            'frames': self.frames,
+            'dropped': dict(self.dropped),
+            'unchanged': self.unchanged,
+        }
+
+    def summary(self):
+        """单行统计信息"""
+        s = self.stats()
+        return (f"{s['fps']:.1f} FPS 延迟 {s['latency_ms']:.0f} ms (p95 {s['latency_p95_ms']:.0f} ms) "
+                f"丢帧 {sum(s['dropped'].values())} 静止 {s['unchanged']}")
+
+    def run(self, display=True, wait_ms=1):
+        """
+        运行流水线，直到帧来源结束或按 q 退出
+        :param display: 是否绘制调试窗口并响应按键（为 False 时只统计，不调用 HighGUI）
+        :param wait_ms: 显示阶段每次等待按键的毫秒数
+        """
+        # 校准在启动线程前同步完成
+        recognizer = self.recognizer
+        inst = recognizer.instruments
+        while not recognizer.calibrated:
+            recognizer.process_frame()
+
+        threads = [threading.Thread(target=self._capture_loop, daemon=True),
+                   threading.Thread(target=self._recognize_loop, daemon=True)]
+        for t in threads:
+            t.start()
+
+        frame = state = None
+        try:
+            while True:
+                try:
+                    item = self._results.get(timeout=0.1)
+                except queue.Empty:
+                    item = False
+                if item is None:
+                    break
+                if item:
+                    self._release(frame)  # 上一帧不再需要
+                    captured, frame, state = item
+                    if display:
+                        with inst.stage("display"):
+                            recognizer._render_blocks(frame, state, f"识别完成 {self.summary()}")
+                    now = time.perf_counter()
+                    self._latencies.append(now - captured)
+                    self._shown.append(now)
+                    self.frames += 1
+                    inst.end_frame(blocks=len(state), latency_ms=(now - captured) * 1000)
+
+                if not display:
+                    continue
+                recognizer.debug_window.poll()
+                key = recognizer.debug_window.wait_key(wait_ms) & 0xFF
+                if key == ord('q'):
+                    break
+                elif key == ord('h') and frame is not None:  # 按h显示可消除的方块对
+                    recognizer._highlight_removable_pairs(frame, state)
+        finally:
+            self._stop.set()
+            for t in threads:
+                t.join(timeout=1.0)
+
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,335 @@
+import sys
+import json
+import time
+import struct
+import argparse
+import contextlib
+import cv2
+import numpy as np
+from frame_source import FrameSource
+from board_state import BoardState
+from debug_window import NullDebugWindow
+from template_loader import load_templates
+from block_recognizer import BlockRecognizer
+
+MAGIC = b"BRS1\n"  # 会话文件标识
+VERSION = 1
+_RECORD = struct.Struct("<cIdI")  # 记录头：类型, 帧序号, 时间戳, 数据字节数
+_TILE = struct.Struct("<HHI")  # 变化图块：行号, 列号, PNG 字节数
+
+# 记录类型
+META = b"M"  # 会话信息 (JSON)
+KEYFRAME = b"K"  # 整帧 PNG
+DELTA = b"D"  # 相对上一帧变化的图块 PNG
+CALIBRATION = b"C"  # 校准参数 (JSON)
+RESULT = b"R"  # 识别结果：JSON 长度 (uint32) + JSON + BoardState 字节（可为空）
+
+
+class SessionWriter:
+    """
+    会话文件写入：记录流式追加，每帧写完即刷新（进程异常退出时已写入的帧仍可回放）
+    首帧和每隔 keyframe_interval 帧写入整帧，其余帧只写入与上一帧不同的 tile × tile 图块，均为无损 PNG
+    """
+
+    def __init__(self, path, keyframe_interval=300, tile=64, png_level=1):
+        """
+        :param keyframe_interval: 整帧的间隔帧数
+        :param tile: 图块边长（像素）
+        :param png_level: PNG 压缩级别 0~9（越高越小、越慢）
+        """
+        self.keyframe_interval = keyframe_interval
+        self.tile = tile
+        self.png_params = [cv2.IMWRITE_PNG_COMPRESSION, png_level]
+        self.stats = {'frames': 0, 'keyframes': 0, 'tiles': 0, 'bytes': len(MAGIC)}
+        self._previous = None  # 上一帧（用于比较变化的图块）
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+
+    def _write(self, kind, index, payload, timestamp=0.0):
+        self._file.write(_RECORD.pack(kind, index, timestamp, len(payload)))
+        self._file.write(payload)
+        self.stats['bytes'] += _RECORD.size + len(payload)
+
+    def _encode(self, img):
+        ok, data = cv2.imencode(".png", img, self.png_params)
+        if not ok:
+            raise ValueError("PNG 编码失败")
+        return data.tobytes()
+
+    def changed_tiles(self, frame):
+        """
+        与上一帧不同的图块
+        :return: 布尔数组 (图块行数, 图块列数)
+        """
+        h, w = frame.shape[:2]
+        diff = cv2.absdiff(frame, self._previous).reshape(h, -1)
+        rows = np.maximum.reduceat(diff, np.arange(0, h, self.tile), axis=0)
+        return np.maximum.reduceat(rows, np.arange(0, diff.shape[1], self.tile * frame.shape[2]), axis=1) > 0
+
+    def write_meta(self, meta):
+        self._write(META, 0, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+    def write_frame(self, index, frame, timestamp):
+        """写入一帧（整帧或变化图块）"""
+        keyframe = (self._previous is None or self._previous.shape != frame.shape
+                    or index % self.keyframe_interval == 0)
+        if not keyframe:
+            changed = self.changed_tiles(frame)
+            keyframe = changed.mean() > 0.5  # 大部分图块都变化时整帧编码更省
+        if keyframe:
+            self._write(KEYFRAME, index, self._encode(frame), timestamp)
+            self._previous = frame.copy()
+            self.stats['keyframes'] += 1
+        else:
+            t = self.tile
+            parts = [struct.pack("<H", int(changed.sum()))]
+            for r, c in zip(*np.nonzero(changed)):
+                tile = frame[r * t:(r + 1) * t, c * t:(c + 1) * t]
+                data = self._encode(tile)
+                parts += [_TILE.pack(r, c, len(data)), data]
+                np.copyto(self._previous[r * t:(r + 1) * t, c * t:(c + 1) * t], tile)
+            self._write(DELTA, index, b"".join(parts), timestamp)
+            self.stats['tiles'] += int(changed.sum())
+        self.stats['frames'] += 1
+
+    def write_calibration(self, index, params):
+        self._write(CALIBRATION, index, json.dumps(params).encode("utf-8"))
+
+    def write_result(self, index, info, state=None):
+        """
+        :param info: 可序列化为 JSON 的结果信息
+        :param state: 识别结果 BoardState，与上一帧相同时为 None
+        """
+        data = json.dumps(info, ensure_ascii=False).encode("utf-8")
+        self._write(RESULT, index, struct.pack("<I", len(data)) + data + (state.to_bytes() if state is not None else b""))
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class SessionReader:
+    """
+    会话文件读取：按写入顺序产生事件，帧事件的画面在内部缓冲区中逐帧重建（下一帧会覆盖）
+    - ('meta', 0, 会话信息)
+    - ('frame', 帧序号, (画面, 时间戳))
+    - ('calibration', 帧序号, 校准参数)
+    - ('result', 帧序号, (结果信息, BoardState | None))
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        if not self.data.startswith(MAGIC):
+            raise ValueError(f"{path} 不是会话文件")
+        self.meta = {}
+        self._frame = None
+
+    def _decode(self, data):
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def __iter__(self):
+        data = memoryview(self.data)
+        offset = len(MAGIC)
+        while offset + _RECORD.size <= len(data):
+            kind, index, timestamp, length = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            if offset + length > len(data):
+                break  # 录制中断留下的不完整记录
+            payload = data[offset:offset + length]
+            offset += length
+            if kind == META:
+                self.meta = json.loads(bytes(payload).decode("utf-8"))
+                yield 'meta', index, self.meta
+            elif kind == KEYFRAME:
+                self._frame = self._decode(payload)
+                yield 'frame', index, (self._frame, timestamp)
+            elif kind == DELTA:
+                self._apply_tiles(payload)
+                yield 'frame', index, (self._frame, timestamp)
+            elif kind == CALIBRATION:
+                yield 'calibration', index, json.loads(bytes(payload).decode("utf-8"))
+            elif kind == RESULT:
+                (size,) = struct.unpack_from("<I", payload)
+                info = json.loads(bytes(payload[4:4 + size]).decode("utf-8"))
+                state = BoardState.from_bytes(payload[4 + size:]) if len(payload) > 4 + size else None
+                yield 'result', index, (info, state)
+
+    def _apply_tiles(self, payload):
+        """将变化图块写回重建的画面"""
+        t = self.meta.get('tile', 64)
+        (count,) = struct.unpack_from("<H", payload)
+        offset = 2
+        for _ in range(count):
+            r, c, length = _TILE.unpack_from(payload, offset)
+            offset += _TILE.size
+            tile = self._decode(payload[offset:offset + length])
+            offset += length
+            self._frame[r * t:r * t + tile.shape[0], c * t:c * t + tile.shape[1]] = tile
+
+
+class SessionRecorder:
+    """
+    会话录制：接管识别器的 process_frame，每帧记录读取的画面、校准参数（校准帧）和识别结果
+    process_frame 的耗时单独计时，不含录制本身的编码开销
+    """
+
+    def __init__(self, recognizer, path, keyframe_interval=300, tile=64, png_level=1):
+        self.recognizer = recognizer
+        self.writer = SessionWriter(path, keyframe_interval, tile, png_level)
+        self.writer.write_meta({
+            'version': VERSION,
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'region': list(recognizer.screen_region) if recognizer.screen_region else None,
+            'templates': recognizer.templates.key,
+            'tile': tile,
+            'options': self._options(recognizer),
+            'match_config': recognizer.match_config,
+        })
+        self.frames = 0
+        self._last_state = None
+        self._process_frame = recognizer.process_frame
+        recognizer.process_frame = self.process_frame
+
+    @staticmethod
+    def _options(recognizer):
+        """影响识别结果的识别器设置（回放时恢复）"""
+        return {attr: getattr(recognizer, attr) for attr in
+                ('layout', 'incremental', 'change_threshold', 'skip_unchanged', 'max_turns', 'edge_routes',
+                 'grid_confidence')}
+
+    def process_frame(self):
+        """调用原 process_frame 并记录本帧"""
+        recognizer = self.recognizer
+        start = time.perf_counter()
+        calibration_frame = self._process_frame()
+        elapsed = time.perf_counter() - start
+        index = self.frames
+        self.frames += 1
+        self.writer.write_frame(index, recognizer.last_frame, time.time())
+        if calibration_frame and recognizer.calibrated:
+            self.writer.write_calibration(index, recognizer.calibration_params())
+        state = recognizer.last_state
+        new_state = state is not None and state is not self._last_state
+        self._last_state = state
+        self.writer.write_result(index, {
+            'calibration_frame': bool(calibration_frame),
+            'calibrated': recognizer.calibrated,
+            'changed': recognizer.frame_changed,
+            'elapsed_ms': round(elapsed * 1000, 3),
+        }, state if new_state else None)
+        return calibration_frame
+
+    def close(self):
+        """恢复原 process_frame 并关闭文件"""
+        self.recognizer.process_frame = self._process_frame
+        self.writer.close()
+
+
+class _FeedSource(FrameSource):
+    """回放时的帧来源：read() 返回最近一次设置的画面"""
+
+    def __init__(self):
+        super().__init__()
+        self.frame = None
+
+    def read(self):
+        return self.frame
+
+
+def replay(path, templates, recorded_calibration=False):
+    """
+    将会话文件的画面按原顺序以最快速度送入新的识别器，并与录制的结果逐帧比较
+    :param templates: 模板特征库
+    :param recorded_calibration: 为 True 时校准帧直接使用录制的校准参数（只比较识别），否则重新校准
+    :return: 每帧一项 [{'frame', 'recorded_ms', 'replay_ms', 'calibration_frame', 'changed': [录制, 回放],
+             'state_diff': 方块类型不同的格子数（一方没有结果时为 -1）,
+             'calibration_diff': {参数: [录制值, 回放值]}}, ...]
+    """
+    source = _FeedSource()
+    recognizer = None
+    reports = []
+    params = None  # 当前帧录制的校准参数
+    recorded_state = None  # 录制的最近一次识别结果
+    for event, index, payload in SessionReader(path):
+        if event == 'meta':
+            if payload.get('templates') != templates.key:
+                print("警告: 模板与录制时不同，识别结果可能不一致", file=sys.stderr)
+            region = tuple(payload['region']) if payload.get('region') else None
+            recognizer = BlockRecognizer(region, templates, frame_source=source, debug_window=NullDebugWindow(),
+                                         match_config=payload.get('match_config'))
+            for attr, value in payload.get('options', {}).items():
+                setattr(recognizer, attr, value)
+            recognizer.use_profiles = False  # 回放不读写校准档案
+        elif event == 'frame':
+            source.frame, params = payload[0], None
+        elif event == 'calibration':
+            params = payload
+        elif event == 'result':
+            # 一帧的记录齐全后再回放，使录制的校准参数可在校准帧直接使用
+            info, state = payload
+            start = time.perf_counter()
+            if recorded_calibration and info['calibration_frame']:
+                calibration_frame = True
+                recognizer.last_frame = source.frame
+                if params is not None:
+                    recognizer.apply_calibration(params)
+                recognizer.change_detector.reset()
+                recognizer.frame_changed = True
+            else:
+                calibration_frame = recognizer.process_frame()
+            report = {'frame': index, 'recorded_ms': info['elapsed_ms'],
+                      'replay_ms': round((time.perf_counter() - start) * 1000, 3),
+                      'calibration_frame': calibration_frame,
+                      'changed': [info['changed'], recognizer.frame_changed]}
+            if params is not None:
+                replayed = recognizer.calibration_params()
+                report['calibration_diff'] = {key: [value, replayed.get(key)] for key, value in params.items()
+                                              if replayed.get(key) != value}
+            if state is not None:
+                recorded_state = state
+            replay_state = recognizer.last_state
+            if recorded_state is None or replay_state is None:
+                report['state_diff'] = 0 if recorded_state is replay_state else -1
+            else:
+                report['state_diff'] = len(recorded_state.diff(replay_state))
+            reports.append(report)
+    return reports
+
+
+def summarize(reports):
+    """回放结果汇总：帧数、结果不一致的帧数、录制与回放耗时的均值和分位数"""
+    mismatched = [r['frame'] for r in reports if r.get('state_diff') or r.get('calibration_diff')
+                  or r.get('changed', [0, 0])[0] != r.get('changed', [0, 0])[1]]
+    summary = {'frames': len(reports), 'mismatched': len(mismatched), 'mismatched_frames': mismatched[:20]}
+    for key in ('recorded_ms', 'replay_ms'):
+        values = np.array([r[key] for r in reports if key in r], dtype=np.float64)
+        if values.size:
+            p50, p90, p99 = np.percentile(values, (50, 90, 99))
+            summary[key] = {'mean': float(values.mean()), 'p50': float(p50), 'p90': float(p90),
+                            'p99': float(p99), 'max': float(values.max())}
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="回放录制的会话文件，比较识别结果并统计逐帧耗时")
+    parser.add_argument("session", help="会话文件（main.py --record 录制）")
+    parser.add_argument("--templates", default="block_templates", help="模板目录")
+    parser.add_argument("--recorded-calibration", action="store_true", help="使用录制的校准参数（不重新校准）")
+    parser.add_argument("--output", help="逐帧结果 JSON lines 输出文件")
+    args = parser.parse_args(argv)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        templates = load_templates(args.templates)
+        reports = replay(args.session, templates, args.recorded_calibration)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in reports))
+    summary = summarize(reports)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if summary['mismatched'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
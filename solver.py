@@ -0,0 +1,158 @@
+import time
+import random
+from collections import Counter
+from pair_finder import PairFinder
+
+class SolveResult:
+    """求解结果及搜索统计"""
+
+    def __init__(self, sequence, total_pairs, nodes, max_depth, tt_probes, tt_hits, elapsed, complete, unpaired=()):
+        self.sequence = sequence  # 找到的最佳消除顺序 [(pos1, pos2), ...]
+        self.total_pairs = total_pairs  # 清空棋盘需要的消除次数
+        self.nodes = nodes  # 搜索节点数
+        self.max_depth = max_depth  # 到达的最大深度
+        self.tt_probes = tt_probes  # 置换表查询次数
+        self.tt_hits = tt_hits  # 置换表命中次数
+        self.elapsed = elapsed  # 搜索耗时（秒）
+        self.complete = complete  # 是否在时间预算内完成了搜索
+        self.unpaired = tuple(unpaired)  # 数量为奇数、无法全部消除的类型（通常是某个方块识别错误）
+
+    @property
+    def cleared(self):
+        """是否找到清空棋盘的完整顺序"""
+        return not self.unpaired and len(self.sequence) == self.total_pairs
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def tt_hit_rate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    def summary(self):
+        """单行统计信息"""
+        return (f"消除 {len(self.sequence)}/{self.total_pairs} 对，深度 {self.max_depth}，"
+                f"节点 {self.nodes}（{self.nodes_per_second:.0f}/秒），"
+                f"置换表命中率 {self.tt_hit_rate:.1%}，耗时 {self.elapsed * 1000:.1f} ms"
+                + (f"，无法清空（数量为奇数: {', '.join(self.unpaired)}）" if self.unpaired else ""))
+
+
+class BoardSolver:
+    """
+    整盘消除求解器：深度优先搜索 + 着法排序 + Zobrist 哈希置换表 + 时间预算
+    以 PairFinder 的消除规则生成着法，默认与 check_elimination 的游戏规则一致（直线或单拐点，不绕行外圈），
+    返回的消除顺序中每一步都是游戏接受的着法
+    """
+
+    def __init__(self, max_turns=1, edge_routes=False, tt_size=200000, seed=0):
+        """
+        :param max_turns: 路径允许的最多拐点数（2 为扩展规则，需显式指定）
+        :param edge_routes: 是否允许路径经过棋盘外圈（扩展规则，需显式指定）
+        :param tt_size: 置换表最大条目数，超出时淘汰最早写入的条目
+        :param seed: Zobrist 随机键的种子
+        """
+        self.max_turns = max_turns
+        self.edge_routes = edge_routes
+        self.tt_size = tt_size
+        self._rng = random.Random(seed)
+
+    def solve(self, state, time_budget=1.0):
+        """
+        搜索完整的消除顺序
+        :param state: 识别结果 BoardState 或字典 {(col, row): {'name': ..., 'coordinate': ...}}
+        :param time_budget: 时间预算（秒）
+        :return: SolveResult，超时返回预算内找到的最长顺序；
+                 有类型数量为奇数时棋盘不可能清空，不做搜索，返回贪心顺序并在 unpaired 中列出这些类型
+        """
+        root = PairFinder(state, self.max_turns, self.edge_routes)
+        total_pairs = sum(len(positions) for positions in root.buckets.values()) // 2
+        unpaired = sorted(name for name, positions in root.buckets.items() if len(positions) % 2)
+        if unpaired:
+            start = time.perf_counter()
+            sequence = self._greedy(root)
+            return SolveResult(sequence, total_pairs, len(sequence) + 1, len(sequence), 0, 0,
+                               time.perf_counter() - start, True, unpaired)
+        # Zobrist 键：每个方块被移除时异或进哈希值
+        self._keys = {pos: self._rng.getrandbits(64) for positions in root.buckets.values() for pos in positions}
+        self._table = {}  # {哈希: 已穷尽搜索、无法清空}
+        self._deadline = time.perf_counter() + time_budget
+        self._best = []
+        self._path = []
+        self._total_pairs = total_pairs
+        self._nodes = self._max_depth = self._probes = self._hits = 0
+        self._timed_out = False
+
+        start = time.perf_counter()
+        self._search(root, 0)
+        elapsed = time.perf_counter() - start
+        return SolveResult(list(self._best), total_pairs, self._nodes, self._max_depth,
+                           self._probes, self._hits, elapsed, not self._timed_out)
+
+    def _greedy(self, finder):
+        """
+        贪心消除：每一步取着法排序后的第一对，直到没有可消除的方块对
+        :return: 消除顺序 [(pos1, pos2), ...]
+        """
+        finder = finder.copy()
+        sequence = []
+        while True:
+            moves = self._order_moves(finder)
+            if not moves:
+                return sequence
+            finder.remove(*moves[0])
+            sequence.append(moves[0])
+
+    def _order_moves(self, finder):
+        """
+        着法排序：剩余数量少的类型优先（只剩两块时只有唯一选择），
+        同类型中靠近棋盘边缘的方块优先，以便尽早打通外圈路径
+        """
+        remaining = Counter({name: len(positions) for name, positions in finder.buckets.items()})
+        pairs = finder.removable_pairs()
+
+        def edge_distance(pair):
+            return sum(min(r, c, len(finder._occ) - 1 - r, len(finder._occ[0]) - 1 - c)
+                       for r, c in (finder._cell(pos) for pos in pair))
+
+        return sorted(pairs, key=lambda pair: (remaining[finder.state.name_at(pair[0])], edge_distance(pair)))
+
+    def _search(self, finder, key):
+        """
+        深度优先搜索
+        :return: 是否找到清空棋盘的顺序
+        """
+        self._nodes += 1
+        depth = len(self._path)
+        if depth > self._max_depth:
+            self._max_depth = depth
+        if depth > len(self._best):
+            self._best = list(self._path)
+        if depth == self._total_pairs:
+            return True
+        if self._nodes & 255 == 0 and time.perf_counter() > self._deadline:
+            self._timed_out = True
+        if self._timed_out:
+            return False
+
+        self._probes += 1
+        if key in self._table:
+            self._hits += 1
+            return False
+
+        for pos1, pos2 in self._order_moves(finder):
+            child = finder.copy()
+            child.remove(pos1, pos2)
+            self._path.append((pos1, pos2))
+            solved = self._search(child, key ^ self._keys[pos1] ^ self._keys[pos2])
+            self._path.pop()
+            if solved:
+                return True
+            if self._timed_out:
+                return False
+
+        # 穷尽搜索仍无法清空，记入置换表
+        if len(self._table) >= self.tt_size:
+            del self._table[next(iter(self._table))]
+        self._table[key] = True
+        return False
@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+
+def generate_board(templates, cols=10, rows=14, block_w=78, block_h=82, h_gap=7, v_gap=3,
+                   margin=(40, 30), none_ratio=0.3, noise=6.0, brightness=10.0, scale_jitter=0.02,
+                   background=(60, 90, 120), seed=0):
+    """
+    用模板合成棋盘画面，并记录每个方块的真实类型
+    非空白方块成对放置，保证每种类型数量为偶数
+    :param templates: 模板字典 {name: image}
+    :param margin: 棋盘四周留白 (横向, 纵向)
+    :param none_ratio: 空白方块（None）所占比例
+    :param noise: 高斯噪声标准差
+    :param brightness: 每个方块亮度偏移的最大幅度
+    :param scale_jitter: 每个方块缩放扰动的最大比例
+    :param background: 背景颜色 (B, G, R)
+    :param seed: 随机种子
+    :return: (画面, 方块列表 [{'col', 'row', 'x', 'y', 'name'}, ...])
+    """
+    rng = np.random.default_rng(seed)
+    names = [name for name in templates if name != "None"]
+    mx, my = margin
+    width = 2 * mx + cols * block_w + (cols - 1) * h_gap
+    height = 2 * my + rows * block_h + (rows - 1) * v_gap
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:] = background
+
+    # 成对分配类型，剩余位置为空白
+    count = cols * rows
+    filled = int(round(count * (1 - none_ratio))) // 2 * 2
+    labels = ["None"] * count
+    pair_types = rng.integers(len(names), size=filled // 2) if names else []
+    for i, k in enumerate(pair_types):
+        labels[2 * i] = labels[2 * i + 1] = names[k]
+    labels = [labels[i] for i in rng.permutation(count)]
+
+    cells = []
+    for i, name in enumerate(labels):
+        row, col = divmod(i, cols)
+        x, y = mx + col * (block_w + h_gap), my + row * (block_h + v_gap)
+        block = _jitter(templates[name], block_w, block_h, rng, brightness, scale_jitter)
+        frame[y:y + block_h, x:x + block_w] = block
+        cells.append({'col': col, 'row': row, 'x': x, 'y': y, 'name': name})
+
+    if noise > 0:
+        noisy = frame.astype(np.float32) + rng.normal(0, noise, frame.shape).astype(np.float32)
+        frame = np.clip(noisy, 0, 255).astype(np.uint8)
+    return frame, cells
+
+
+def _jitter(template, block_w, block_h, rng, brightness, scale_jitter):
+    """对单个模板施加亮度偏移和轻微缩放，输出仍为方块尺寸"""
+    block = cv2.resize(template, (block_w, block_h), interpolation=cv2.INTER_AREA)
+    if scale_jitter > 0:
+        s = 1 + rng.uniform(-scale_jitter, scale_jitter)
+        scaled = cv2.resize(block, None, fx=s, fy=s, interpolation=cv2.INTER_LINEAR)
+        # 以中心对齐，裁剪或用边缘像素填充回原尺寸
+        sh, sw = scaled.shape[:2]
+        top, left = (sh - block_h) // 2, (sw - block_w) // 2
+        if s >= 1:
+            block = scaled[top:top + block_h, left:left + block_w]
+        else:
+            block = cv2.copyMakeBorder(scaled, -top, block_h - sh + top, -left, block_w - sw + left,
+                                       cv2.BORDER_REPLICATE)
+    if brightness > 0:
+        shift = rng.uniform(-brightness, brightness)
+        block = np.clip(block.astype(np.float32) + shift, 0, 255).astype(np.uint8)
+    return block
+
+
+def label_accuracy(positions, cells, tolerance=3):
+    """
+    识别结果与真实类型的一致率（按方块左上角像素位置对应）
+    :param positions: 识别结果 {(col, row): {'name': ..., 'coordinate': ...}}
+    :param cells: generate_board 返回的方块列表
+    :param tolerance: 位置允许的像素误差
+    """
+    if not cells:
+        return 0.0
+    found = {}
+    for value in positions.values():
+        x1, y1 = value['coordinate'][:2]
+        found[(int(x1), int(y1))] = value['name']
+    correct = 0
+    offsets = sorted(((dx, dy) for dx in range(-tolerance, tolerance + 1) for dy in range(-tolerance, tolerance + 1)),
+                     key=lambda o: abs(o[0]) + abs(o[1]))  # 优先取位置最接近的方块
+    for cell in cells:
+        for dx, dy in offsets:
+            name = found.get((cell['x'] + dx, cell['y'] + dy))
+            if name is not None:
+                correct += name == cell['name']
+                break
+    return correct / len(cells)
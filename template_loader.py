@@ -1,29 +1,399 @@
 import os
 import cv2
+import json
+import hashlib
+import threading
+import numpy as np
+import features
+from utils import atomic_write
 
-def load_templates(template_dir):
+TEMPLATE_W, TEMPLATE_H = 78, 82  # 模板尺寸（宽, 高）
+CACHE_DIR = ".cache"  # 特征库缓存目录（位于模板目录下）
+CACHE_VERSION = 1
+PYRAMID_SCALES = (0.75, 0.875, 1.0, 1.125, 1.25, 1.5, 1.75, 2.0)  # 模板金字塔的默认缩放比例
+
+class TemplateBank(dict):
+    """
+    模板特征库：仍是 {name: image} 字典，同时持有预计算好的批量特征
+    - grays: 灰度图 (K, H, W)
+    - hist_vecs: 去均值归一化的颜色直方图 (K, bins^3)
+    - ncc_vecs: 去均值归一化的像素向量 (K, H*W*3)
+    - ssim_mu / ssim_var: SSIM 局部均值和方差 (K, H-6, W-6)
+    scaled(scale) 返回按比例缩放的同一组模板（模板金字塔的一层），各层在内存和磁盘中缓存
+    updated() 返回增删改部分模板后的新特征库（只计算变化模板的特征），原特征库保持不变
+    """
+    ARRAYS = ("images", "grays", "hist_vecs", "ncc_vecs", "ssim_mu", "ssim_var")
+
+    def __init__(self, names, arrays, key=None, scale=1.0, cache_dir=None):
+        """
+        :param scale: 相对原始模板尺寸的缩放比例
+        :param cache_dir: 磁盘缓存目录（金字塔各层缓存在其子目录中），为 None 时只在内存中缓存
+        """
+        self.names = list(names)
+        for attr in self.ARRAYS:
+            setattr(self, attr, arrays[attr])
+        self.key = key
+        self.scale = scale
+        self.cache_dir = cache_dir
+        self._levels = {scale: self}  # 模板金字塔 {缩放比例: 特征库}
+        self._base = self
+        super().__init__(zip(self.names, self.images))
+
+    @property
+    def size(self):
+        """模板尺寸 (高, 宽)"""
+        return self.images.shape[1:3]
+
+    def scaled(self, scale):
+        """
+        模板金字塔中指定缩放比例的一层（以原始尺寸的模板缩放，首次使用时构建并缓存）
+        :param scale: 相对原始模板的缩放比例
+        :return: 特征库 TemplateBank
+        """
+        base = self._base
+        scale = round(float(scale), 4)
+        bank = base._levels.get(scale)
+        if bank is not None:
+            return bank
+
+        key = f"{base.key}@{scale:g}" if base.key else None
+        level_dir = os.path.join(base.cache_dir, f"x{scale:g}") if base.cache_dir else None
+        bank = TemplateBank.load(level_dir, key) if level_dir and key else None
+        if bank is None:
+            bank = TemplateBank.from_images(_resize_templates(dict(zip(base.names, base.images)), scale), key)
+            if level_dir and key:
+                bank._save_cache(level_dir)
+        bank.scale = scale
+        bank._levels = base._levels
+        bank._base = base
+        base._levels[scale] = bank
+        return bank
+
+    def updated(self, templates, removed=(), key=None):
+        """
+        增量更新模板：新特征库中未变化模板的特征直接沿用，只为新增或修改的模板计算特征；
+        已构建的模板金字塔各层同样增量更新。原特征库（及其各层）保持不变，正在使用它的匹配不受影响
+        :param templates: 新增或修改的模板 {name: image}（原始尺寸）
+        :param removed: 删除的模板名
+        :param key: 新模板集的缓存键（有磁盘缓存时写入新的缓存）
+        :return: 原始尺寸的新特征库（金字塔的基础层）
+        """
+        base = self._base
+        bank = base._splice(templates, removed, key)
+        bank.scale = base.scale
+        for scale, level in base._levels.items():
+            if level is base:
+                continue
+            level_key = f"{key}@{scale:g}" if key else None
+            updated = level._splice(_resize_templates(templates, scale, base.size), removed, level_key)
+            updated.scale = scale
+            updated.cache_dir = level.cache_dir
+            updated._levels = bank._levels
+            updated._base = bank
+            bank._levels[scale] = updated
+        if key:
+            for level in bank._levels.values():
+                cache_dir = level.cache_dir if level is not bank else base.cache_dir
+                if cache_dir:
+                    level._save_cache(cache_dir)
+        return bank
+
+    def _splice(self, templates, removed, key):
+        """
+        拼接特征：保留模板的特征按下标复制，新增或修改模板的特征新算；
+        保留模板的顺序不变，新增的模板排在最后
+        """
+        removed = set(removed)
+        names = [name for name in self.names if name not in removed]
+        names += [name for name in templates if name not in self]
+        fresh = TemplateBank.from_images(templates) if templates else None
+        old_rows = [i for i, name in enumerate(names) if name not in templates]
+        new_rows = [i for i, name in enumerate(names) if name in templates]
+        arrays = {}
+        for attr in self.ARRAYS:
+            old = getattr(self, attr)
+            arrays[attr] = out = np.empty((len(names),) + old.shape[1:], dtype=old.dtype)
+            out[old_rows] = old[[self.index(names[i]) for i in old_rows]]
+            if new_rows:
+                out[new_rows] = getattr(fresh, attr)[[fresh.index(names[i]) for i in new_rows]]
+        return TemplateBank(names, arrays, key)
+
+    def _save_cache(self, cache_dir):
+        """写入磁盘缓存并记录缓存目录，失败时只提示"""
+        try:
+            self.save(cache_dir)
+            self.cache_dir = cache_dir
+        except OSError as e:
+            print(f"警告: 无法写入模板缓存 {e}")
+
+    def pyramid(self, scales=PYRAMID_SCALES):
+        """
+        构建（或从缓存读取）模板金字塔
+        :return: {缩放比例: 特征库}
+        """
+        return {scale: self.scaled(scale) for scale in scales}
+
+    @classmethod
+    def from_images(cls, templates, key=None):
+        """
+        从 {name: image} 字典构建特征库
+        :param templates: 模板字典，图像尺寸需一致
+        :param key: 缓存键
+        """
+        names = list(templates.keys())
+        images = np.stack([templates[name] for name in names])
+        grays = features.to_gray(images)
+        ssim_mu, ssim_var = features.ssim_stats(grays)
+        arrays = {
+            "images": images,
+            "grays": grays,
+            "hist_vecs": features.normalize_rows(features.color_histograms(images)),
+            "ncc_vecs": features.ncc_vectors(images),
+            "ssim_mu": ssim_mu,
+            "ssim_var": ssim_var,
+        }
+        return cls(names, arrays, key)
+
+    def index(self, name):
+        """模板名对应的特征下标"""
+        return self.names.index(name)
+
+    def save(self, cache_dir):
+        """
+        将特征库写入缓存目录
+        已有的缓存可能正被其他特征库内存映射（如模板热更新前的特征库），数组先写入临时文件再整体替换，
+        不改写被映射的文件；写入前先删除元数据，替换失败（Windows 上被映射的文件不能替换）时缓存失效而不是错配。
+        临时文件名每次唯一，多个进程同时写入同一缓存目录时互不截断
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_path = os.path.join(cache_dir, "meta.json")
+        try:
+            os.remove(meta_path)
+        except FileNotFoundError:
+            pass
+        for attr in self.ARRAYS:
+            atomic_write(os.path.join(cache_dir, f"{attr}.npy"), lambda f: np.save(f, getattr(self, attr)))
+        meta = {"version": CACHE_VERSION, "key": self.key, "names": self.names}
+        # 元数据最后写入，保证中断时不会留下看似有效的缓存
+        atomic_write(meta_path, lambda f: json.dump(meta, f, ensure_ascii=False), "w")
+
+    @classmethod
+    def load(cls, cache_dir, key):
+        """
+        从缓存目录读取特征库（数组以只读方式内存映射，按需从磁盘分页读取，不整体解码）
+        :return: 特征库，缓存缺失或键不匹配时返回 None
+        """
+        try:
+            with open(os.path.join(cache_dir, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != CACHE_VERSION or meta.get("key") != key:
+                return None
+            arrays = {attr: np.asarray(np.load(os.path.join(cache_dir, f"{attr}.npy"), mmap_mode="r"))
+                      for attr in cls.ARRAYS}
+        except (OSError, ValueError):
+            return None
+        return cls(meta["names"], arrays, key, cache_dir=cache_dir)
+
+
+def _template_files(template_dir):
+    """模板目录下按文件名排序的 PNG 列表"""
+    return sorted(f for f in os.listdir(template_dir) if f.endswith(".png"))
+
+
+def _file_digest(path):
+    """模板文件的内容哈希"""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).digest()
+
+
+def _combine_key(digests):
+    """
+    由各模板文件的内容哈希生成缓存键
+    :param digests: [(文件名, 内容哈希), ...]，按文件名排序
+    """
+    digest = hashlib.sha1()
+    for filename, file_digest in digests:
+        digest.update(filename.encode("utf-8"))
+        digest.update(file_digest)
+    return digest.hexdigest()
+
+
+def _content_key(template_dir, filenames):
+    """根据模板文件名和内容哈希生成缓存键"""
+    return _combine_key((filename, _file_digest(os.path.join(template_dir, filename))) for filename in filenames)
+
+
+def _read_template(img_path):
+    """
+    读取一张模板图片并缩放到模板尺寸
+    :return: 彩色图像，无法读取时返回 None
     """
-    加载模板图片并确保尺寸一致
+    img = cv2.imread(img_path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    # 确保模板尺寸正确
+    if img.shape[:2] != (TEMPLATE_H, TEMPLATE_W):  # 高度82，宽度78
+        img = cv2.resize(img, (TEMPLATE_W, TEMPLATE_H), interpolation=cv2.INTER_AREA)
+    return img
+
+
+def _resize_templates(templates, scale, size=(TEMPLATE_H, TEMPLATE_W)):
+    """
+    按比例缩放一组模板（模板金字塔的一层）
+    :param templates: {name: image}，原始尺寸
+    :param size: 原始模板尺寸 (高, 宽)
+    """
+    h, w = size
+    target = (max(8, int(round(w * scale))), max(8, int(round(h * scale))))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return {name: cv2.resize(img, target, interpolation=interpolation) for name, img in templates.items()}
+
+
+def load_templates(template_dir, use_cache=True, scales=()):
+    """
+    加载模板图片并确保尺寸一致，返回预计算好的特征库
     :param template_dir: 模板图片目录
-    :return: 模板字典 {name: image}
+    :param use_cache: 是否读写磁盘缓存（模板文件未变化时跳过解码和特征提取）
+    :param scales: 预先构建的模板金字塔缩放比例（其余比例在 scaled() 首次使用时构建）
+    :return: 模板特征库 TemplateBank（兼容 {name: image} 字典）
     """
+    filenames = _template_files(template_dir)
+    key = _content_key(template_dir, filenames)
+    cache_dir = os.path.join(template_dir, CACHE_DIR)
+
+    if use_cache:
+        bank = TemplateBank.load(cache_dir, key)
+        if bank is not None:
+            print(f"加载了 {len(bank)} 个模板（缓存）")
+            bank.pyramid(scales)
+            return bank
+
     templates = {}
-    for filename in os.listdir(template_dir):
-        if filename.endswith(".png"):
-            name = os.path.splitext(filename)[0]
-            img_path = os.path.join(template_dir, filename)
+    for filename in filenames:
+        name = os.path.splitext(filename)[0]
+        img = _read_template(os.path.join(template_dir, filename))
+        if img is None:
+            print(f"警告: 无法加载模板图片 {filename}")
+            continue
+        templates[name] = img
+
+    print(f"加载了 {len(templates)} 个模板")
+    if not templates:
+        return templates
+
+    bank = TemplateBank.from_images(templates, key)
+    if use_cache:
+        bank.cache_dir = cache_dir
+        try:
+            bank.save(cache_dir)
+        except OSError as e:
+            print(f"警告: 无法写入模板缓存 {e}")
+    bank.pyramid(scales)
+    return bank
+
 
-            # 读取彩色图像
-            img = cv2.imread(img_path, cv2.IMREAD_COLOR)
+class TemplateWatcher:
+    """
+    模板目录热更新：定期检查目录中 PNG 的修改时间和大小，有变化的文件再比较内容哈希确认
+    （只有修改时间变化、内容相同的文件不算修改）；确认有增删改时只解码变化的模板，
+    用 TemplateBank.updated 增量建立新特征库，建好后才交给回调，使用者整体替换引用
+    """
+
+    def __init__(self, template_dir, bank, interval=1.0):
+        """
+        :param template_dir: 模板图片目录
+        :param bank: 当前使用的模板特征库（load_templates 的结果）
+        :param interval: 后台检查间隔（秒）
+        """
+        self.template_dir = template_dir
+        self.bank = bank._base
+        self.interval = interval
+        self._files = {}  # {文件名: (修改时间 ns, 大小, 内容哈希)}，与 bank 对应
+        for filename, st in self._scan().items():
+            self._files[filename] = (st.st_mtime_ns, st.st_size, _file_digest(os.path.join(template_dir, filename)))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _scan(self):
+        """目录中的 PNG {文件名: stat}"""
+        with os.scandir(self.template_dir) as entries:
+            return {e.name: e.stat() for e in entries if e.name.endswith(".png") and e.is_file()}
+
+    def poll(self):
+        """
+        检查一次模板目录，有变化时更新 bank
+        写到一半的文件（无法解码）保持原状态，下次检查时重试
+        :return: 变化的模板名 {'added': [...], 'changed': [...], 'removed': [...]}，没有变化时返回 None
+        """
+        try:
+            entries = self._scan()
+        except OSError:
+            return None
+        files, touched = {}, []
+        for filename, st in entries.items():
+            old = self._files.get(filename)
+            if old is not None and old[:2] == (st.st_mtime_ns, st.st_size):
+                files[filename] = old
+                continue
+            try:
+                digest = _file_digest(os.path.join(self.template_dir, filename))
+            except OSError:
+                if old is not None:
+                    files[filename] = old
+                continue
+            files[filename] = (st.st_mtime_ns, st.st_size, digest)
+            if old is None or old[2] != digest:
+                touched.append(filename)
+
+        templates, changes = {}, {'added': [], 'changed': [], 'removed': []}
+        for filename in touched:
+            img = _read_template(os.path.join(self.template_dir, filename))
             if img is None:
-                print(f"警告: 无法加载模板图片 {filename}")
+                if filename in self._files:
+                    files[filename] = self._files[filename]
+                else:
+                    del files[filename]
                 continue
+            name = os.path.splitext(filename)[0]
+            templates[name] = img
+            changes['changed' if filename in self._files else 'added'].append(name)
+        changes['removed'] = [os.path.splitext(f)[0] for f in self._files if f not in files]
 
-            # 确保模板尺寸正确
-            if img.shape[:2] != (82, 78):  # 高度82，宽度78
-                img = cv2.resize(img, (78, 82), interpolation=cv2.INTER_AREA)
+        if not templates and not changes['removed']:
+            self._files = files
+            return None
+        if not files:
+            return None  # 模板被全部移走（如整体替换目录内容的中途），保留当前模板
+        key = _combine_key((filename, files[filename][2]) for filename in sorted(files))
+        self.bank = self.bank.updated(templates, changes['removed'], key)
+        self._files = files
+        print(f"模板已更新: 新增 {changes['added']} 修改 {changes['changed']} 删除 {changes['removed']}")
+        return changes
 
-            templates[name] = img
+    def start(self, callback):
+        """
+        在后台线程中定期检查
+        :param callback: 有变化时调用 callback(新特征库, 变化的模板名)
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch_loop, args=(callback,), daemon=True)
+        self._thread.start()
 
-    print(f"加载了 {len(templates)} 个模板")
-    return templates
\ No newline at end of file
+    def _watch_loop(self, callback):
+        while not self._stop.wait(self.interval):
+            try:
+                changes = self.poll()
+            except Exception as e:  # 单个模板出错不应中止监视
+                print(f"警告: 模板更新失败 {e}")
+                continue
+            if changes:
+                callback(self.bank, changes)
+
+    def stop(self):
+        """停止后台检查"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
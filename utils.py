@@ -1,6 +1,81 @@
-import winreg
+import os
+import platform
+import tempfile
+import functools
+import subprocess
 
+@functools.lru_cache(maxsize=None)
 def get_scaling_factor():
-    with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Control Panel\Desktop\WindowMetrics") as key:
-        value = winreg.QueryValueEx(key, "AppliedDPI")[0]
-        return value / 96
\ No newline at end of file
+    """
+    获取系统缩放比例
+    - Windows: 注册表中的 AppliedDPI / 96
+    - macOS: 主屏幕的 backingScaleFactor（需要 pyobjc，未安装时为 1.0）
+    - Linux: GDK_SCALE × GDK_DPI_SCALE、QT_SCALE_FACTOR 环境变量，其次为 X 资源 Xft.dpi / 96
+    无法读取时返回 1.0；结果在进程内缓存（Linux 下读取 X 资源需要启动 xrdb 子进程）
+    """
+    system = platform.system()
+    if system == "Windows":
+        return _windows_scaling_factor()
+    if system == "Darwin":
+        return _macos_scaling_factor()
+    return _linux_scaling_factor()
+
+
+def atomic_write(path, write, mode="wb"):
+    """
+    写入文件并整体替换：先写入同目录下本进程独有的临时文件，再 os.replace 到目标路径
+    多个进程同时写同一文件时互不截断，读取方只会看到完整的旧文件或新文件
+    :param write: 写入函数 write(f)
+    :param mode: 打开临时文件的模式（"wb" 或 "w"，文本模式使用 UTF-8）
+    """
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory or ".")
+    try:
+        with open(fd, mode, **({} if "b" in mode else {'encoding': "utf-8"})) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _windows_scaling_factor():
+    try:
+        import winreg
+        with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Control Panel\Desktop\WindowMetrics") as key:
+            value = winreg.QueryValueEx(key, "AppliedDPI")[0]
+        return value / 96
+    except (ImportError, OSError):
+        return 1.0
+
+
+def _macos_scaling_factor():
+    try:
+        from AppKit import NSScreen
+        return float(NSScreen.mainScreen().backingScaleFactor())
+    except (ImportError, AttributeError):
+        return 1.0
+
+
+def _linux_scaling_factor():
+    try:
+        gdk = float(os.environ.get("GDK_SCALE", 1)) * float(os.environ.get("GDK_DPI_SCALE", 1))
+        qt = float(os.environ.get("QT_SCALE_FACTOR", 1))
+    except ValueError:
+        gdk = qt = 1.0
+    if gdk != 1.0 or qt != 1.0:
+        return gdk if gdk != 1.0 else qt
+    try:
+        output = subprocess.run(["xrdb", "-query"], capture_output=True, text=True, timeout=1).stdout
+    except (OSError, subprocess.SubprocessError):
+        return 1.0
+    for line in output.splitlines():
+        if line.startswith("Xft.dpi:"):
+            try:
+                return float(line.split(":", 1)[1]) / 96
+            except ValueError:
+                break
+    return 1.0